@@ -1,24 +1,334 @@
-import shutil
+import argparse
 import datetime
+import gzip
+import json
+import logging
 import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from sqlalchemy.engine import make_url
+
+from . import metrics
+from .database import SQLALCHEMY_DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# Online SQLite backups: python -m backend.backup_db backup (cron/Task Scheduler) or
+# python -m backend.backup_db schedule (long-running loop). Pages are copied with SQLite's
+# backup API in steps of BACKUP_PAGES_PER_STEP, each step a short read transaction, so the
+# copy is consistent and writers keep going (in WAL mode readers never block them). The copy is
+# gzip-compressed into BACKUP_DIR and old backups are pruned by the retention settings.
+BACKUP_DIR = os.getenv("BACKUP_DIR", str(Path(__file__).resolve().parent / "backups"))
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "1024"))
+# Pause between steps; gives writers a window in rollback-journal mode (not needed with WAL)
+BACKUP_STEP_PAUSE_MS = int(os.getenv("BACKUP_STEP_PAUSE_MS", "0"))
+# A write from another connection restarts a stepped backup; after this many restarts the
+# remaining copy is done in one step (one read transaction) so that busy databases still finish
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3"))
+BACKUP_GZIP_LEVEL = int(os.getenv("BACKUP_GZIP_LEVEL", "6"))
+# Retention: the newest BACKUP_KEEP_LAST backups, plus the newest backup of each of the last
+# BACKUP_KEEP_DAILY days and of each of the last BACKUP_KEEP_WEEKLY weeks
+BACKUP_KEEP_LAST = int(os.getenv("BACKUP_KEEP_LAST", "7"))
+BACKUP_KEEP_DAILY = int(os.getenv("BACKUP_KEEP_DAILY", "14"))
+BACKUP_KEEP_WEEKLY = int(os.getenv("BACKUP_KEEP_WEEKLY", "8"))
+BACKUP_INTERVAL_SECONDS = int(os.getenv("BACKUP_INTERVAL_SECONDS", str(24 * 3600)))
+
+CHUNK_SIZE = 1024 * 1024
+STATUS_FILE = "backup_status.json"
+# sql_app_backup_20240101_120000.db[.gz]; uncompressed files are backups made by the old script
+BACKUP_NAME = re.compile(r"^sql_app_backup_(\d{8}_\d{6})\.db(\.gz)?$")
+TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+
+class BackupError(Exception):
+    pass
+
+class _TooManyRestarts(Exception):
+    pass
 
-DATABASE_PATH = "./sql_app.db"
-BACKUP_DIR = "./backups"
+@dataclass
+class BackupFile:
+    path: str
+    created: datetime.datetime
 
-def backup_database():
-    if not os.path.exists(BACKUP_DIR):
-        os.makedirs(BACKUP_DIR)
+@dataclass
+class BackupResult:
+    path: str
+    source_bytes: int
+    size: int
+    seconds: float
+    restarts: int
 
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_filename = f"sql_app_backup_{timestamp}.db"
-    backup_path = os.path.join(BACKUP_DIR, backup_filename)
+def database_path(url: str = SQLALCHEMY_DATABASE_URL) -> str:
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        raise BackupError("Only file SQLite databases can be backed up here; use pg_dump for PostgreSQL")
+    return url.database
 
+def _copy_pages(source: sqlite3.Connection, target: sqlite3.Connection, pages: int, pause: float, max_restarts: int) -> int:
+    restarts = 0
+    previous = [None]
+
+    def progress(status, remaining, total):
+        nonlocal restarts
+        # More pages left than after the previous step: another connection wrote and the copy started over
+        if previous[0] is not None and remaining > previous[0]:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _TooManyRestarts()
+        previous[0] = remaining
+        if pause and remaining:
+            time.sleep(pause)
+
+    try:
+        source.backup(target, pages=pages, progress=progress)
+    except _TooManyRestarts:
+        logger.warning("Backup restarted %d times by concurrent writes; copying in one step", restarts)
+        source.backup(target, pages=-1)
+    return restarts
+
+def _compress(path: str, destination: str, level: int = BACKUP_GZIP_LEVEL) -> None:
+    tmp_path = destination + ".tmp"
     try:
-        shutil.copyfile(DATABASE_PATH, backup_path)
-        print(f"Database backup successful: {backup_path}")
+        with open(path, "rb") as f, gzip.open(tmp_path, "wb", compresslevel=level) as gz:
+            shutil.copyfileobj(f, gz, CHUNK_SIZE)
+        os.replace(tmp_path, destination)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def backup_database(source: Optional[str] = None, directory: str = BACKUP_DIR, pages: int = BACKUP_PAGES_PER_STEP,
+                    pause_ms: int = BACKUP_STEP_PAUSE_MS, max_restarts: int = BACKUP_MAX_RESTARTS,
+                    now: Optional[datetime.datetime] = None) -> BackupResult:
+    """Copies the live database into directory as sql_app_backup_<timestamp>.db.gz."""
+    source = source or database_path()
+    if not os.path.exists(source):
+        raise BackupError(f"Database {source} does not exist")
+    os.makedirs(directory, exist_ok=True)
+    start = time.perf_counter()
+    name = f"sql_app_backup_{(now or datetime.datetime.now()).strftime(TIMESTAMP_FORMAT)}.db.gz"
+    destination = os.path.join(directory, name)
+    # Uncompressed copy next to the result (same filesystem), removed once compressed
+    copy_path = os.path.join(directory, f".{name}.{os.getpid()}.db")
+    try:
+        src = sqlite3.connect(source, timeout=30)
+        dst = sqlite3.connect(copy_path)
+        try:
+            restarts = _copy_pages(src, dst, pages, pause_ms / 1000, max_restarts)
+        finally:
+            dst.close()
+            src.close()
+        source_bytes = os.path.getsize(copy_path)
+        _compress(copy_path, destination)
     except Exception as e:
-        print(f"Database backup failed: {e}")
+        _write_status(directory, failed=True)
+        raise BackupError(f"Backup of {source} failed: {e}") from e
+    finally:
+        if os.path.exists(copy_path):
+            os.remove(copy_path)
+    result = BackupResult(destination, source_bytes, os.path.getsize(destination), time.perf_counter() - start, restarts)
+    _write_status(directory, result=result)
+    logger.info("Database backup %s: %d -> %d bytes in %.2fs", destination, result.source_bytes, result.size, result.seconds)
+    return result
+
+def list_backups(directory: str = BACKUP_DIR) -> List[BackupFile]:
+    """Backups in directory, newest first."""
+    backups = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            match = BACKUP_NAME.match(name)
+            if match:
+                created = datetime.datetime.strptime(match.group(1), TIMESTAMP_FORMAT)
+                backups.append(BackupFile(os.path.join(directory, name), created))
+    return sorted(backups, key=lambda b: b.created, reverse=True)
+
+def select_expired(backups: List[BackupFile], keep_last: int = BACKUP_KEEP_LAST, keep_daily: int = BACKUP_KEEP_DAILY,
+                   keep_weekly: int = BACKUP_KEEP_WEEKLY) -> List[BackupFile]:
+    """The backups (newest first) that no retention rule keeps."""
+    kept = set(range(min(keep_last, len(backups))))
+    for keep, period in ((keep_daily, lambda d: d.date()), (keep_weekly, lambda d: d.isocalendar()[:2])):
+        periods = []
+        for index, backup in enumerate(backups):
+            key = period(backup.created)
+            if key not in periods:
+                if len(periods) == keep:
+                    break
+                periods.append(key)
+                kept.add(index)
+    return [backup for index, backup in enumerate(backups) if index not in kept]
+
+def prune_backups(directory: str = BACKUP_DIR, **keep) -> List[str]:
+    removed = []
+    for backup in select_expired(list_backups(directory), **keep):
+        os.remove(backup.path)
+        removed.append(backup.path)
+    return removed
+
+def _decompress(path: str, destination: str) -> None:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f, open(destination, "wb") as out:
+        shutil.copyfileobj(f, out, CHUNK_SIZE)
+
+def check_database(path: str) -> List[str]:
+    """Problems found in an SQLite file: integrity_check output, or a missing schema version."""
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        problems = [row[0] for row in connection.execute("PRAGMA integrity_check") if row[0] != "ok"]
+        if not problems and connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'alembic_version'").fetchone() is None:
+            problems.append("no alembic_version table: not an application database")
+        return problems
+    except sqlite3.DatabaseError as e:
+        return [str(e)]
+    finally:
+        connection.close()
+
+def verify_backup(path: str) -> List[str]:
+    """Decompresses the backup into a temporary file and checks it; empty list when it is usable."""
+    with tempfile.TemporaryDirectory() as tmp:
+        restored = os.path.join(tmp, "restore.db")
+        try:
+            _decompress(path, restored)
+        except (OSError, EOFError) as e:
+            return [f"cannot decompress: {e}"]
+        return check_database(restored)
+
+def restore_backup(path: str, target: str, force: bool = False) -> None:
+    """
+    Replaces target with the backup after checking it. Stop the application first: open
+    connections would keep using the old file.
+    """
+    if os.path.exists(target) and not force:
+        raise BackupError(f"{target} exists; pass --force to replace it")
+    tmp_path = f"{target}.restore-{os.getpid()}"
+    try:
+        try:
+            _decompress(path, tmp_path)
+        except (OSError, EOFError) as e:
+            raise BackupError(f"Cannot decompress {path}: {e}") from e
+        problems = check_database(tmp_path)
+        if problems:
+            raise BackupError(f"{path} failed verification: {'; '.join(problems[:5])}")
+        # WAL/shared-memory files of the replaced database must not be applied to the restored one
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(target + suffix):
+                os.remove(target + suffix)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+# Status of the last runs, kept in BACKUP_DIR so that /metrics of the API processes can report
+# backups made by cron or the schedule process
+def _read_status(directory: str = BACKUP_DIR) -> dict:
+    try:
+        with open(os.path.join(directory, STATUS_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_status(directory: str, result: Optional[BackupResult] = None, failed: bool = False) -> None:
+    status = _read_status(directory)
+    if failed:
+        status.update(last_failure=time.time(), failures=status.get("failures", 0) + 1)
+    else:
+        status.update(
+            last_success=time.time(), last_duration_seconds=round(result.seconds, 3),
+            last_size_bytes=result.size, last_source_bytes=result.source_bytes, last_restarts=result.restarts,
+        )
+    tmp_path = os.path.join(directory, STATUS_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(status, f)
+    os.replace(tmp_path, os.path.join(directory, STATUS_FILE))
+
+def _status_value(key: str):
+    return lambda: _read_status().get(key, 0)
+
+def register_metrics() -> None:
+    # Backup state as seen by the API process, read from the status file the backup job writes
+    for key, name, doc, kind in (
+        ("last_success", "backup_last_success_timestamp_seconds", "Unix time of the last successful database backup", "gauge"),
+        ("last_duration_seconds", "backup_last_duration_seconds", "Duration of the last successful database backup", "gauge"),
+        ("last_size_bytes", "backup_last_size_bytes", "Compressed size of the last database backup", "gauge"),
+        ("last_source_bytes", "backup_last_source_bytes", "Database size at the last backup", "gauge"),
+        ("failures", "backup_failures_total", "Failed database backups", "counter"),
+    ):
+        metrics.REGISTRY.register(metrics.CallbackMetric(name, doc, _status_value(key), kind=kind))
+    metrics.REGISTRY.register(metrics.CallbackMetric("backup_files", "Database backups kept in BACKUP_DIR", lambda: len(list_backups())))
+
+def run_schedule(interval: float = BACKUP_INTERVAL_SECONDS, directory: str = BACKUP_DIR, runs: Optional[int] = None) -> None:
+    """Backs up and prunes every interval seconds (runs: stop after that many, for tests)."""
+    count = 0
+    while runs is None or count < runs:
+        started = time.monotonic()
+        try:
+            backup_database(directory=directory)
+            prune_backups(directory)
+        except BackupError as e:
+            logger.error("%s", e)
+        count += 1
+        if runs is None or count < runs:
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+def _latest(directory: str) -> str:
+    backups = list_backups(directory)
+    if not backups:
+        raise BackupError(f"No backups in {directory}")
+    return backups[0].path
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Online SQLite backups: create, prune, verify, restore")
+    parser.add_argument("command", choices=["backup", "prune", "verify", "restore", "schedule", "list"], nargs="?", default="backup")
+    parser.add_argument("file", nargs="?", help="verify/restore: backup file (default: the newest)")
+    parser.add_argument("--dir", default=BACKUP_DIR, help="Backup directory")
+    parser.add_argument("--verify", action="store_true", help="backup: check the new backup after writing it")
+    parser.add_argument("--target", help="restore: database file to replace (default: the configured database)")
+    parser.add_argument("--force", action="store_true", help="restore: replace an existing database")
+    parser.add_argument("--interval", type=float, default=BACKUP_INTERVAL_SECONDS, help="schedule: seconds between backups")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "backup":
+            result = backup_database(directory=args.dir)
+            print(f"Database backup successful: {result.path} ({result.source_bytes} -> {result.size} bytes, {result.seconds:.2f}s)")
+            for path in prune_backups(args.dir):
+                print(f"Removed old backup {path}")
+            if args.verify:
+                problems = verify_backup(result.path)
+                for problem in problems:
+                    print(problem)
+                return 1 if problems else 0
+        elif args.command == "prune":
+            for path in prune_backups(args.dir):
+                print(f"Removed old backup {path}")
+        elif args.command == "list":
+            for backup in list_backups(args.dir):
+                print(f"{backup.created:%Y-%m-%d %H:%M:%S}  {os.path.getsize(backup.path):>12}  {backup.path}")
+        elif args.command == "verify":
+            path = args.file or _latest(args.dir)
+            problems = verify_backup(path)
+            for problem in problems:
+                print(problem)
+            print(f"{path}: {'OK' if not problems else 'FAILED'}")
+            return 1 if problems else 0
+        elif args.command == "restore":
+            path = args.file or _latest(args.dir)
+            target = args.target or database_path()
+            restore_backup(path, target, force=args.force)
+            print(f"Restored {path} to {target}")
+        else:
+            logging.basicConfig(level=logging.INFO)
+            run_schedule(args.interval, args.dir)
+    except BackupError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
 
 if __name__ == "__main__":
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
-    backup_database()
+    sys.exit(main())
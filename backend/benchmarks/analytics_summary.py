@@ -0,0 +1,97 @@
+"""Benchmark for /reports/analytics/summary aggregation.
+
+Compares crud.get_defect_summary, which reads the analytics rollup tables, with the
+original approach of loading every Defect and counting in Python.
+
+    python -m backend.benchmarks.analytics_summary --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from backend import crud, models, rollups, schemas
+from backend.database import Base
+
+STATUSES = [s.value for s in schemas.DefectStatus]
+PRIORITIES = [p.value for p in schemas.DefectPriority]
+
+def populate(session, size: int, projects: int = 200):
+    session.execute(insert(models.User), [{"username": "bench", "email": "bench@example.com", "hashed_password": "x", "role": "manager"}])
+    session.execute(insert(models.Project), [{"title": f"Project {i}", "owner_id": 1} for i in range(projects)])
+    now = datetime.now()
+    batch = []
+    for i in range(size):
+        batch.append({
+            "title": f"Defect {i}",
+            "priority": random.choice(PRIORITIES),
+            "status": random.choice(STATUSES),
+            "created_at": now - timedelta(days=random.randint(0, 365)),
+            "due_date": now + timedelta(days=random.randint(-60, 60)),
+            "reporter_id": 1,
+            "project_id": random.randint(1, projects),
+        })
+        if len(batch) == 10000:
+            session.execute(insert(models.Defect), batch)
+            batch = []
+    if batch:
+        session.execute(insert(models.Defect), batch)
+    # Raw inserts bypass crud, so fill the rollups the way migration 0004 does
+    rollups.rebuild(session)
+    session.commit()
+
+def legacy_summary(session, now: datetime):
+    defects = session.query(models.Defect).all()
+    done = [schemas.DefectStatus.closed, schemas.DefectStatus.cancelled]
+    overdue = sum(1 for d in defects if d.due_date and d.due_date < now and d.status not in done)
+    completed = sum(1 for d in defects if d.status in done)
+    active = len({d.project_id for d in defects if d.status not in done})
+    return len(defects), overdue, completed, active
+
+def measure(fn, session, repeat: int):
+    best = float("inf")
+    tracemalloc.start()
+    for _ in range(repeat):
+        session.expunge_all()
+        start = time.perf_counter()
+        result = fn(session)
+        best = min(best, time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return tuple(result), best, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-legacy-above", type=int, default=200000, help="do not run the ORM loop above this many rows")
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'rollup ms':>13} {'rollup peak KB':>18} {'legacy ms':>10} {'legacy peak KB':>15}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+            Base.metadata.create_all(bind=engine)
+            session = sessionmaker(bind=engine)()
+            populate(session, size)
+
+            # One instant for both sides, so the overdue counts are comparable
+            now = datetime.now()
+            summary, agg_time, agg_peak = measure(lambda s: crud.get_defect_summary(s, now=now), session, args.repeat)
+            legacy_cols = ("-", "-")
+            if size <= args.skip_legacy_above:
+                legacy, legacy_time, legacy_peak = measure(lambda s: legacy_summary(s, now), session, 1)
+                assert legacy == summary, (legacy, summary)
+                legacy_cols = (f"{legacy_time * 1000:.1f}", f"{legacy_peak // 1024}")
+            print(f"{size:>9} {agg_time * 1000:>13.1f} {agg_peak // 1024:>18} {legacy_cols[0]:>10} {legacy_cols[1]:>15}")
+            session.close()
+            engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark for attachment downloads served by uvicorn.
+
+Downloads one file in full with Starlette's default FileResponse (64 KiB reads) and with
+downloads.AttachmentFileResponse (DOWNLOAD_CHUNK_SIZE reads), then times a resumed download
+(Range: bytes=<half>-) and a repeat view answered with 304.
+
+    python -m backend.benchmarks.attachment_download --size-mb 200
+"""
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from starlette.responses import FileResponse
+
+from backend import downloads
+
+def make_app(path: str, sha256: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/default")
+    def default():
+        return FileResponse(path, filename="file.bin")
+
+    @app.get("/attachment")
+    def attachment(request: Request):
+        return downloads.attachment_response(request, path, "file.bin", "application/octet-stream", sha256)
+
+    return app
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def download(client: httpx.Client, url: str, headers=None):
+    start = time.perf_counter()
+    received = 0
+    with client.stream("GET", url, headers=headers) as r:
+        for chunk in r.iter_raw(1024 * 1024):
+            received += len(chunk)
+    return time.perf_counter() - start, received, r.status_code
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "file.bin")
+        with open(path, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        sha256 = "0" * 64
+        port = free_port()
+        server = uvicorn.Server(uvicorn.Config(make_app(path, sha256), port=port, log_level="warning", access_log=False))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+
+        base = f"http://127.0.0.1:{port}"
+        best = {"default": float("inf"), "attachment": float("inf")}
+        with httpx.Client(timeout=60) as client:
+            # Interleaved rounds, best of each: the numbers are noisy on small machines
+            for _ in range(args.repeat):
+                for name in best:
+                    seconds, received, _ = download(client, f"{base}/{name}")
+                    assert received == args.size_mb * 1024 * 1024
+                    best[name] = min(best[name], seconds)
+            for name, seconds in best.items():
+                print(f"full download  {name:10} {seconds * 1000:8.1f} ms  {args.size_mb / seconds:8.1f} MB/s")
+
+            half = args.size_mb * 1024 * 1024 // 2
+            seconds, received, status = download(client, f"{base}/attachment", {"Range": f"bytes={half}-"})
+            print(f"resume         attachment {seconds * 1000:8.1f} ms  status {status}, {received} bytes")
+            not_modified = min(download(client, f"{base}/attachment", {"If-None-Match": f'"{sha256}"'})[0] for _ in range(20))
+            print(f"repeat view    attachment {not_modified * 1000:8.1f} ms  status 304, 0 bytes")
+
+        server.should_exit = True
+        thread.join()
+
+if __name__ == "__main__":
+    main()
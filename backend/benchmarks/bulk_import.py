@@ -0,0 +1,57 @@
+"""Benchmark: crud.bulk_create_defects vs one crud.create_defect call per row.
+
+    python -m backend.benchmarks.bulk_import --rows 100000 --single-rows 2000
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from backend import crud, models, schemas
+from backend.database import Base, create_db_engine
+
+def make_rows(count: int):
+    return [
+        {"title": f"Imported defect {i}", "description": "Bulk import", "priority": "Средний", "project_id": 1 + i % 10}
+        for i in range(count)
+    ]
+
+def fresh_session(tmp: str, name: str):
+    engine = create_db_engine(f"sqlite:///{Path(tmp) / name}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    session.execute(insert(models.User), [{"username": "bench", "email": "bench@example.com", "hashed_password": "x", "role": "manager"}])
+    session.execute(insert(models.Project), [{"title": f"Project {i}", "owner_id": 1} for i in range(10)])
+    session.commit()
+    return session
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--single-rows", type=int, default=2000, help="rows for the per-row baseline")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        session = fresh_session(tmp, "bulk.db")
+        start = time.perf_counter()
+        result = crud.bulk_create_defects(session, enumerate(make_rows(args.rows), start=1), reporter_id=1)
+        bulk_time = time.perf_counter() - start
+        assert result.created == args.rows, result.failed
+        session.close()
+
+        session = fresh_session(tmp, "single.db")
+        start = time.perf_counter()
+        for row in make_rows(args.single_rows):
+            crud.create_defect(session, defect=schemas.DefectCreate(**row), reporter_id=1)
+        single_time = time.perf_counter() - start
+        session.close()
+
+    print(f"{'method':>8} {'rows':>8} {'seconds':>8} {'rows/s':>9}")
+    print(f"{'bulk':>8} {args.rows:>8} {bulk_time:>8.2f} {args.rows / bulk_time:>9.0f}")
+    print(f"{'per-row':>8} {args.single_rows:>8} {single_time:>8.2f} {args.single_rows / single_time:>9.0f}")
+
+if __name__ == "__main__":
+    main()
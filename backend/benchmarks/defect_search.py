@@ -0,0 +1,77 @@
+"""Benchmark for defect search: FTS5 index vs LIKE '%...%'.
+
+The generated descriptions draw from a 20-word vocabulary, so word terms match most
+rows (worst case for ranked search); numeric terms are selective.
+
+    python -m backend.benchmarks.defect_search --sizes 100000 1000000
+"""
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, insert, or_
+from sqlalchemy.orm import sessionmaker
+
+from backend import crud, models
+from backend.database import Base
+
+WORDS = ("трещина стена кровля протечка плитка скол фасад окно дверь перекрытие арматура бетон "
+         "штукатурка кабель щиток насос труба отопление вентиляция лестница").split()
+
+def populate(session, size: int):
+    session.execute(insert(models.User), [{"username": "bench", "email": "bench@example.com", "hashed_password": "x", "role": "manager"}])
+    session.execute(insert(models.Project), [{"title": "Bench", "owner_id": 1}])
+    for start in range(0, size, 10000):
+        session.execute(insert(models.Defect), [
+            {
+                "title": " ".join(random.choices(WORDS, k=3)) + f" {i}",
+                "description": " ".join(random.choices(WORDS, k=20)),
+                "priority": "Низкий",
+                "status": "Новая",
+                "reporter_id": 1,
+                "project_id": 1,
+            }
+            for i in range(start, min(start + 10000, size))
+        ])
+    session.commit()
+
+def like_search(session, term, limit):
+    return session.query(models.Defect).filter(
+        or_(models.Defect.title.contains(term), models.Defect.description.contains(term))
+    ).limit(limit).all()
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000])
+    parser.add_argument("--terms", nargs="+", default=["арматура бетон", "вентил", "12345"])
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'rows':>9}  {'query':<16} {'fts ms':>8} {'ranked ms':>10} {'like ms':>8}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+            Base.metadata.create_all(bind=engine)
+            session = sessionmaker(bind=engine)()
+            populate(session, size)
+            for term in args.terms:
+                fts = timed(lambda: crud.get_defects(session, limit=args.limit, search_query=term), args.repeat)
+                ranked = timed(lambda: crud.get_defects(session, limit=args.limit, search_query=term, ranked=True), args.repeat)
+                like = timed(lambda: like_search(session, term, args.limit), args.repeat)
+                print(f"{size:>9}  {term:<16} {fts:>8.2f} {ranked:>10.2f} {like:>8.2f}")
+            session.close()
+            engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Benchmark: request throughput with logging off, synchronous file logging and the queue pipeline.
+
+Serves GET /defects/{id} in-process over ASGI from concurrent clients. "sync" is the previous
+setup (FileHandler + StreamHandler formatting and writing in the request thread); "queue" is
+logging_setup.setup_logging(); "sampled" is the queue with 10% of successful access log lines
+kept (ACCESS_LOG_SAMPLE_RATE=0.1). Stream output goes to /dev/null throughout. Modes are interleaved
+over several rounds and the best round is reported. A second table shows the time a request
+thread spends (CPU time of that thread) per logger.info() call.
+
+    python -m backend.benchmarks.logging_throughput --requests 2000 --concurrency 50 --rounds 3
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import crud, hashing, logging_setup, main as app_module, schemas
+from backend.database import Base
+from backend.main import app, get_db
+
+MODES = ("off", "sync", "queue", "sampled")
+
+def sync_logging(log_file: str, stream):
+    root = logging.getLogger()
+    handlers = [logging.FileHandler(log_file), logging.StreamHandler(stream)]
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter(logging_setup.TEXT_FORMAT))
+        root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+    def teardown():
+        for handler in handlers:
+            root.removeHandler(handler)
+            handler.close()
+    return teardown
+
+async def run(requests: int, concurrency: int, path: str, headers: dict) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        queue = asyncio.Queue()
+        for _ in range(requests):
+            queue.put_nowait(None)
+
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                r = await client.get(path, headers=headers)
+                assert r.status_code == 200, r.text
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--records", type=int, default=20000, help="logger.info() calls for the per-record table")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        with Session() as session:
+            user = crud.create_user(session, user=schemas.UserCreate(username="bench", email="bench@example.com", password="pass", role="manager"), pwd_context=hashing.pwd_context)
+            project = crud.create_user_project(session, project=schemas.ProjectCreate(title="Bench"), user_id=user.id)
+            defect = crud.create_defect(session, defect=schemas.DefectCreate(title="Bench defect", project_id=project.id), reporter_id=user.id)
+            path = f"/defects/{defect.id}"
+
+        def override_get_db():
+            db = Session()
+            try:
+                yield db
+            finally:
+                db.close()
+        app.dependency_overrides[get_db] = override_get_db
+
+        async def token():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+                r = await client.post("/token", data={"username": "bench", "password": "pass"})
+                return {"Authorization": f"Bearer {r.json()['access_token']}"}
+        headers = asyncio.run(token())
+        asyncio.run(run(args.concurrency, args.concurrency, path, headers))  # warm up
+
+        def configure(mode: str, log_file: str):
+            logging_setup.shutdown_logging()
+            if mode == "off":
+                logging.disable(logging.CRITICAL)
+                return lambda: logging.disable(logging.NOTSET)
+            if mode == "sync":
+                return sync_logging(log_file, devnull)
+            logging_setup.setup_logging(log_file=log_file, stream=devnull)
+            if mode == "queue":
+                return logging_setup.shutdown_logging
+            sampler = app_module.access_sampler
+            app_module.access_sampler = logging_setup.AccessLogSampler(0.1)
+
+            def teardown():
+                app_module.access_sampler = sampler
+                logging_setup.shutdown_logging()
+            return teardown
+
+        best = {}
+        for round_number in range(args.rounds):
+            for mode in MODES:
+                teardown = configure(mode, str(Path(tmp) / f"{mode}-{round_number}.log"))
+                elapsed = asyncio.run(run(args.requests, args.concurrency, path, headers))
+                teardown()
+                best[mode] = min(best.get(mode, elapsed), elapsed)
+
+        print(f"{'mode':>6} {'requests':>9} {'best s':>8} {'req/s':>8}")
+        for mode in MODES:
+            print(f"{mode:>6} {args.requests:>9} {best[mode]:>8.2f} {args.requests / best[mode]:>8.0f}")
+
+        bench_logger = logging.getLogger("backend.access")
+        extra = {"method": "GET", "path": path, "query": "", "route": "/defects/{defect_id}", "status": 200, "duration_ms": 4.2, "sample_rate": 1.0}
+        print(f"\n{'mode':>6} {'records':>9} {'us/record in caller':>20}")
+        for mode in ("sync", "queue"):
+            teardown = configure(mode, str(Path(tmp) / f"{mode}-calls.log"))
+            start = time.thread_time()
+            for _ in range(args.records):
+                bench_logger.info("%s %s %s %.1fms", "GET", path, 200, 4.2, extra=extra)
+            elapsed = time.thread_time() - start
+            teardown()
+            print(f"{mode:>6} {args.records:>9} {elapsed / args.records * 1e6:>20.1f}")
+
+        app.dependency_overrides.clear()
+        engine.dispose()
+
+if __name__ == "__main__":
+    main()
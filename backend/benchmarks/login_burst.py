@@ -0,0 +1,102 @@
+"""Benchmark: latency of unrelated GETs during a burst of logins.
+
+Runs the app in-process over ASGI and polls GET /users/me/ while 50 concurrent
+POST /token requests are served, once with bcrypt on the event loop (the previous
+behaviour) and once with hashing.verify_password's thread pool.
+
+    python -m backend.benchmarks.login_burst --logins 50
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import crud, hashing, schemas
+from backend.database import Base
+from backend.main import app, get_db
+
+async def inline_verify_password(plain_password: str, hashed_password: str) -> bool:
+    return crud.verify_password(plain_password, hashed_password, hashing.pwd_context)
+
+def percentile(values, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+async def poll(client: httpx.AsyncClient, headers: dict, stop: asyncio.Event, interval: float):
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        r = await client.get("/users/me/", headers=headers)
+        latencies.append(time.perf_counter() - start)
+        assert r.status_code == 200, r.text
+        await asyncio.sleep(interval)
+    return latencies
+
+async def run(logins: int, baseline_seconds: float, interval: float):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        r = await client.post("/token", data={"username": "bench", "password": "pass"})
+        headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+        stop = asyncio.Event()
+        poller = asyncio.create_task(poll(client, headers, stop, interval))
+        await asyncio.sleep(baseline_seconds)
+        stop.set()
+        baseline = await poller
+
+        stop = asyncio.Event()
+        poller = asyncio.create_task(poll(client, headers, stop, interval))
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[
+            client.post("/token", data={"username": "bench", "password": "pass"}) for _ in range(logins)
+        ])
+        burst_time = time.perf_counter() - start
+        stop.set()
+        during = await poller
+        assert all(r.status_code == 200 for r in responses)
+    return baseline, during, burst_time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--baseline-seconds", type=float, default=1.0)
+    parser.add_argument("--interval", type=float, default=0.005, help="pause between polling GETs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        with Session() as session:
+            crud.create_user(session, user=schemas.UserCreate(username="bench", email="bench@example.com", password="pass"), pwd_context=hashing.pwd_context)
+
+        def override_get_db():
+            db = Session()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = override_get_db
+        pooled = hashing.verify_password
+        print(f"bcrypt rounds={hashing.BCRYPT_ROUNDS} workers={hashing.PASSWORD_HASH_WORKERS} logins={args.logins}")
+        print(f"{'mode':>8} {'GETs':>6} {'base p50 ms':>12} {'base p99 ms':>12} {'burst p50 ms':>13} {'burst p99 ms':>13} {'burst s':>8}")
+        for mode, verify in (("inline", inline_verify_password), ("pool", pooled)):
+            hashing.verify_password = verify
+            baseline, during, burst_time = asyncio.run(run(args.logins, args.baseline_seconds, args.interval))
+            print(
+                f"{mode:>8} {len(during):>6} {statistics.median(baseline) * 1000:>12.2f} {percentile(baseline, 99) * 1000:>12.2f} "
+                f"{statistics.median(during) * 1000:>13.2f} {percentile(during, 99) * 1000:>13.2f} {burst_time:>8.2f}"
+            )
+        hashing.verify_password = pooled
+        app.dependency_overrides.clear()
+        engine.dispose()
+
+if __name__ == "__main__":
+    main()
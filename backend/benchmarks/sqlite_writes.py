@@ -0,0 +1,85 @@
+"""Benchmark: SQLite write throughput with and without the production engine profile.
+
+Writer threads insert defects one transaction at a time (like POST /defects/) while
+reader threads page through /defects/-style queries, for a fixed duration per profile.
+
+    python -m backend.benchmarks.sqlite_writes --writers 8 --readers 4 --seconds 10
+"""
+import argparse
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from backend import crud, models, schemas
+from backend.database import Base, create_db_engine
+
+def writer(Session, stop: threading.Event, counters: dict, lock: threading.Lock):
+    done = errors = 0
+    while not stop.is_set():
+        with Session() as session:
+            try:
+                crud.create_defect(session, defect=schemas.DefectCreate(title="Bench defect", project_id=1), reporter_id=1)
+                done += 1
+            except OperationalError:
+                session.rollback()
+                errors += 1
+    with lock:
+        counters["writes"] += done
+        counters["write_errors"] += errors
+
+def reader(Session, stop: threading.Event, counters: dict, lock: threading.Lock):
+    done = errors = 0
+    while not stop.is_set():
+        with Session() as session:
+            try:
+                crud.get_defects(session, limit=50, project_id=1, status=schemas.DefectStatus.new)
+                done += 1
+            except OperationalError:
+                errors += 1
+    with lock:
+        counters["reads"] += done
+        counters["read_errors"] += errors
+
+def run(profile: str, writers: int, readers: int, seconds: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_db_engine(f"sqlite:///{Path(tmp) / 'bench.db'}", profile=profile)
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine, autoflush=False)
+        with Session() as session:
+            session.execute(insert(models.User), [{"username": "bench", "email": "bench@example.com", "hashed_password": "x", "role": "manager"}])
+            session.execute(insert(models.Project), [{"title": "Bench", "owner_id": 1}])
+            session.commit()
+
+        counters = {"writes": 0, "write_errors": 0, "reads": 0, "read_errors": 0}
+        lock = threading.Lock()
+        stop = threading.Event()
+        threads = [threading.Thread(target=writer, args=(Session, stop, counters, lock)) for _ in range(writers)]
+        threads += [threading.Thread(target=reader, args=(Session, stop, counters, lock)) for _ in range(readers)]
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        engine.dispose()
+    return counters
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{'profile':>10} {'writes/s':>9} {'write errors':>13} {'reads/s':>8} {'read errors':>12}")
+    for profile in ("default", "production"):
+        c = run(profile, args.writers, args.readers, args.seconds)
+        print(f"{profile:>10} {c['writes'] / args.seconds:>9.1f} {c['write_errors']:>13} {c['reads'] / args.seconds:>8.1f} {c['read_errors']:>12}")
+
+if __name__ == "__main__":
+    main()
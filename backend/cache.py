@@ -0,0 +1,266 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Iterable, NamedTuple, Optional, Set, Tuple
+from urllib.parse import urlencode
+
+from sqlalchemy import event, inspect
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires_at = entry
+            if expires_at <= self.clock():
+                self._evict(key)
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._evict(next(iter(self._data)))
+
+    def pop(self, key: Hashable) -> Any:
+        with self._lock:
+            return self._evict(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def _evict(self, key: Hashable) -> Any:
+        entry = self._data.pop(key, None)
+        return entry[0] if entry else None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class UserCache(TTLCache):
+    """
+    Token -> user snapshot cache for get_current_user.
+    Entries are indexed by username as well, so a role change or deactivation can drop
+    every token of that user at once.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tokens_by_username: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+        # Called as metrics_hook(hit, seconds) after every lookup
+        self.metrics_hook: Optional[Callable[[bool, float], None]] = None
+
+    def set(self, key: str, value, ttl: Optional[float] = None) -> None:
+        super().set(key, value, ttl)
+        with self._lock:
+            self._tokens_by_username.setdefault(value.username, set()).add(key)
+
+    def _evict(self, key: Hashable):
+        value = super()._evict(key)
+        if value is not None:
+            tokens = self._tokens_by_username.get(value.username)
+            if tokens is not None:
+                tokens.discard(key)
+                if not tokens:
+                    del self._tokens_by_username[value.username]
+        return value
+
+    def invalidate_user(self, username: str) -> None:
+        with self._lock:
+            for token in list(self._tokens_by_username.get(username, ())):
+                self._evict(token)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._tokens_by_username.clear()
+
+    def record(self, hit: bool, seconds: float) -> None:
+        # `seconds` is the time spent resolving the user; for misses that is the DB lookup
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.lookup_seconds += seconds
+        if self.metrics_hook is not None:
+            self.metrics_hook(hit, seconds)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        average_miss = self.lookup_seconds / self.misses if self.misses else 0.0
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "average_miss_seconds": average_miss,
+            # Estimate: every hit skipped one lookup of average miss cost
+            "saved_seconds": self.hits * average_miss,
+        }
+
+
+# Per process: the invalidation below only reaches the worker that made the write. With several
+# workers, a deactivated user or changed role stays valid on the others until their entries
+# expire, so AUTH_CACHE_TTL_SECONDS is that delay; 0 turns the cache off.
+user_cache = UserCache(
+    maxsize=int(os.getenv("AUTH_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("AUTH_CACHE_TTL_SECONDS", "30")),
+)
+
+# Any ORM write to a user (role change, deactivation, re-creation under the same name)
+# drops that user's cached tokens
+@event.listens_for(models.User, "after_insert")
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    user_cache.invalidate_user(target.username)
+    for old_username in inspect(target).attrs.username.history.deleted:
+        user_cache.invalidate_user(old_username)
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    last_modified: Optional[datetime]
+
+
+class MemoryBackend:
+    """Per-process LRU; each worker keeps its own copy."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._cache.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._cache.set(key, value, ttl)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+class RedisBackend:
+    """Shared between workers; works with Redis or any server speaking its protocol (Valkey, KeyDB...)."""
+
+    def __init__(self, url: str, prefix: str = "techframe:response:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("RESPONSE_CACHE_URL is set, but the redis package is not installed (pip install redis)") from e
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._client.set(self.prefix + key, value, ex=max(1, int(ttl)))
+
+    def clear(self) -> None:
+        for key in self._client.scan_iter(match=self.prefix + "*", count=500):
+            self._client.delete(key)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._client.scan_iter(match=self.prefix + "*", count=500))
+
+
+class ResponseCache:
+    """
+    Serialized GET responses keyed by path, query parameters and the data versions they were
+    built from (see backend/versions.py). A write bumps the version, so later lookups use a new
+    key and the old entry simply ages out; the TTL bounds staleness for writes made outside the app.
+    Backend errors are logged and treated as misses.
+    """
+
+    def __init__(self, backend, ttl: float = 30.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def key(path: str, params: Iterable[Tuple[str, str]], version_tag: str) -> str:
+        return f"{path}?{urlencode(sorted(params))}#{version_tag}"
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        try:
+            packed = self.backend.get(key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Response cache read failed: %s", e)
+            packed = None
+        if packed is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        header, body = packed.split(b"\n", 1)
+        meta = json.loads(header)
+        last_modified = datetime.fromisoformat(meta["last_modified"]) if meta["last_modified"] else None
+        return CachedResponse(body, meta["etag"], last_modified)
+
+    def set(self, key: str, entry: CachedResponse) -> None:
+        meta = {"etag": entry.etag, "last_modified": entry.last_modified.isoformat() if entry.last_modified else None}
+        try:
+            self.backend.set(key, json.dumps(meta).encode() + b"\n" + entry.body, self.ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Response cache write failed: %s", e)
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def make_response_cache() -> ResponseCache:
+    ttl = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30"))
+    url = os.getenv("RESPONSE_CACHE_URL")
+    if url:
+        backend = RedisBackend(url)
+    else:
+        backend = MemoryBackend(maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")), ttl=ttl)
+    return ResponseCache(backend, ttl=ttl)
+
+
+response_cache = make_response_cache()
@@ -0,0 +1,55 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response
+
+# Validators for conditional GET: strong ETags and Last-Modified, answered with 304 Not Modified.
+# Responses carry user-specific authorization, so shared caches must not store them and clients
+# must revalidate before reuse.
+CACHE_CONTROL = "private, no-cache"
+# For URLs whose content can never change (content-addressed attachments): reused for a year
+# without revalidation
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"\0")
+    return f'"{digest.hexdigest()[:32]}"'
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison (RFC 9110 13.1.2)
+    if header.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+def is_not_modified(request: Request, etag: Optional[str], last_modified: Optional[datetime] = None) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence; If-Modified-Since is ignored when it is present
+        return etag is not None and _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+def validator_headers(etag: Optional[str], last_modified: Optional[datetime] = None, cache_control: str = CACHE_CONTROL) -> dict:
+    headers = {"Cache-Control": cache_control}
+    if etag is not None:
+        headers["ETag"] = etag
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+def not_modified_response(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
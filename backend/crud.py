@@ -1,8 +1,12 @@
-from sqlalchemy.orm import Session
-from datetime import datetime
-from typing import List, Optional
+from pydantic import ValidationError
+from sqlalchemy import delete, func, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, noload, selectinload
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from . import models, schemas
+from . import models, rollups, schemas, search
+from . import versions  # noqa: F401 - registers the data version listeners for every Session
 from passlib.context import CryptContext
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -15,6 +19,23 @@ def verify_password(plain_password, hashed_password, pwd_context):
 def get_password_hash(password, pwd_context):
     return pwd_context.hash(password.encode('utf-8')[:72]) # Кодируем пароль в байты и усекаем до 72 байт
 
+def _paginate(query, id_column, skip: int, limit: int, after_id: Optional[int] = None, order_column=None):
+    # Keyset mode (after_id) seeks on the primary key, so every page costs the same as the first one.
+    # Offset pages are ordered by id too: their last id is handed out as the next cursor, and
+    # without ORDER BY rows come back in whatever index order the planner picked
+    if after_id is not None:
+        return query.filter(id_column > after_id).order_by(id_column).limit(limit).all()
+    return query.order_by(id_column if order_column is None else order_column).offset(skip).limit(limit).all()
+
+# Relationships rendered by schemas.Defect and schemas.Project, loaded up front with one
+# SELECT ... IN per relationship instead of one lazy load per row
+DEFECT_RELATION_NAMES = ("comments", "attachments")
+DEFECT_RELATIONS = tuple(selectinload(getattr(models.Defect, name)) for name in DEFECT_RELATION_NAMES)
+PROJECT_RELATIONS = (
+    selectinload(models.Project.defects).selectinload(models.Defect.comments),
+    selectinload(models.Project.defects).selectinload(models.Defect.attachments),
+)
+
 # --- User CRUD operations ---
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
@@ -25,11 +46,13 @@ def get_user_by_email(db: Session, email: str):
 def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def get_users(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    return _paginate(db.query(models.User), models.User.id, skip, limit, after_id)
 
-def create_user(db: Session, user: schemas.UserCreate, pwd_context: CryptContext):
-    hashed_password = get_password_hash(user.password, pwd_context)
+def create_user(db: Session, user: schemas.UserCreate, pwd_context: Optional[CryptContext] = None, hashed_password: Optional[str] = None):
+    # Callers that hash off the event loop pass hashed_password instead of pwd_context
+    if hashed_password is None:
+        hashed_password = get_password_hash(user.password, pwd_context)
     db_user = models.User(username=user.username, email=user.email, hashed_password=hashed_password, role=user.role)
     db.add(db_user)
     db.commit()
@@ -46,11 +69,20 @@ def update_user_role(db: Session, user_id: int, new_role: schemas.UserRole):
     return db_user
 
 # --- Project CRUD operations ---
-def get_project(db: Session, project_id: int):
-    return db.query(models.Project).filter(models.Project.id == project_id).first()
+def get_project(db: Session, project_id: int, load_relations: bool = False):
+    query = db.query(models.Project).filter(models.Project.id == project_id)
+    if load_relations:
+        query = query.options(*PROJECT_RELATIONS)
+    return query.first()
 
-def get_projects(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Project).offset(skip).limit(limit).all()
+def project_exists(db: Session, project_id: int) -> bool:
+    return db.query(models.Project.id).filter(models.Project.id == project_id).first() is not None
+
+def get_projects(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None, load_relations: bool = False):
+    query = db.query(models.Project)
+    if load_relations:
+        query = query.options(*PROJECT_RELATIONS)
+    return _paginate(query, models.Project.id, skip, limit, after_id)
 
 def create_user_project(db: Session, project: schemas.ProjectCreate, user_id: int):
     db_project = models.Project(**project.model_dump(), owner_id=user_id)
@@ -78,13 +110,17 @@ def delete_project(db: Session, project_id: int):
     return db_project
 
 # --- Defect CRUD operations ---
-def get_defect(db: Session, defect_id: int):
-    return db.query(models.Defect).filter(models.Defect.id == defect_id).first()
+def get_defect(db: Session, defect_id: int, load_relations: bool = False):
+    query = db.query(models.Defect).filter(models.Defect.id == defect_id)
+    if load_relations:
+        query = query.options(*DEFECT_RELATIONS)
+    return query.first()
 
-def get_defects(
-    db: Session,
-    skip: int = 0,
-    limit: int = 100,
+def defect_exists(db: Session, defect_id: int) -> bool:
+    return db.query(models.Defect.id).filter(models.Defect.id == defect_id).first() is not None
+
+def _filter_defects(
+    query,
     project_id: Optional[int] = None,
     status: Optional[schemas.DefectStatus] = None,
     priority: Optional[schemas.DefectPriority] = None,
@@ -96,7 +132,6 @@ def get_defects(
     due_end_date: Optional[datetime] = None,
     search_query: Optional[str] = None,
 ):
-    query = db.query(models.Defect)
     if project_id:
         query = query.filter(models.Defect.project_id == project_id)
     if status:
@@ -116,33 +151,220 @@ def get_defects(
     if due_end_date:
         query = query.filter(models.Defect.due_date <= due_end_date)
     if search_query:
-        query = query.filter(
-            (models.Defect.title.contains(search_query)) |
-            (models.Defect.description.contains(search_query))
-        )
-    return query.offset(skip).limit(limit).all()
+        query = search.filter_defects(query, search_query)
+    return query
+
+def get_defects(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    ranked: bool = False,
+    relations: Iterable[str] = (),
+    **filters,
+):
+    # Relationships named in `relations` are eager-loaded; the others are left empty, not lazy-loaded
+    loaders = [
+        (selectinload if name in relations else noload)(getattr(models.Defect, name))
+        for name in DEFECT_RELATION_NAMES
+    ]
+    query = _filter_defects(db.query(models.Defect).options(*loaders), **filters)
+    id_column = models.Defect.id
+    if filters.get("search_query") and search.uses_index(db, filters["search_query"]):
+        if ranked:
+            # BM25 relevance has to score every match, so it is only applied on request
+            query = query.order_by(search.defect_search.c.rank)
+        # The index yields matches in rowid (= defect id) order, which keyset pages can follow without sorting
+        id_column = search.defect_search.c.rowid
+    order_column = None
+    if filters.get("created_start_date") or filters.get("created_end_date"):
+        # Same order, but "id + 0" cannot be read off the primary key: SQLite then takes the
+        # matches from ix_defects_created_at and sorts them, instead of walking the whole table in
+        # id order looking for recent rows
+        order_column = id_column + 0
+    return _paginate(query, id_column, skip, limit, after_id, order_column)
+
+# Columns of the defects report, in the order they appear in the exported file
+DEFECT_EXPORT_COLUMNS = (
+    models.Defect.id,
+    models.Defect.title,
+    models.Defect.description,
+    models.Defect.priority,
+    models.Defect.status,
+    models.Defect.created_at,
+    models.Defect.updated_at,
+    models.Defect.due_date,
+    models.Defect.reporter_id,
+    models.Defect.assignee_id,
+    models.Defect.project_id,
+)
+
+def count_defect_export_rows(db: Session, **filters) -> int:
+    return _filter_defects(db.query(func.count(models.Defect.id)), **filters).scalar()
+
+def iter_defect_export_rows(db: Session, batch_size: int = 1000, **filters):
+    # Keyset batches (id > last seen id) keep memory flat and never hold a read open between batches
+    last_id = 0
+    while True:
+        query = _filter_defects(db.query(*DEFECT_EXPORT_COLUMNS), **filters)
+        batch = query.filter(models.Defect.id > last_id).order_by(models.Defect.id).limit(batch_size).all()
+        if not batch:
+            return
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        last_id = batch[-1].id
+
+DONE_STATUSES = (schemas.DefectStatus.closed, schemas.DefectStatus.cancelled)
+
+def get_defect_summary(db: Session, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, now: Optional[datetime] = None):
+    # Total, completed and projects with open defects come from the rollups; overdue depends on
+    # the current time, so it is counted from defects through ix_defects_due_date_status
+    done = {status.value for status in DONE_STATUSES}
+    counts = rollups.count_defects(db, ("project_id", "status"), start_date, end_date)
+    total = sum(counts.values())
+    completed = sum(n for (_, status), n in counts.items() if status in done)
+    active_projects = len({project_id for project_id, status in counts if status not in done})
+
+    overdue = db.query(func.count(models.Defect.id)).filter(
+        models.Defect.due_date < (now or datetime.now()), ~models.Defect.status.in_(DONE_STATUSES)
+    )
+    if start_date:
+        overdue = overdue.filter(models.Defect.created_at >= start_date)
+    if end_date:
+        overdue = overdue.filter(models.Defect.created_at <= end_date)
+    return total, overdue.scalar(), completed, active_projects
+
+def get_defect_counts(db: Session, dimension: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
+    # [(value, count)] sorted by value, for dimension "status", "priority" or "day"
+    counts = rollups.count_defects(db, (dimension,), start_date, end_date)
+    return sorted((value, n) for (value,), n in counts.items())
+
+def get_defect_creation_trend(db: Session, start_date: datetime, end_date: datetime):
+    return get_defect_counts(db, "day", start_date, end_date)
+
+def get_project_performance(db: Session):
+    # [(project id, title, total defects, completed defects)] for every project, from the rollups
+    done = {status.value for status in DONE_STATUSES}
+    totals, completed = {}, {}
+    for (project_id, status), n in rollups.count_defects(db, ("project_id", "status")).items():
+        totals[project_id] = totals.get(project_id, 0) + n
+        if status in done:
+            completed[project_id] = completed.get(project_id, 0) + n
+    return [
+        (project_id, title, totals.get(project_id, 0), completed.get(project_id, 0))
+        for project_id, title in db.query(models.Project.id, models.Project.title).order_by(models.Project.id)
+    ]
 
 def create_defect(db: Session, defect: schemas.DefectCreate, reporter_id: int):
     db_defect = models.Defect(**defect.model_dump(exclude_unset=True), reporter_id=reporter_id)
     db.add(db_defect)
+    db.flush()
+    rollups.record_created(db, [rollups.defect_key(db_defect)])
     db.commit()
     db.refresh(db_defect)
     return db_defect
 
+BULK_CHUNK_SIZE = 1000
+# Rows with errors are all counted, but only this many are described in the result
+MAX_REPORTED_ERRORS = 1000
+
+def _validation_messages(error: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(part) for part in e['loc']) or 'row'}: {e['msg']}" for e in error.errors()]
+
+def _insert_defect_chunk(db: Session, chunk: List[tuple], reporter_id: int, result: schemas.DefectImportResult):
+    # chunk holds (row number, raw row); valid rows go into one executemany INSERT and one commit
+    rows = []
+    for row_number, raw in chunk:
+        try:
+            rows.append((row_number, schemas.DefectCreate.model_validate(raw)))
+        except ValidationError as e:
+            _add_import_error(result, row_number, _validation_messages(e))
+
+    project_ids = {defect.project_id for _, defect in rows}
+    user_ids = {defect.assignee_id for _, defect in rows if defect.assignee_id is not None}
+    known_projects = {id_ for (id_,) in db.query(models.Project.id).filter(models.Project.id.in_(project_ids))}
+    known_users = {id_ for (id_,) in db.query(models.User.id).filter(models.User.id.in_(user_ids))} if user_ids else set()
+
+    values = []
+    for row_number, defect in rows:
+        errors = []
+        if defect.project_id not in known_projects:
+            errors.append(f"project_id: Project {defect.project_id} not found")
+        if defect.assignee_id is not None and defect.assignee_id not in known_users:
+            errors.append(f"assignee_id: User {defect.assignee_id} not found")
+        if errors:
+            _add_import_error(result, row_number, errors)
+        else:
+            values.append({**defect.model_dump(exclude_unset=True), "reporter_id": reporter_id})
+    if values:
+        d = models.Defect
+        inserted = db.execute(insert(d).returning(d.project_id, d.status, d.priority, d.created_at), values)
+        rollups.record_created(db, [rollups.defect_key(row) for row in inserted])
+        db.commit()
+        result.created += len(values)
+
+def _add_import_error(result: schemas.DefectImportResult, row_number: int, errors: List[str]):
+    result.failed += 1
+    if len(result.errors) < MAX_REPORTED_ERRORS:
+        result.errors.append(schemas.DefectImportError(row=row_number, errors=errors))
+
+def bulk_create_defects(db: Session, rows: Iterable[Tuple[int, dict]], reporter_id: int, chunk_size: int = BULK_CHUNK_SIZE):
+    # rows are (row number, raw row) pairs. Valid rows are committed chunk by chunk, so an
+    # import that fails midway keeps the chunks before it
+    result = schemas.DefectImportResult(created=0, failed=0)
+    chunk = []
+    for row_number, raw in rows:
+        chunk.append((row_number, raw))
+        if len(chunk) >= chunk_size:
+            _insert_defect_chunk(db, chunk, reporter_id, result)
+            chunk = []
+    if chunk:
+        _insert_defect_chunk(db, chunk, reporter_id, result)
+    result.errors.sort(key=lambda e: e.row)
+    return result
+
 def update_defect(db: Session, defect_id: int, defect: schemas.DefectUpdate):
     db_defect = db.query(models.Defect).filter(models.Defect.id == defect_id).first()
     if db_defect:
+        old_key = rollups.defect_key(db_defect)
         update_data = defect.model_dump(exclude_unset=True)
         for key, value in update_data.items():
             setattr(db_defect, key, value)
         db.add(db_defect)
+        rollups.record_changed(db, old_key, rollups.defect_key(db_defect))
         db.commit()
         db.refresh(db_defect)
     return db_defect
 
+def get_defect_owners(db: Session, defect_ids: Iterable[int]):
+    # (id, reporter_id, assignee_id) for authorization checks without loading whole rows
+    return db.query(models.Defect.id, models.Defect.reporter_id, models.Defect.assignee_id).filter(
+        models.Defect.id.in_(list(defect_ids))
+    ).all()
+
+def batch_update_defects(db: Session, patches: Dict[int, schemas.DefectUpdate]):
+    # Defects sharing the same patch are updated by one UPDATE ... WHERE id IN (...); everything
+    # runs in one transaction and the result is read back with one SELECT
+    groups: Dict[tuple, List[int]] = {}
+    for defect_id, patch in patches.items():
+        values = patch.model_dump(exclude_unset=True)
+        if values:
+            groups.setdefault(tuple(sorted(values.items())), []).append(defect_id)
+    updated_ids = [defect_id for ids in groups.values() for defect_id in ids]
+    before = rollups.keys_for(db, updated_ids)
+    for values, ids in groups.items():
+        db.query(models.Defect).filter(models.Defect.id.in_(ids)).update(dict(values), synchronize_session=False)
+    after = rollups.keys_for(db, updated_ids)
+    after.subtract(before)
+    rollups.apply(db, after)
+    db.commit()
+    return db.query(models.Defect).filter(models.Defect.id.in_(list(patches))).order_by(models.Defect.id).all()
+
 def delete_defect(db: Session, defect_id: int):
     db_defect = db.query(models.Defect).filter(models.Defect.id == defect_id).first()
     if db_defect:
+        rollups.record_deleted(db, [rollups.defect_key(db_defect)])
         db.delete(db_defect)
         db.commit()
     return db_defect
@@ -151,6 +373,10 @@ def delete_defect(db: Session, defect_id: int):
 def get_comment(db: Session, comment_id: int):
     return db.query(models.Comment).filter(models.Comment.id == comment_id).first()
 
+def get_comments_for_defect(db: Session, defect_id: int, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    query = db.query(models.Comment).filter(models.Comment.defect_id == defect_id)
+    return _paginate(query, models.Comment.id, skip, limit, after_id)
+
 def create_comment(db: Session, comment: schemas.CommentCreate, author_id: int):
     db_comment = models.Comment(**comment.model_dump(), author_id=author_id)
     db.add(db_comment)
@@ -180,13 +406,42 @@ def delete_comment(db: Session, comment_id: int):
 def get_attachment(db: Session, attachment_id: int):
     return db.query(models.Attachment).filter(models.Attachment.id == attachment_id).first()
 
+def get_attachments_for_defect(db: Session, defect_id: int, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    query = db.query(models.Attachment).filter(models.Attachment.defect_id == defect_id)
+    return _paginate(query, models.Attachment.id, skip, limit, after_id)
+
+def get_blob(db: Session, sha256: str):
+    return db.get(models.Blob, sha256)
+
+def get_defect_attachment_bytes(db: Session, defect_id: int) -> int:
+    return db.query(func.coalesce(func.sum(models.Attachment.size), 0)).filter(models.Attachment.defect_id == defect_id).scalar()
+
+def get_blob_storage_bytes(db: Session) -> int:
+    # Bytes on disk: each distinct blob counts once however many attachments share it
+    return db.query(func.coalesce(func.sum(models.Blob.size), 0)).scalar()
+
+def _add_blob_reference(db: Session, sha256: str, size: int) -> None:
+    upsert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    stmt = upsert(models.Blob).values(sha256=sha256, size=size, ref_count=1)
+    db.execute(stmt.on_conflict_do_update(index_elements=["sha256"], set_={"ref_count": models.Blob.ref_count + 1}))
+
+def _release_blob_reference(db: Session, sha256: str) -> bool:
+    # True when this was the last reference and the blob row is gone
+    blob = models.Blob
+    db.execute(update(blob).where(blob.sha256 == sha256).values(ref_count=blob.ref_count - 1))
+    return db.execute(delete(blob).where(blob.sha256 == sha256, blob.ref_count <= 0)).rowcount > 0
+
 def create_attachment(db: Session, attachment: schemas.AttachmentCreate, uploader_id: int):
     db_attachment = models.Attachment(
         defect_id=attachment.defect_id,
         uploader_id=uploader_id,
         filename=attachment.filename,
-        file_path=attachment.file_path
+        file_path=attachment.file_path,
+        sha256=attachment.sha256,
+        size=attachment.size,
     )
+    if attachment.sha256 is not None:
+        _add_blob_reference(db, attachment.sha256, attachment.size)
     db.add(db_attachment)
     db.commit()
     db.refresh(db_attachment)
@@ -206,6 +461,58 @@ def update_attachment(db: Session, attachment_id: int, attachment: schemas.Attac
 def delete_attachment(db: Session, attachment_id: int):
     db_attachment = db.query(models.Attachment).filter(models.Attachment.id == attachment_id).first()
     if db_attachment:
+        if db_attachment.sha256 is not None:
+            _release_blob_reference(db, db_attachment.sha256)
         db.delete(db_attachment)
         db.commit()
     return db_attachment
+
+# --- Export job operations ---
+EXPORT_JOB_ACTIVE = ("queued", "running")
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+def create_export_job(db: Session, job_id: str, key: str, format: str, user_id: int):
+    now = _utcnow()
+    db_job = models.ExportJob(id=job_id, key=key, format=format, status="queued", processed=0, created_by=user_id, created_at=now, updated_at=now)
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def get_export_job(db: Session, job_id: str):
+    return db.get(models.ExportJob, job_id)
+
+def find_export_job(db: Session, key: str, stale_before: datetime):
+    # A job with the same key that is still running (and alive) or finished and not expired
+    job = models.ExportJob
+    return (
+        db.query(job)
+        .filter(job.key == key)
+        .filter(
+            ((job.status.in_(EXPORT_JOB_ACTIVE)) & (job.updated_at >= stale_before))
+            | ((job.status == "done") & (job.expires_at > _utcnow()))
+        )
+        .order_by(job.created_at.desc())
+        .first()
+    )
+
+def update_export_job(db: Session, job_id: str, **values) -> None:
+    db.execute(update(models.ExportJob).where(models.ExportJob.id == job_id).values(updated_at=_utcnow(), **values))
+    db.commit()
+
+def touch_queued_export_jobs(db: Session, job_ids: List[str]) -> None:
+    # Queued jobs save no progress until a worker starts them; this keeps them from looking lost
+    job = models.ExportJob
+    db.execute(update(job).where(job.id.in_(job_ids), job.status == "queued").values(updated_at=_utcnow()))
+    db.commit()
+
+def delete_expired_export_jobs(db: Session) -> List[Tuple[str, str]]:
+    # (id, format) of the removed jobs, whose result files the caller deletes
+    job = models.ExportJob
+    expired = db.query(job.id, job.format).filter(job.expires_at <= _utcnow()).all()
+    if expired:
+        db.execute(delete(job).where(job.id.in_([job_id for job_id, _ in expired])))
+        db.commit()
+    return [(job_id, format) for job_id, format in expired]
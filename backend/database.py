@@ -1,4 +1,7 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
 from pathlib import Path
 
@@ -6,13 +9,85 @@ PROJECT_ROOT = Path(__file__).resolve().parent.parent
 DB_PATH = PROJECT_ROOT / "sql_app.db"
 if DB_PATH.is_dir():
     DB_PATH = PROJECT_ROOT / "sql_app.sqlite"
-if not DB_PATH.exists():
-    DB_PATH.touch()
-SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH.as_posix()}"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+def _default_database_url() -> str:
+    if not DB_PATH.exists():
+        DB_PATH.touch()
+    return f"sqlite:///{DB_PATH.as_posix()}"
+
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL") or _default_database_url()
+
+# "production" applies SQLITE_PRAGMAS to every new SQLite connection; "default" leaves SQLite defaults
+DB_PROFILE = os.getenv("DB_PROFILE", "production")
+
+SQLITE_PRAGMAS = {
+    # WAL lets readers run alongside the single writer instead of blocking on it
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    # Safe with WAL: a power loss can drop the last transactions but never corrupts the file
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    # Writers wait this long for the lock instead of failing with "database is locked"
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    # Negative values are KiB: 64 MiB page cache per connection
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE_MB", "256")) * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+
+# Connections per process; the threadpool runs up to 40 handlers at once
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Server databases only: recycle connections before the server/proxy drops idle ones, and cap
+# how long a single statement may run (0 disables the limit)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas=None):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in (pragmas or SQLITE_PRAGMAS).items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+def engine_options(url) -> dict:
+    url = make_url(url)
+    is_sqlite = url.get_backend_name() == "sqlite"
+    options = {}
+    if is_sqlite:
+        options["connect_args"] = {"check_same_thread": False}
+    if not is_sqlite or url.database not in (None, "", ":memory:"):
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    if not is_sqlite:
+        # Several workers/nodes share the server: validate pooled connections after restarts/failovers
+        options.update(pool_pre_ping=True, pool_recycle=DB_POOL_RECYCLE)
+        if url.get_backend_name() == "postgresql" and DB_STATEMENT_TIMEOUT_MS:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+def create_db_engine(url: str = SQLALCHEMY_DATABASE_URL, profile: str = DB_PROFILE):
+    db_engine = create_engine(url, **engine_options(url))
+    if db_engine.dialect.name == "sqlite" and profile == "production":
+        event.listen(db_engine, "connect", lambda dbapi_connection, record: apply_sqlite_pragmas(dbapi_connection))
+    return db_engine
+
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
+
+ALEMBIC_INI = Path(__file__).resolve().parent / "alembic.ini"
+MIGRATION_LOCK_ID = 740512
+
+def run_migrations(bind=None):
+    # Brings the schema up to date (alembic upgrade head) using the application engine
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(str(ALEMBIC_INI))
+    with (bind or engine).begin() as connection:
+        if connection.dialect.name == "postgresql":
+            # Every worker runs this on startup; the lock (released at commit) lets one migrate at a time
+            connection.exec_driver_sql(f"SELECT pg_advisory_xact_lock({MIGRATION_LOCK_ID})")
+        config.attributes["connection"] = connection
+        command.upgrade(config, "head")
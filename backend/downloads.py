@@ -0,0 +1,72 @@
+import os
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import quote
+
+from fastapi import Request, Response
+from starlette.responses import FileResponse
+
+from . import conditional, storage
+
+# Attachment downloads. Starlette's FileResponse answers Range requests (206, multipart ranges,
+# If-Range, 416) and hands the file to the server via http.response.pathsend where the server
+# supports it; on top of that the endpoint adds content ETags, 304s and caching headers.
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Zero-copy through a reverse proxy: "X-Accel-Redirect" (nginx) or "X-Sendfile" (Apache, lighttpd).
+# The proxy then reads the file with sendfile() and serves ranges itself; the app only authorizes.
+ATTACHMENT_SENDFILE_HEADER = os.getenv("ATTACHMENT_SENDFILE_HEADER", "")
+# X-Accel-Redirect only: internal nginx location that maps to ATTACHMENTS_DIR
+ATTACHMENT_ACCEL_PREFIX = os.getenv("ATTACHMENT_ACCEL_PREFIX", "/_attachments/")
+
+class AttachmentFileResponse(FileResponse):
+    # One thread hop per chunk: larger reads than Starlette's 64 KiB default cut the per-request
+    # overhead on large files
+    chunk_size = DOWNLOAD_CHUNK_SIZE
+
+def _content_disposition(filename: str, disposition: str) -> str:
+    # Same header FileResponse builds
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition}; filename*=utf-8''{quoted}"
+    return f'{disposition}; filename="{filename}"'
+
+def _sendfile_location(path: str) -> Optional[str]:
+    if ATTACHMENT_SENDFILE_HEADER.lower() == "x-sendfile":
+        return os.path.abspath(path)
+    root = os.path.abspath(storage.blob_store.root)
+    relative = os.path.relpath(os.path.abspath(path), root)
+    if relative.startswith(".."):
+        return None  # outside the attachments directory, not mapped by the proxy
+    return ATTACHMENT_ACCEL_PREFIX.rstrip("/") + "/" + relative.replace(os.sep, "/")
+
+def attachment_response(request: Request, path: str, filename: str, media_type: str, content_id: Optional[str],
+                        disposition: str = "attachment") -> Optional[Response]:
+    """
+    The download response for an attachment file, or None when the file is missing. content_id
+    identifies immutable content (the blob hash, or hash and preview variant); None for files
+    that may be replaced in place.
+    """
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        return None
+    last_modified = datetime.fromtimestamp(stat_result.st_mtime, timezone.utc)
+    if content_id is not None:
+        # A blob path always holds the same bytes: the hash is a strong validator for the URL
+        etag, cache_control = f'"{content_id}"', conditional.IMMUTABLE_CACHE_CONTROL
+    else:
+        # Files stored before content addressing can be replaced in place
+        etag = conditional.make_etag(path, stat_result.st_mtime_ns, stat_result.st_size)
+        cache_control = conditional.CACHE_CONTROL
+    headers = conditional.validator_headers(etag, last_modified, cache_control)
+    if conditional.is_not_modified(request, etag, last_modified):
+        return conditional.not_modified_response(headers)
+
+    if ATTACHMENT_SENDFILE_HEADER:
+        location = _sendfile_location(path)
+        if location is not None:
+            headers.update({ATTACHMENT_SENDFILE_HEADER: location, "Content-Disposition": _content_disposition(filename, disposition)})
+            return Response(headers=headers, media_type=media_type)
+    return AttachmentFileResponse(
+        path, filename=filename, media_type=media_type, headers=headers, stat_result=stat_result, content_disposition_type=disposition
+    )
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from . import crud, models, reports, schemas, versions
+from .database import create_db_engine
+
+logger = logging.getLogger(__name__)
+
+# Background defect exports. POST /reports/defects/export/jobs records a job and hands it to a
+# process pool, so building large XLSX files does not take CPU from the API's event loop and
+# threadpool. The worker process updates progress in export_jobs and writes the file to
+# EXPORT_DIR, where it is kept for EXPORT_JOB_TTL_SECONDS. Requests with the same format and
+# filters made while the defects are unchanged get the same job.
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+EXPORT_JOB_WORKERS = int(os.getenv("EXPORT_JOB_WORKERS", "1"))
+# Queued + running jobs per API process; further requests get 503
+EXPORT_JOB_MAX_QUEUED = int(os.getenv("EXPORT_JOB_MAX_QUEUED", "20"))
+EXPORT_JOB_TTL_SECONDS = int(os.getenv("EXPORT_JOB_TTL_SECONDS", "3600"))
+# A running job whose progress has not moved for this long, or a queued job its API process
+# stopped refreshing, is considered lost (the process died); identical requests then start a new job
+EXPORT_JOB_STALE_SECONDS = int(os.getenv("EXPORT_JOB_STALE_SECONDS", "600"))
+# How often the API process refreshes updated_at of the jobs it has queued, so a job waiting
+# behind others is not taken for a lost one
+EXPORT_JOB_HEARTBEAT_SECONDS = EXPORT_JOB_STALE_SECONDS / 4
+# Rows per database batch; progress is saved after each batch
+EXPORT_BATCH_SIZE = 1000
+
+MEDIA_TYPES = {"csv": reports.CSV_MEDIA_TYPE, "xlsx": reports.XLSX_MEDIA_TYPE}
+
+class QueueFull(Exception):
+    pass
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _aware(stamp: Optional[datetime]) -> Optional[datetime]:
+    # SQLite returns naive datetimes; they are stored in UTC
+    return stamp.replace(tzinfo=timezone.utc) if stamp is not None and stamp.tzinfo is None else stamp
+
+def job_key(format: str, filters: dict, data_version: str) -> str:
+    payload = json.dumps({"format": format, "filters": filters, "data": data_version}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def result_path(job_id: str, format: str, directory: str = EXPORT_DIR) -> str:
+    return os.path.join(directory, f"{job_id}.{format}")
+
+def _counted(rows, on_batch, batch_size: int):
+    count = 0
+    for row in rows:
+        yield row
+        count += 1
+        if count % batch_size == 0:
+            on_batch(count)
+
+def run_export(job_id: str, format: str, filters: dict, database_url: str, directory: str, batch_size: int = EXPORT_BATCH_SIZE) -> None:
+    """Runs in a pool process: its own engine, progress saved to export_jobs after every batch."""
+    engine = create_db_engine(database_url)
+    path = result_path(job_id, format, directory)
+    tmp_path = path + ".tmp"
+    try:
+        with sessionmaker(bind=engine)() as db:
+            try:
+                total = crud.count_defect_export_rows(db, **filters)
+                crud.update_export_job(db, job_id, status="running", total=total)
+                processed = [0]
+
+                def on_batch(count: int) -> None:
+                    processed[0] = count
+                    crud.update_export_job(db, job_id, processed=count)
+
+                rows = _counted(crud.iter_defect_export_rows(db, batch_size=batch_size, **filters), on_batch, batch_size)
+                os.makedirs(directory, exist_ok=True)
+                if format == "xlsx":
+                    with open(tmp_path, "wb") as f:
+                        reports.write_xlsx(rows, f)
+                else:
+                    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+                        for chunk in reports.iter_csv(rows):
+                            f.write(chunk)
+                os.replace(tmp_path, path)
+                finished = _utcnow()
+                crud.update_export_job(
+                    db, job_id, status="done", processed=total, size=os.path.getsize(path),
+                    finished_at=finished, expires_at=finished + timedelta(seconds=EXPORT_JOB_TTL_SECONDS),
+                )
+            except Exception as e:
+                db.rollback()
+                finished = _utcnow()
+                crud.update_export_job(
+                    db, job_id, status="failed", error=str(e)[:500],
+                    finished_at=finished, expires_at=finished + timedelta(seconds=EXPORT_JOB_TTL_SECONDS),
+                )
+                raise
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        engine.dispose()
+
+class ExportJobRunner:
+    def __init__(self, workers: int = EXPORT_JOB_WORKERS, max_queued: int = EXPORT_JOB_MAX_QUEUED, directory: str = EXPORT_DIR):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.directory = directory
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._active = 0
+        # Submitted jobs not finished yet: id -> database URL, for the heartbeat
+        self._waiting: Dict[str, str] = {}
+        self._heartbeat: Optional[threading.Thread] = None
+        # Held from the duplicate lookup to the job insert, so concurrent identical requests in
+        # this process cannot both start a job
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: forking a process that runs uvicorn, logging and sampler threads can copy held locks
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def submit(self, db: Session, request: schemas.ExportJobCreate, user_id: int) -> models.ExportJob:
+        """The job for this export: an existing identical one, or a newly queued one."""
+        self.purge_expired(db)
+        filters = request.model_dump(exclude={"format"})
+        key = job_key(request.format, filters, versions.tag(versions.current(db, ("defects",))))
+        # The worker connects to the same database as the request (tests use their own)
+        database_url = db.get_bind().url.render_as_string(hide_password=False)
+        with self._lock:
+            existing = crud.find_export_job(db, key, stale_before=_utcnow() - timedelta(seconds=EXPORT_JOB_STALE_SECONDS))
+            if existing is not None:
+                return existing
+            if self._active >= self.max_queued:
+                raise QueueFull(f"{self._active} exports are already queued")
+            job = crud.create_export_job(db, uuid.uuid4().hex, key, request.format, user_id)
+            self._active += 1
+            self._waiting[job.id] = database_url
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._beat, name="export-job-heartbeat", daemon=True)
+                self._heartbeat.start()
+        try:
+            try:
+                future = self._pool().submit(run_export, job.id, request.format, filters, database_url, self.directory)
+            except BrokenProcessPool:
+                self._executor = None
+                future = self._pool().submit(run_export, job.id, request.format, filters, database_url, self.directory)
+        except Exception as e:
+            self._release(job.id)
+            finished = _utcnow()
+            crud.update_export_job(
+                db, job.id, status="failed", error=f"Export could not be started: {e}"[:500],
+                finished_at=finished, expires_at=finished + timedelta(seconds=EXPORT_JOB_TTL_SECONDS),
+            )
+            raise
+        future.add_done_callback(lambda f: self._finished(job.id, database_url, f))
+        return job
+
+    def _release(self, job_id: str) -> None:
+        with self._lock:
+            self._active -= 1
+            self._waiting.pop(job_id, None)
+
+    def _finished(self, job_id: str, database_url: str, future: Future) -> None:
+        self._release(job_id)
+        error = future.exception()
+        if error is None:
+            return
+        logger.error("Export job %s failed: %s", job_id, error)
+        if isinstance(error, BrokenProcessPool):
+            # A worker died (e.g. killed for memory) before recording the failure itself; the
+            # next job gets a fresh pool
+            self._executor = None
+            engine = create_db_engine(database_url)
+            try:
+                with sessionmaker(bind=engine)() as db:
+                    finished = _utcnow()
+                    crud.update_export_job(
+                        db, job_id, status="failed", error="Export worker process died",
+                        finished_at=finished, expires_at=finished + timedelta(seconds=EXPORT_JOB_TTL_SECONDS),
+                    )
+            finally:
+                engine.dispose()
+
+    def _beat(self) -> None:
+        while True:
+            time.sleep(EXPORT_JOB_HEARTBEAT_SECONDS)
+            try:
+                self.refresh_waiting()
+            except Exception:
+                logger.exception("Could not refresh queued export jobs")
+
+    def refresh_waiting(self) -> None:
+        """Marks this process's queued jobs as alive; the heartbeat thread calls it periodically."""
+        with self._lock:
+            waiting = dict(self._waiting)
+        by_url: Dict[str, list] = {}
+        for job_id, database_url in waiting.items():
+            by_url.setdefault(database_url, []).append(job_id)
+        for database_url, job_ids in by_url.items():
+            engine = create_db_engine(database_url)
+            try:
+                with sessionmaker(bind=engine)() as db:
+                    crud.touch_queued_export_jobs(db, job_ids)
+            finally:
+                engine.dispose()
+
+    def purge_expired(self, db: Session) -> None:
+        for job_id, format in crud.delete_expired_export_jobs(db):
+            try:
+                os.remove(result_path(job_id, format, self.directory))
+            except FileNotFoundError:
+                pass
+
+    def describe(self, job: models.ExportJob) -> schemas.ExportJob:
+        status = job.status
+        error = job.error
+        if status in crud.EXPORT_JOB_ACTIVE and _aware(job.updated_at) < _utcnow() - timedelta(seconds=EXPORT_JOB_STALE_SECONDS):
+            status, error = "failed", "Export worker stopped responding"
+        if status == "done":
+            progress = 100.0
+        else:
+            progress = round(job.processed / job.total * 100, 1) if job.total else 0.0
+        return schemas.ExportJob(
+            id=job.id, format=job.format, status=status, processed=job.processed, total=job.total,
+            progress=progress, size=job.size, error=error, created_at=_aware(job.created_at),
+            finished_at=_aware(job.finished_at), expires_at=_aware(job.expires_at),
+            download_url=f"/reports/defects/export/jobs/{job.id}/download" if status == "done" else None,
+        )
+
+    def result(self, job: models.ExportJob) -> Optional[str]:
+        # Path of a finished, unexpired result
+        if job.status != "done" or _aware(job.expires_at) <= _utcnow():
+            return None
+        path = result_path(job.id, job.format, self.directory)
+        return path if os.path.exists(path) else None
+
+runner = ExportJobRunner()
@@ -0,0 +1,35 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from . import crud, metrics
+
+# bcrypt cost factor; every +1 doubles the time of a hash/verify
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Upper bound on concurrent bcrypt computations; further logins queue for a free worker
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt releases the GIL while hashing, so a thread pool keeps the event loop free
+# without the pickling overhead of a process pool
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+def _timed(operation: str, fn, *args):
+    # Runs in the pool, so only the bcrypt work is measured, not the wait for a free worker
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        metrics.PASSWORD_HASH_DURATION.observe(time.perf_counter() - start, operation)
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _timed, "verify", crud.verify_password, plain_password, hashed_password, pwd_context)
+
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _timed, "hash", crud.get_password_hash, password, pwd_context)
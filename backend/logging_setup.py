@@ -0,0 +1,200 @@
+import atexit
+import fnmatch
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+# Logging pipeline: request threads only put records on a bounded queue; a QueueListener thread
+# formats them (JSON by default) and writes to a rotating file and stderr.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text
+LOG_FILE = os.getenv("LOG_FILE", "app.log")  # empty: no file
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_STDERR = os.getenv("LOG_STDERR", "1") != "0"
+# Records beyond this many waiting are dropped (and counted) rather than blocking a request
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Access log sampling: default rate, per-route overrides ("/reports/analytics/*=0.1,/users/me/=0"
+# matched against route templates such as /defects/{defect_id}); errors and slow requests are
+# always logged
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "1.0"))
+ACCESS_LOG_SAMPLE_RATES = os.getenv("ACCESS_LOG_SAMPLE_RATES", "")
+ACCESS_LOG_SLOW_MS = float(os.getenv("ACCESS_LOG_SLOW_MS", "1000"))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Attributes every LogRecord has; anything else was passed through extra= and goes into the JSON
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+# Immutable argument types that are safe to format later, on the listener thread
+_PLAIN_TYPES = (str, int, float, bool, type(None))
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread and never blocks the caller:
+    when the queue is full the record is dropped and counted in `dropped`.
+    """
+
+    def __init__(self, log_queue, maxsize: int = LOG_QUEUE_SIZE):
+        super().__init__(log_queue)
+        self.maxsize = maxsize
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare() formats the message here, in the request thread. Only arguments that
+        # could change before the listener gets to them (ORM objects, lists...) are rendered now.
+        args = record.args
+        if args:
+            values = args.values() if isinstance(args, dict) else args
+            if not all(isinstance(value, _PLAIN_TYPES) for value in values):
+                record.msg = record.getMessage()
+                record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+class BufferedStreamHandler(logging.StreamHandler):
+    """StreamHandler that writes without flushing; BatchingQueueListener flushes once the queue is drained."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+class BufferedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler without the per-record flush. The stock shouldRollover() also formats
+    every record a second time and stats the file; here the size comes from the stream position.
+    """
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            msg = self.format(record) + self.terminator
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes and self.stream.tell() + len(msg) >= self.maxBytes:
+                self.doRollover()
+            self.stream.write(msg)
+        except Exception:
+            self.handleError(record)
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    def dequeue(self, block: bool):
+        # About to wait for new records: push what has been written so far to the OS
+        if block and self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+        return self.queue.get(block)
+
+def parse_sample_rates(spec: str) -> List[Tuple[str, float]]:
+    rates = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        pattern, _, rate = part.rpartition("=")
+        if not pattern:
+            raise ValueError(f"ACCESS_LOG_SAMPLE_RATES entry must be pattern=rate: {part!r}")
+        rates.append((pattern.strip(), float(rate)))
+    return rates
+
+class AccessLogSampler:
+    def __init__(self, default_rate: float = 1.0, rates: Optional[List[Tuple[str, float]]] = None,
+                 slow_ms: float = ACCESS_LOG_SLOW_MS, rng: Callable[[], float] = random.random):
+        self.default_rate = default_rate
+        self.rates = rates or []
+        self.slow_ms = slow_ms
+        self.rng = rng
+
+    @classmethod
+    def from_env(cls) -> "AccessLogSampler":
+        return cls(ACCESS_LOG_SAMPLE_RATE, parse_sample_rates(ACCESS_LOG_SAMPLE_RATES), ACCESS_LOG_SLOW_MS)
+
+    def rate_for(self, route: str) -> float:
+        for pattern, rate in self.rates:
+            if fnmatch.fnmatchcase(route, pattern):
+                return rate
+        return self.default_rate
+
+    def sample(self, route: str, status_code: int, duration_ms: float) -> float:
+        # The rate the request was sampled at (1.0 for errors and slow requests), or 0 to skip it
+        if status_code >= 400 or duration_ms >= self.slow_ms:
+            return 1.0
+        rate = self.rate_for(route)
+        if rate >= 1:
+            return 1.0
+        return rate if rate > 0 and self.rng() < rate else 0.0
+
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, log_file: Optional[str] = LOG_FILE,
+                  stream=None, queue_size: int = LOG_QUEUE_SIZE) -> NonBlockingQueueHandler:
+    """Routes the root logger through the queue. Calling it again replaces the previous setup."""
+    global _queue_handler, _listener
+    shutdown_logging()
+
+    formatter = JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = []
+    if log_file:
+        handlers.append(BufferedRotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        ))
+    if stream is not None or LOG_STDERR:
+        handlers.append(BufferedStreamHandler(stream))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # SimpleQueue: a lock-free C queue; NonBlockingQueueHandler enforces the bound
+    log_queue = queue.SimpleQueue()
+    _queue_handler = NonBlockingQueueHandler(log_queue, maxsize=queue_size)
+    _listener = BatchingQueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_queue_handler)
+    return _queue_handler
+
+def shutdown_logging() -> None:
+    # Flushes what is still queued, then closes the file
+    global _queue_handler, _listener
+    if _listener is None:
+        return
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _queue_handler = _listener = None
+
+def dropped_records() -> int:
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+atexit.register(shutdown_logging)
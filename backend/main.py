@@ -1,41 +1,43 @@
 from datetime import datetime, timedelta
-from typing import Optional, List
-import csv
-from io import StringIO
+from functools import lru_cache
+from typing import Optional, List, Union
 import logging
+import mimetypes
 import time
-import io
-import shutil
 import os
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Depends, HTTPException, status, Query, Request, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Request, Response, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from sqlalchemy.orm import Session
+from pydantic import TypeAdapter
 from jose import JWTError, jwt
 from starlette.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from passlib.context import CryptContext
-from openpyxl import Workbook
-from starlette.responses import FileResponse
-from sqlalchemy import func, extract # Добавлен импорт func и extract
-
-from backend import crud, models, schemas
-from backend.database import engine, SessionLocal
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
-)
+
+from backend import crud, models, schemas, reports, pagination, hashing, conditional, versions, logging_setup, metrics, profiling, storage, downloads, thumbnails, export_jobs, backup_db
+from backend.cache import CachedResponse, response_cache, user_cache
+from backend.database import engine, SessionLocal, run_migrations
+
+# Configure logging: records are queued and written by a background thread (see backend/logging_setup.py)
+logging_setup.setup_logging()
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger("backend.access")
+access_sampler = logging_setup.AccessLogSampler.from_env()
 
-models.Base.metadata.create_all(bind=engine)
+metrics.register_pool(engine)
+backup_db.register_metrics()
+user_cache.metrics_hook = metrics.observe_auth_cache
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # On server startup rather than on import, so importing the app (tests, scripts) leaves the database alone
+    run_migrations()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost",
@@ -45,26 +47,55 @@ origins = [
 ]
 
 alle_origins = list(set(origins + ["http://10.0.85.2:3000", "http://localhost:3000"]))
-logger.info(f"Configuring CORS with allowed origins: {alle_origins}")
+logger.info("Configuring CORS with allowed origins: %s", alle_origins)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=alle_origins,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Authorization", "Content-Type"],
+    allow_headers=["Authorization", "Content-Type", "If-None-Match", "If-Modified-Since", "Range", "If-Range"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER, "ETag", "Last-Modified", "Accept-Ranges", "Content-Range", "Content-Disposition"],
 )
+# Oversized attachment uploads are refused before the body is received
+app.add_middleware(storage.UploadSizeLimit)
+
+# Profiled requests are sampled in the threadpool too (see backend/profiling.py)
+profiling.instrument_threadpool()
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    logger.info(f"Request: {request.method} {request.url} - Status: {response.status_code} - Time: {process_time:.4f}s")
+    start_time = time.perf_counter()
+    stats, token = metrics.request_started()
+    trace = profiling.profiler.start(request.method, request.url.path)
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        duration = time.perf_counter() - start_time
+        # Route templates (/defects/{defect_id}) keep label cardinality bounded
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "unmatched"
+        metrics.request_finished(request.method, route_path, status_code, duration, stats, token)
+        if trace is not None:
+            profiling.profiler.finish(trace, route_path, status_code, duration)
+    if access_logger.isEnabledFor(logging.INFO):
+        duration_ms = duration * 1000
+        sample_rate = access_sampler.sample(route_path, response.status_code, duration_ms)
+        if sample_rate:
+            access_logger.info(
+                "%s %s %s %.1fms", request.method, request.url.path, response.status_code, duration_ms,
+                extra={
+                    "method": request.method, "path": request.url.path, "query": request.url.query, "route": route_path,
+                    "status": response.status_code, "duration_ms": round(duration_ms, 1), "sample_rate": sample_rate,
+                    "db_ms": round(stats.db_seconds * 1000, 1), "statements": stats.statements,
+                },
+            )
     return response
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing (bcrypt runs in a bounded thread pool, see backend/hashing.py)
+pwd_context = hashing.pwd_context
 
 #Время хранения
 SECRET_KEY = "your-secret-key" # TODO: 
@@ -96,20 +127,30 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    start_time = time.perf_counter()
+    # Кэш: токен -> снимок пользователя, сбрасывается при изменении пользователя (см. backend/cache.py)
+    cached_user = user_cache.get(token)
+    if cached_user is not None:
+        user_cache.record(True, time.perf_counter() - start_time)
+        return cached_user
     try:
-        print(f"Attempting to decode token: {token}") # Добавлено логирование
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(f"Decoded payload: {payload}") # Добавлено логирование
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = schemas.TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = crud.get_user_by_username(db, username=token_data.username)
+    user = await run_in_threadpool(crud.get_user_by_username, db, username=token_data.username)
     if user is None:
         raise credentials_exception
-    return user
+    snapshot = schemas.User.model_validate(user)
+    # A cached token must not outlive its own expiry
+    ttl = min(user_cache.ttl, payload["exp"] - time.time()) if "exp" in payload else user_cache.ttl
+    if ttl > 0:
+        user_cache.set(token, snapshot, ttl=ttl)
+    user_cache.record(False, time.perf_counter() - start_time)
+    return snapshot
 
 async def get_current_active_user(current_user: schemas.User = Depends(get_current_user)):
     if not current_user.is_active:
@@ -122,12 +163,25 @@ async def get_current_active_user(current_user: schemas.User = Depends(get_curre
 async def read_root():
     return {"message": "Welcome to the Defect Management API"}
 
+# /token, /register/ and /users/ stay async to await bcrypt; their DB work runs in the threadpool.
+# Each helper closes the session afterwards, returning the connection to the pool while bcrypt
+# runs, so queued logins don't hold one each
+def _get_user_and_release(db: Session, username: str):
+    user = crud.get_user_by_username(db, username=username)
+    db.close()
+    return user
+
+def _user_exists_and_release(db: Session, user: schemas.UserCreate) -> bool:
+    exists = crud.get_user_by_email(db, email=user.email) is not None or crud.get_user_by_username(db, username=user.username) is not None
+    db.close()
+    return exists
+
 # Authentication endpoints
 @app.post("/token", response_model=schemas.Token, tags=["Authentication"])
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = crud.get_user_by_username(db, username=form_data.username)
-    if not user or not crud.verify_password(form_data.password, user.hashed_password, pwd_context):
-        logger.warning(f"Failed login attempt for username: {form_data.username}")
+    user = await run_in_threadpool(_get_user_and_release, db, form_data.username)
+    if not user or not await hashing.verify_password(form_data.password, user.hashed_password):
+        logger.warning("Failed login attempt for username: %s", form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -137,38 +191,37 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
     )
-    logger.info(f"User {user.username} logged in successfully.")
+    logger.info("User %s logged in successfully.", user.username)
     return {"access_token": access_token, "token_type": "bearer"}
 
 # User endpoints
 @app.post("/register/", response_model=schemas.User, tags=["Users"])
 async def register_new_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user_email = crud.get_user_by_email(db, email=user.email)
-    db_user_username = crud.get_user_by_username(db, username=user.username)
-    if db_user_email or db_user_username:
+    if await run_in_threadpool(_user_exists_and_release, db, user):
         raise HTTPException(status_code=400, detail="Username already taken")
-    return crud.create_user(db=db, user=user, pwd_context=pwd_context)
+    hashed_password = await hashing.hash_password(user.password)
+    return await run_in_threadpool(crud.create_user, db=db, user=user, hashed_password=hashed_password)
 
 @app.post("/users/", response_model=schemas.User, tags=["Users"])
 async def create_user_api(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user_email = crud.get_user_by_email(db, email=user.email)
-    db_user_username = crud.get_user_by_username(db, username=user.username)
-    if db_user_email or db_user_username:
+    if await run_in_threadpool(_user_exists_and_release, db, user):
         raise HTTPException(status_code=400, detail="Username already taken")
-    return crud.create_user(db=db, user=user, pwd_context=pwd_context)
+    hashed_password = await hashing.hash_password(user.password)
+    return await run_in_threadpool(crud.create_user, db=db, user=user, hashed_password=hashed_password)
 
 @app.get("/users/me/", response_model=schemas.User, tags=["Users"])
 async def read_users_me(current_user: schemas.User = Depends(get_current_active_user)):
-    logger.info(f"User {current_user.username} accessed their own profile.")
+    logger.info("User %s accessed their own profile.", current_user.username)
     return current_user
 
 @app.get("/users/", response_model=List[schemas.User])
-async def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = crud.get_users(db, skip=skip, limit=limit)
+def read_users(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    users = crud.get_users(db, skip=skip, limit=limit, after_id=pagination.decode_cursor(cursor))
+    pagination.set_next_cursor(response, users, limit)
     return users
 
 @app.put("/users/{user_id}/role", response_model=schemas.User, tags=["Users"])
-async def update_user_role(
+def update_user_role(
     user_id: int, 
     new_role: schemas.UserRole, 
     db: Session = Depends(get_db),
@@ -182,10 +235,11 @@ async def update_user_role(
         raise HTTPException(status_code=404, detail="User not found")
     
     updated_user = crud.update_user_role(db, user_id, new_role)
+    user_cache.invalidate_user(updated_user.username)
     return updated_user
 
 @app.get("/admin/users/", response_model=List[schemas.User], tags=["Admin"])
-async def read_all_users_admin(
+def read_all_users_admin(
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
@@ -194,40 +248,162 @@ async def read_all_users_admin(
     users = crud.get_users(db)
     return users
 
+@app.get("/admin/auth-cache", tags=["Admin"])
+def read_auth_cache_stats(current_user: schemas.User = Depends(get_current_active_user)):
+    if current_user.role != schemas.UserRole.admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access admin features")
+    return user_cache.stats()
+
+@app.get("/metrics", include_in_schema=False)
+def read_metrics(request: Request):
+    # Prometheus scrape endpoint; protected only when METRICS_TOKEN is set
+    if metrics.METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {metrics.METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/admin/response-cache", tags=["Admin"])
+def read_response_cache_stats(current_user: schemas.User = Depends(get_current_active_user)):
+    if current_user.role != schemas.UserRole.admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access admin features")
+    return response_cache.stats()
+
+@app.get("/admin/profiling", response_model=schemas.ProfilingSettings, tags=["Admin"])
+def read_profiling_settings(current_user: schemas.User = Depends(get_current_active_user)):
+    if current_user.role != schemas.UserRole.admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access admin features")
+    return profiling.profiler.current_settings().as_dict()
+
+@app.put("/admin/profiling", response_model=schemas.ProfilingSettings, tags=["Admin"])
+def update_profiling_settings(update: schemas.ProfilingSettingsUpdate, current_user: schemas.User = Depends(get_current_active_user)):
+    # Takes effect immediately here and within a second in the other worker processes
+    if current_user.role != schemas.UserRole.admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access admin features")
+    settings = profiling.profiler.update_settings(**update.model_dump(exclude_unset=True))
+    logger.info("User %s changed profiling settings: %s", current_user.username, settings.as_dict())
+    return settings.as_dict()
+
+@app.get("/admin/profiles", tags=["Admin"])
+def read_profiles(limit: int = Query(50, ge=1, le=profiling.PROFILE_MAX_FILES), current_user: schemas.User = Depends(get_current_active_user)):
+    if current_user.role != schemas.UserRole.admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access admin features")
+    return profiling.profiler.list_profiles(limit)
+
+@app.get("/admin/profiles/{profile_id}", tags=["Admin"])
+def read_profile(profile_id: str, current_user: schemas.User = Depends(get_current_active_user)):
+    if current_user.role != schemas.UserRole.admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access admin features")
+    profile = profiling.profiler.load(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
 @app.get("/users/{user_id}", response_model=schemas.User, tags=["Users"])
 def read_user(user_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
     db_user = crud.get_user(db, user_id=user_id)
     if db_user is None:
-        logger.warning(f"User {current_user.username} tried to access non-existent user with ID: {user_id}.")
+        logger.warning("User %s tried to access non-existent user with ID: %s.", current_user.username, user_id)
         raise HTTPException(status_code=404, detail="User not found")
-    logger.info(f"User {current_user.username} accessed user with ID: {user_id}.")
+    logger.info("User %s accessed user with ID: %s.", current_user.username, user_id)
     return db_user
 
+# List endpoints return flat summary rows; relations are nested only when named in ?expand=
+PROJECT_EXPANSIONS = {"defects"}
+DEFECT_EXPANSIONS = set(crud.DEFECT_RELATION_NAMES)
+
+def parse_expand(expand: Optional[str], allowed: set) -> set:
+    requested = {part.strip() for part in expand.split(",") if part.strip()} if expand else set()
+    unknown = requested - allowed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot expand: {', '.join(sorted(unknown))}")
+    return requested
+
+@lru_cache(maxsize=None)
+def _list_adapter(model) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+def list_response(model, rows, exclude: Optional[set] = None) -> Response:
+    # Serialized straight to JSON bytes, skipping jsonable_encoder and response_model re-validation
+    adapter = _list_adapter(model)
+    items = adapter.validate_python(rows, from_attributes=True)
+    content = adapter.dump_json(items, exclude={"__all__": exclude} if exclude else None)
+    return Response(content=content, media_type="application/json")
+
+def version_validators(request: Request, db: Session, tables: tuple) -> tuple:
+    # (ETag, Last-Modified, version state) for a GET whose body depends only on the URL and the
+    # rows of `tables`. Every committed write to one of them bumps its data version, so the ETag
+    # is strong and can be checked before querying or serializing anything.
+    state = versions.current(db, tables)
+    etag = conditional.make_etag(request.url.path, sorted(request.query_params.multi_items()), versions.tag(state))
+    return etag, versions.last_modified(state), state
+
+def cached_response(request: Request, db: Session, tables: tuple, build) -> Response:
+    # build() returns the JSON body and only runs when nothing is cached for the current data
+    # versions of `tables`; clients that already have this body get 304
+    etag, last_modified, state = version_validators(request, db, tables)
+    headers = conditional.validator_headers(etag, last_modified)
+    if conditional.is_not_modified(request, etag, last_modified):
+        return conditional.not_modified_response(headers)
+    key = response_cache.key(request.url.path, request.query_params.multi_items(), versions.tag(state))
+    entry = response_cache.get(key)
+    if entry is None:
+        entry = CachedResponse(build(), etag, last_modified)
+        response_cache.set(key, entry)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+# Tables each representation is built from: a project embeds its defects, a defect its comments
+# and attachments
+PROJECT_TABLES = ("projects", "defects", "comments", "attachments")
+DEFECT_TABLES = ("defects", "comments", "attachments")
+
 # Project API endpoints
 @app.post("/users/{user_id}/projects/", response_model=schemas.Project, tags=["Projects"])
 def create_project_for_user(
     user_id: int, project: schemas.ProjectCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)
 ):
     if current_user.id != user_id and current_user.role not in [schemas.UserRole.manager, schemas.UserRole.admin]:
-        logger.warning(f"User {current_user.username} tried to create project for another user {user_id}.")
+        logger.warning("User %s tried to create project for another user %s.", current_user.username, user_id)
         raise HTTPException(status_code=403, detail="Not authorized to create projects for this user")
     new_project = crud.create_user_project(db=db, project=project, user_id=user_id)
-    logger.info(f"User {current_user.username} created project {new_project.title} (ID: {new_project.id}).")
+    logger.info("User %s created project %s (ID: %s).", current_user.username, new_project.title, new_project.id)
     return new_project
 
-@app.get("/projects/", response_model=List[schemas.Project], tags=["Projects"])
-def read_projects(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
-    projects = crud.get_projects(db, skip=skip, limit=limit)
-    logger.info(f"User {current_user.username} accessed list of projects.")
-    return projects
+@app.get("/projects/", response_model=List[Union[schemas.Project, schemas.ProjectSummary]], tags=["Projects"])
+def read_projects(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    expand: Optional[str] = Query(None, description="Comma-separated relations to nest: defects"),
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    expansions = parse_expand(expand, PROJECT_EXPANSIONS)
+    etag, last_modified, _ = version_validators(request, db, PROJECT_TABLES if expansions else ("projects",))
+    headers = conditional.validator_headers(etag, last_modified)
+    if conditional.is_not_modified(request, etag, last_modified):
+        return conditional.not_modified_response(headers)
+    projects = crud.get_projects(
+        db, skip=skip, limit=limit, after_id=pagination.decode_cursor(cursor), load_relations=bool(expansions)
+    )
+    response = list_response(schemas.Project if expansions else schemas.ProjectSummary, projects)
+    response.headers.update(headers)
+    pagination.set_next_cursor(response, projects, limit)
+    logger.info("User %s accessed list of projects.", current_user.username)
+    return response
 
 @app.get("/projects/{project_id}", response_model=schemas.Project, tags=["Projects"])
-def read_project(project_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
-    db_project = crud.get_project(db, project_id=project_id)
+def read_project(project_id: int, request: Request, response: Response, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
+    etag, last_modified, _ = version_validators(request, db, PROJECT_TABLES)
+    headers = conditional.validator_headers(etag, last_modified)
+    # The ETag comes from table versions, not the row, so it can match for an id that does not exist
+    if conditional.is_not_modified(request, etag, last_modified) and crud.project_exists(db, project_id):
+        return conditional.not_modified_response(headers)
+    db_project = crud.get_project(db, project_id=project_id, load_relations=True)
     if db_project is None:
-        logger.warning(f"User {current_user.username} tried to access non-existent project with ID: {project_id}.")
+        logger.warning("User %s tried to access non-existent project with ID: %s.", current_user.username, project_id)
         raise HTTPException(status_code=404, detail="Project not found")
-    logger.info(f"User {current_user.username} accessed project {db_project.title} (ID: {project_id}).")
+    logger.info("User %s accessed project %s (ID: %s).", current_user.username, db_project.title, project_id)
+    response.headers.update(headers)
     return db_project
 
 @app.put("/projects/{project_id}", response_model=schemas.Project, tags=["Projects"])
@@ -236,26 +412,26 @@ def update_project(
 ):
     db_project = crud.get_project(db, project_id=project_id)
     if db_project is None:
-        logger.warning(f"User {current_user.username} tried to update non-existent project with ID: {project_id}.")
+        logger.warning("User %s tried to update non-existent project with ID: %s.", current_user.username, project_id)
         raise HTTPException(status_code=404, detail="Project not found")
     if db_project.owner_id != current_user.id and current_user.role not in [schemas.UserRole.admin]:
-        logger.warning(f"User {current_user.username} not authorized to update project {project_id}.")
+        logger.warning("User %s not authorized to update project %s.", current_user.username, project_id)
         raise HTTPException(status_code=403, detail="Not authorized to update this project")
     updated_project = crud.update_project(db=db, project_id=project_id, project=project)
-    logger.info(f"User {current_user.username} updated project {updated_project.title} (ID: {project_id}).")
+    logger.info("User %s updated project %s (ID: %s).", current_user.username, updated_project.title, project_id)
     return updated_project
 
 @app.delete("/projects/{project_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Projects"])
 def delete_project(project_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
     db_project = crud.get_project(db, project_id=project_id)
     if db_project is None:
-        logger.warning(f"User {current_user.username} tried to delete non-existent project with ID: {project_id}.")
+        logger.warning("User %s tried to delete non-existent project with ID: %s.", current_user.username, project_id)
         raise HTTPException(status_code=404, detail="Project not found")
     if db_project.owner_id != current_user.id and current_user.role not in [schemas.UserRole.admin]:
-        logger.warning(f"User {current_user.username} not authorized to delete project {project_id}.")
+        logger.warning("User %s not authorized to delete project %s.", current_user.username, project_id)
         raise HTTPException(status_code=403, detail="Not authorized to delete this project")
     crud.delete_project(db=db, project_id=project_id)
-    logger.info(f"User {current_user.username} deleted project (ID: {project_id}).")
+    logger.info("User %s deleted project (ID: %s).", current_user.username, project_id)
     return
 
 # Defect API endpoints
@@ -273,7 +449,7 @@ def create_defect_for_project(
     return new_defect
 
 @app.post("/defects/", response_model=schemas.Defect, tags=["Defects"])
-async def create_defect_global(
+def create_defect_global(
     defect: schemas.DefectCreate,
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
@@ -282,10 +458,58 @@ async def create_defect_global(
         raise HTTPException(status_code=403, detail="Not authorized to create defects")
     return crud.create_defect(db=db, defect=defect, reporter_id=current_user.id)
 
-@app.get("/defects/", response_model=List[schemas.Defect], tags=["Defects"])
+# Rows per POST /defects/bulk request; 0 disables the check. Larger sets go in several requests
+# or through POST /defects/import.
+BULK_CREATE_MAX_ROWS = int(os.getenv("BULK_CREATE_MAX_ROWS", "10000"))
+
+@app.post("/defects/bulk", response_model=schemas.DefectImportResult, tags=["Defects"])
+def create_defects_bulk(
+    payload: schemas.DefectBulkCreate,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    if current_user.role not in [schemas.UserRole.manager, schemas.UserRole.engineer, schemas.UserRole.admin]:
+        raise HTTPException(status_code=403, detail="Not authorized to create defects")
+    if BULK_CREATE_MAX_ROWS and len(payload.defects) > BULK_CREATE_MAX_ROWS:
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=f"At most {BULK_CREATE_MAX_ROWS} defects can be created per request")
+    result = crud.bulk_create_defects(db, enumerate(payload.defects, start=1), reporter_id=current_user.id)
+    logger.info("User %s bulk-created %s defects (%s rejected).", current_user.username, result.created, result.failed)
+    return result
+
+@app.post("/defects/import", response_model=schemas.DefectImportResult, tags=["Defects"])
+def import_defects(
+    file: UploadFile = File(..., description="CSV or XLSX file in the /reports/defects/export layout"),
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    if current_user.role not in [schemas.UserRole.manager, schemas.UserRole.engineer, schemas.UserRole.admin]:
+        raise HTTPException(status_code=403, detail="Not authorized to create defects")
+    filename = (file.filename or "").lower()
+    if filename.endswith(".csv"):
+        rows = reports.iter_csv_import(file.file)
+    elif filename.endswith(".xlsx"):
+        rows = reports.iter_xlsx_import(file.file)
+    else:
+        raise HTTPException(status_code=400, detail="Unsupported file format. Upload a .csv or .xlsx file.")
+    # Chunks are committed as they are read: if the file breaks off midway, the rows before the
+    # break stay imported and the response says where it stopped
+    read_errors = []
+    result = crud.bulk_create_defects(db, reports.read_until_error(rows, read_errors), reporter_id=current_user.id)
+    if read_errors:
+        row_number, error = read_errors[0]
+        if not result.created:
+            raise HTTPException(status_code=400, detail=f"Could not read {file.filename}: {error}")
+        result.stopped_at_row, result.error = row_number, f"Could not read {file.filename} from row {row_number}: {error}"
+        logger.warning("Import of %s by %s stopped at row %s: %s", file.filename, current_user.username, row_number, error)
+    logger.info("User %s imported %s defects from %s (%s rejected).", current_user.username, result.created, file.filename, result.failed)
+    return result
+
+@app.get("/defects/", response_model=List[Union[schemas.Defect, schemas.DefectSummary]], tags=["Defects"])
 def read_defects(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     project_id: Optional[int] = Query(None),
     status: Optional[schemas.DefectStatus] = Query(None),
     priority: Optional[schemas.DefectPriority] = Query(None),
@@ -296,13 +520,27 @@ def read_defects(
     due_start_date: Optional[datetime] = Query(None),
     due_end_date: Optional[datetime] = Query(None),
     search_query: Optional[str] = Query(None),
+    ranked: bool = Query(False, description="Order search_query matches by relevance instead of id"),
+    expand: Optional[str] = Query(None, description="Comma-separated relations to nest: comments, attachments"),
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
+    if ranked and cursor:
+        raise HTTPException(status_code=400, detail="Cursor pagination is not available for ranked search")
+    expansions = parse_expand(expand, DEFECT_EXPANSIONS)
+    # Search also matches comment text
+    tables = ("defects", *sorted(expansions | ({"comments"} if search_query else set())))
+    etag, last_modified, _ = version_validators(request, db, tables)
+    headers = conditional.validator_headers(etag, last_modified)
+    if conditional.is_not_modified(request, etag, last_modified):
+        return conditional.not_modified_response(headers)
     defects = crud.get_defects(
         db=db,
         skip=skip,
         limit=limit,
+        after_id=pagination.decode_cursor(cursor),
+        ranked=ranked,
+        relations=expansions,
         project_id=project_id,
         status=status,
         priority=priority,
@@ -314,46 +552,92 @@ def read_defects(
         due_end_date=due_end_date,
         search_query=search_query,
     )
-    logger.info(f"User {current_user.username} accessed list of defects with filters.")
-    return defects
+    if expansions:
+        response = list_response(schemas.Defect, defects, exclude=DEFECT_EXPANSIONS - expansions)
+    else:
+        response = list_response(schemas.DefectSummary, defects)
+    response.headers.update(headers)
+    if not ranked:
+        pagination.set_next_cursor(response, defects, limit)
+    logger.info("User %s accessed list of defects with filters.", current_user.username)
+    return response
 
 @app.get("/defects/{defect_id}", response_model=schemas.Defect, tags=["Defects"])
-def read_defect(defect_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
-    db_defect = crud.get_defect(db, defect_id=defect_id)
+def read_defect(defect_id: int, request: Request, response: Response, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
+    etag, last_modified, _ = version_validators(request, db, DEFECT_TABLES)
+    headers = conditional.validator_headers(etag, last_modified)
+    # The ETag comes from table versions, not the row, so it can match for an id that does not exist
+    if conditional.is_not_modified(request, etag, last_modified) and crud.defect_exists(db, defect_id):
+        return conditional.not_modified_response(headers)
+    db_defect = crud.get_defect(db, defect_id=defect_id, load_relations=True)
     if db_defect is None:
-        logger.warning(f"User {current_user.username} tried to access non-existent defect with ID: {defect_id}.")
+        logger.warning("User %s tried to access non-existent defect with ID: %s.", current_user.username, defect_id)
         raise HTTPException(status_code=404, detail="Defect not found")
-    logger.info(f"User {current_user.username} accessed defect {db_defect.title} (ID: {defect_id}).")
+    logger.info("User %s accessed defect %s (ID: %s).", current_user.username, db_defect.title, defect_id)
+    response.headers.update(headers)
     return db_defect
 
+MAX_BATCH_UPDATE = 1000
+
+# Declared before /defects/{defect_id} so "batch" is not taken for a defect id
+@app.put("/defects/batch", response_model=List[schemas.DefectSummary], tags=["Defects"])
+def update_defects_batch(
+    batch: schemas.DefectBatchUpdate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)
+):
+    if batch.items and (batch.ids or batch.patch):
+        raise HTTPException(status_code=400, detail="Send either ids with patch, or items")
+    if batch.items:
+        patches = {item.id: schemas.DefectUpdate(**item.model_dump(exclude_unset=True, exclude={"id"})) for item in batch.items}
+    elif batch.ids and batch.patch is not None:
+        patches = {defect_id: batch.patch for defect_id in batch.ids}
+    else:
+        raise HTTPException(status_code=400, detail="Nothing to update")
+    if len(patches) > MAX_BATCH_UPDATE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_UPDATE} defects can be updated at once")
+
+    # Same rules as update_defect, checked for every defect before anything is written
+    owners = {defect_id: (reporter_id, assignee_id) for defect_id, reporter_id, assignee_id in crud.get_defect_owners(db, patches)}
+    missing = sorted(set(patches) - set(owners))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Defects not found: {', '.join(map(str, missing))}")
+    if current_user.role not in [schemas.UserRole.manager, schemas.UserRole.admin]:
+        forbidden = sorted(defect_id for defect_id, ids in owners.items() if current_user.id not in ids)
+        if forbidden:
+            logger.warning("User %s not authorized to update defects %s.", current_user.username, forbidden)
+            raise HTTPException(status_code=403, detail=f"Not authorized to update defects: {', '.join(map(str, forbidden))}")
+
+    updated = crud.batch_update_defects(db, patches)
+    logger.info("User %s batch-updated %s defects.", current_user.username, len(updated))
+    return updated
+
 @app.put("/defects/{defect_id}", response_model=schemas.Defect, tags=["Defects"])
 def update_defect(
     defect_id: int, defect: schemas.DefectUpdate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)
 ):
     db_defect = crud.get_defect(db, defect_id=defect_id)
     if db_defect is None:
-        logger.warning(f"User {current_user.username} tried to update non-existent defect with ID: {defect_id}.")
+        logger.warning("User %s tried to update non-existent defect with ID: %s.", current_user.username, defect_id)
         raise HTTPException(status_code=404, detail="Defect not found")
     # Only reporter, assignee, or manager can update
     if current_user.id not in [db_defect.reporter_id, db_defect.assignee_id] and current_user.role not in [schemas.UserRole.manager, schemas.UserRole.admin]:
-        logger.warning(f"User {current_user.username} not authorized to update defect {defect_id}.")
+        logger.warning("User %s not authorized to update defect %s.", current_user.username, defect_id)
         raise HTTPException(status_code=403, detail="Not authorized to update this defect")
     updated_defect = crud.update_defect(db=db, defect_id=defect_id, defect=defect)
-    logger.info(f"User {current_user.username} updated defect {updated_defect.title} (ID: {defect_id}).")
+    logger.info("User %s updated defect %s (ID: %s).", current_user.username, updated_defect.title, defect_id)
     return updated_defect
 
 @app.delete("/defects/{defect_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Defects"])
 def delete_defect(defect_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
     db_defect = crud.get_defect(db, defect_id=defect_id)
     if db_defect is None:
-        logger.warning(f"User {current_user.username} tried to delete non-existent defect with ID: {defect_id}.")
+        logger.warning("User %s tried to delete non-existent defect with ID: %s.", current_user.username, defect_id)
         raise HTTPException(status_code=404, detail="Defect not found")
     # Only reporter or manager can delete
     if current_user.id != db_defect.reporter_id and current_user.role not in [schemas.UserRole.manager, schemas.UserRole.admin]:
-        logger.warning(f"User {current_user.username} not authorized to delete defect {defect_id}.")
+        logger.warning("User %s not authorized to delete defect %s.", current_user.username, defect_id)
         raise HTTPException(status_code=403, detail="Not authorized to delete this defect")
     crud.delete_defect(db=db, defect_id=defect_id)
-    logger.info(f"User {current_user.username} deleted defect (ID: {defect_id}).")
+    logger.info("User %s deleted defect (ID: %s).", current_user.username, defect_id)
     return
 
 # Comment API endpoints
@@ -363,17 +647,18 @@ def create_comment_for_defect(
 ):
     db_defect = crud.get_defect(db, defect_id=defect_id)
     if db_defect is None:
-        logger.warning(f"User {current_user.username} tried to create comment for non-existent defect with ID: {defect_id}.")
+        logger.warning("User %s tried to create comment for non-existent defect with ID: %s.", current_user.username, defect_id)
         raise HTTPException(status_code=404, detail="Defect not found")
     new_comment = crud.create_comment(db=db, comment=comment, author_id=current_user.id)
-    logger.info(f"User {current_user.username} added comment (ID: {new_comment.id}) to defect {defect_id}.")
+    logger.info("User %s added comment (ID: %s) to defect %s.", current_user.username, new_comment.id, defect_id)
     return new_comment
 
 @app.get("/defects/{defect_id}/comments/", response_model=List[schemas.Comment], tags=["Comments"])
-def read_comments_for_defect(defect_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
+def read_comments_for_defect(defect_id: int, response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
     # Add authorization check if needed, for now all authenticated users can view comments
-    comments = db.query(models.Comment).filter(models.Comment.defect_id == defect_id).offset(skip).limit(limit).all()
-    logger.info(f"User {current_user.username} accessed comments for defect {defect_id}.")
+    comments = crud.get_comments_for_defect(db, defect_id=defect_id, skip=skip, limit=limit, after_id=pagination.decode_cursor(cursor))
+    pagination.set_next_cursor(response, comments, limit)
+    logger.info("User %s accessed comments for defect %s.", current_user.username, defect_id)
     return comments
 
 @app.put("/comments/{comment_id}", response_model=schemas.Comment, tags=["Comments"])
@@ -382,26 +667,26 @@ def update_comment(
 ):
     db_comment = crud.get_comment(db, comment_id=comment_id)
     if db_comment is None:
-        logger.warning(f"User {current_user.username} tried to update non-existent comment with ID: {comment_id}.")
+        logger.warning("User %s tried to update non-existent comment with ID: %s.", current_user.username, comment_id)
         raise HTTPException(status_code=404, detail="Comment not found")
     if db_comment.author_id != current_user.id and current_user.role not in [schemas.UserRole.manager, schemas.UserRole.admin]: # Only author or manager/admin can update
-        logger.warning(f"User {current_user.username} not authorized to update comment {comment_id}.")
+        logger.warning("User %s not authorized to update comment %s.", current_user.username, comment_id)
         raise HTTPException(status_code=403, detail="Not authorized to update this comment")
     updated_comment = crud.update_comment(db=db, comment_id=comment_id, comment=comment)
-    logger.info(f"User {current_user.username} updated comment (ID: {comment_id}) for defect {updated_comment.defect_id}.")
+    logger.info("User %s updated comment (ID: %s) for defect %s.", current_user.username, comment_id, updated_comment.defect_id)
     return updated_comment
 
 @app.delete("/comments/{comment_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Comments"])
 def delete_comment(comment_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
     db_comment = crud.get_comment(db, comment_id=comment_id)
     if db_comment is None:
-        logger.warning(f"User {current_user.username} tried to delete non-existent comment with ID: {comment_id}.")
+        logger.warning("User %s tried to delete non-existent comment with ID: %s.", current_user.username, comment_id)
         raise HTTPException(status_code=404, detail="Comment not found")
     if db_comment.author_id != current_user.id and current_user.role not in [schemas.UserRole.manager, schemas.UserRole.admin]: # Only author or manager/admin can delete
-        logger.warning(f"User {current_user.username} not authorized to delete comment {comment_id}.")
+        logger.warning("User %s not authorized to delete comment %s.", current_user.username, comment_id)
         raise HTTPException(status_code=403, detail="Not authorized to delete this comment")
     crud.delete_comment(db=db, comment_id=comment_id)
-    logger.info(f"User {current_user.username} deleted comment (ID: {comment_id}).")
+    logger.info("User %s deleted comment (ID: %s).", current_user.username, comment_id)
     return
 
 # Attachment API endpoints
@@ -414,36 +699,41 @@ def create_upload_attachment_for_defect(
 ):
     db_defect = crud.get_defect(db, defect_id=defect_id)
     if db_defect is None:
-        logger.warning(f"User {current_user.username} tried to create attachment for non-existent defect with ID: {defect_id}.")
+        logger.warning("User %s tried to create attachment for non-existent defect with ID: %s.", current_user.username, defect_id)
         raise HTTPException(status_code=404, detail="Defect not found")
     
     # Check if the user is authorized to add attachments to this defect
     if current_user.role not in [schemas.UserRole.manager, schemas.UserRole.engineer, schemas.UserRole.admin]:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to add attachments")
 
-    upload_dir = f"./attachments/{defect_id}"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_location = f"{upload_dir}/{file.filename}"
+    # Stored once per distinct content; a file that is already stored is only hashed
+    try:
+        blob = storage.store_upload(db, file.file, defect_id)
+    except storage.QuotaExceeded as e:
+        logger.warning("User %s exceeded an attachment quota on defect %s: %s", current_user.username, defect_id, e)
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=str(e))
 
-    with open(file_location, "wb+") as file_object:
-        shutil.copyfileobj(file.file, file_object)
-    
-    attachment_create = schemas.AttachmentCreate(defect_id=defect_id, filename=file.filename, file_path=file_location)
+    attachment_create = schemas.AttachmentCreate(defect_id=defect_id, filename=file.filename, file_path=blob.path, sha256=blob.sha256, size=blob.size)
     new_attachment = crud.create_attachment(db=db, attachment=attachment_create, uploader_id=current_user.id)
-    logger.info(f"User {current_user.username} added attachment {new_attachment.filename} (ID: {new_attachment.id}) to defect {defect_id}.")
+    storage.ensure_stored(file.file, blob)
+    # Thumbnail/preview generation runs in a background pool; the upload does not wait for it
+    thumbnails.schedule(blob.path, mimetypes.guess_type(new_attachment.filename)[0])
+    logger.info("User %s added attachment %s (ID: %s) to defect %s.", current_user.username, new_attachment.filename, new_attachment.id, defect_id)
     return new_attachment
 
 @app.get("/defects/{defect_id}/attachments/", response_model=List[schemas.Attachment], tags=["Attachments"])
-def read_attachments_for_defect(defect_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
+def read_attachments_for_defect(defect_id: int, response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
     # Add authorization check if needed, for now all authenticated users can view attachments
-    attachments = db.query(models.Attachment).filter(models.Attachment.defect_id == defect_id).offset(skip).limit(limit).all()
-    logger.info(f"User {current_user.username} accessed attachments for defect {defect_id}.")
+    attachments = crud.get_attachments_for_defect(db, defect_id=defect_id, skip=skip, limit=limit, after_id=pagination.decode_cursor(cursor))
+    pagination.set_next_cursor(response, attachments, limit)
+    logger.info("User %s accessed attachments for defect %s.", current_user.username, defect_id)
     return attachments
 
 @app.get("/defects/{defect_id}/attachments/{attachment_id}/download", tags=["Attachments"], summary="Download an attachment")
 def download_attachment(
     defect_id: int,
     attachment_id: int,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
@@ -453,11 +743,45 @@ def download_attachment(
     
     # Add authorization check if needed
 
-    file_path = db_attachment.file_path
-    if not os.path.exists(file_path):
+    # Blob paths have no extension, so the type comes from the original file name
+    media_type = mimetypes.guess_type(db_attachment.filename)[0] or "application/octet-stream"
+    # Range requests (resume), ETag/If-None-Match and caching headers: see backend/downloads.py
+    response = downloads.attachment_response(request, db_attachment.file_path, db_attachment.filename, media_type, db_attachment.sha256)
+    if response is None:
         raise HTTPException(status_code=404, detail="File not found on server")
+    return response
 
-    return FileResponse(file_path, filename=db_attachment.filename)
+@app.get("/defects/{defect_id}/attachments/{attachment_id}/{variant}", tags=["Attachments"], summary="Downscaled JPEG of an image attachment")
+def read_attachment_preview(
+    defect_id: int,
+    attachment_id: int,
+    variant: schemas.AttachmentVariant,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    db_attachment = crud.get_attachment(db, attachment_id=attachment_id)
+    if db_attachment is None or db_attachment.defect_id != defect_id:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    # Previews are keyed by the blob hash, so attachments stored before content addressing have none
+    if db_attachment.sha256 is None or not thumbnails.is_image(mimetypes.guess_type(db_attachment.filename)[0]):
+        raise HTTPException(status_code=404, detail="No preview for this attachment")
+
+    content_id = f"{db_attachment.sha256}-{variant.value}"
+    # A cached copy is revalidated without waiting for (or checking) the generated file
+    if conditional.is_not_modified(request, f'"{content_id}"'):
+        return conditional.not_modified_response(conditional.validator_headers(f'"{content_id}"', cache_control=conditional.IMMUTABLE_CACHE_CONTROL))
+    try:
+        path = thumbnails.get_variant(db_attachment.file_path, variant.value)
+    except FutureTimeoutError:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Preview is being generated", headers={"Retry-After": "5"})
+    except thumbnails.PoolFull as e:
+        logger.warning("Preview queue is full: %s", e)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many previews are being generated, try again later", headers={"Retry-After": "5"})
+    if path is None:
+        raise HTTPException(status_code=404, detail="No preview for this attachment")
+    filename = f"{os.path.splitext(db_attachment.filename)[0]}.{variant.value}.jpg"
+    return downloads.attachment_response(request, path, filename, thumbnails.MEDIA_TYPE, content_id, disposition="inline")
 
 @app.delete("/defects/{defect_id}/attachments/{attachment_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Attachments"])
 def delete_attachment(
@@ -473,15 +797,24 @@ def delete_attachment(
     if current_user.id != db_attachment.uploader_id and current_user.role not in [schemas.UserRole.manager, schemas.UserRole.admin]:
         raise HTTPException(status_code=403, detail="Not authorized to delete this attachment")
 
-    file_path = db_attachment.file_path
-    if os.path.exists(file_path):
-        os.remove(file_path)
-
     crud.delete_attachment(db=db, attachment_id=attachment_id)
-    logger.info(f"User {current_user.username} deleted attachment {db_attachment.filename} (ID: {attachment_id}) from defect {defect_id}.")
+    # A blob left without references is removed by `python -m backend.storage gc` (see backend/storage.py)
+    if db_attachment.sha256 is None and os.path.exists(db_attachment.file_path):
+        os.remove(db_attachment.file_path)
+    logger.info("User %s deleted attachment %s (ID: %s) from defect %s.", current_user.username, db_attachment.filename, attachment_id, defect_id)
     return
 
 # Reporting API endpoint
+EXPORT_BATCH_SIZE = 1000
+
+def _log_stream_errors(chunks):
+    # Once streaming has started the status code is already sent, so failures can only be logged
+    try:
+        yield from chunks
+    except Exception as e:
+        logger.error("Error exporting defects report: %s", e, exc_info=True)
+        raise
+
 @app.get("/reports/defects/export", response_class=StreamingResponse, tags=["Reports"], summary="Export defects to CSV/Excel")
 def export_defects_to_csv_excel(
     db: Session = Depends(get_db),
@@ -500,11 +833,12 @@ def export_defects_to_csv_excel(
 ):
     try:
         if current_user.role not in [schemas.UserRole.manager, schemas.UserRole.observer, schemas.UserRole.admin, schemas.UserRole.engineer]:
-            logger.warning(f"User {current_user.username} not authorized to export reports.")
+            logger.warning("User %s not authorized to export reports.", current_user.username)
             raise HTTPException(status_code=403, detail="Not authorized to export reports")
 
-        defects = crud.get_defects(
+        defects = crud.iter_defect_export_rows(
             db=db,
+            batch_size=EXPORT_BATCH_SIZE,
             project_id=project_id,
             status=status,
             priority=priority,
@@ -520,70 +854,67 @@ def export_defects_to_csv_excel(
         headers = {"Content-Disposition": f"attachment; filename=\"defects_report.{format}\""}
 
         if format == "csv":
-            output = StringIO()
-            writer = csv.writer(output)
-
-            # Write header
-            writer.writerow(["ID", "Title", "Description", "Priority", "Status", "Created At", "Updated At", "Due Date", "Reporter ID", "Assignee ID", "Project ID"])
-
-            # Write data
-            for defect in defects:
-                writer.writerow([
-                    defect.id,
-                    defect.title,
-                    defect.description,
-                    defect.priority if defect.priority else "",
-                    defect.status if defect.status else "",
-                    defect.created_at.isoformat() if defect.created_at else "",
-                    defect.updated_at.isoformat() if defect.updated_at else "",
-                    defect.due_date.isoformat() if defect.due_date else "",
-                    defect.reporter_id,
-                    defect.assignee_id,
-                    defect.project_id
-                ])
-
-            output.seek(0)
-            logger.info(f"User {current_user.username} exported defects report to CSV.")
-            return StreamingResponse(output, headers=headers, media_type="text/csv")
-
+            content, media_type = reports.iter_csv(defects), reports.CSV_MEDIA_TYPE
         elif format == "xlsx":
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Defects Report"
-
-            # Write header
-            ws.append(["ID", "Title", "Description", "Priority", "Status", "Created At", "Updated At", "Due Date", "Reporter ID", "Assignee ID", "Project ID"])
-
-            # Write data
-            for defect in defects:
-                ws.append([
-                    defect.id,
-                    defect.title,
-                    defect.description,
-                    defect.priority if defect.priority else "",
-                    defect.status if defect.status else "",
-                    defect.created_at.isoformat() if defect.created_at else "",
-                    defect.updated_at.isoformat() if defect.updated_at else "",
-                    defect.due_date.isoformat() if defect.due_date else "",
-                    defect.reporter_id,
-                    defect.assignee_id,
-                    defect.project_id
-                ])
-
-            excel_file = io.BytesIO()
-            wb.save(excel_file)
-            excel_file.seek(0)
-            
-            logger.info(f"User {current_user.username} exported defects report to XLSX.")
-            return StreamingResponse(excel_file, headers=headers, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-
+            content, media_type = reports.iter_xlsx(defects), reports.XLSX_MEDIA_TYPE
         else:
             raise HTTPException(status_code=400, detail="Invalid format. Choose 'csv' or 'xlsx'.")
+
+        logger.info("User %s exported defects report to %s.", current_user.username, format.upper())
+        return StreamingResponse(_log_stream_errors(content), headers=headers, media_type=media_type)
+    except HTTPException as e:
+        raise e
     except Exception as e:
-        logger.error(f"Error exporting defects report: {e}", exc_info=True)
+        logger.error("Error exporting defects report: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to generate report.")
 
+EXPORT_ROLES = [schemas.UserRole.manager, schemas.UserRole.observer, schemas.UserRole.admin, schemas.UserRole.engineer]
+
+@app.post("/reports/defects/export/jobs", response_model=schemas.ExportJob, status_code=status.HTTP_202_ACCEPTED, tags=["Reports"], summary="Start a background defects export")
+def create_export_job(
+    export: schemas.ExportJobCreate,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    if current_user.role not in EXPORT_ROLES:
+        logger.warning("User %s not authorized to export reports.", current_user.username)
+        raise HTTPException(status_code=403, detail="Not authorized to export reports")
+    try:
+        job = export_jobs.runner.submit(db, export, current_user.id)
+    except export_jobs.QueueFull as e:
+        logger.warning("Export queue is full: %s", e)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many exports in progress, try again later", headers={"Retry-After": "30"})
+    logger.info("User %s requested %s export job %s.", current_user.username, export.format.upper(), job.id)
+    return export_jobs.runner.describe(job)
+
+def _get_export_job(db: Session, job_id: str, current_user: schemas.User) -> models.ExportJob:
+    # Jobs are shared by everyone who asks for the same export, so any user allowed to export can read them
+    if current_user.role not in EXPORT_ROLES:
+        raise HTTPException(status_code=403, detail="Not authorized to export reports")
+    job = crud.get_export_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return job
+
+@app.get("/reports/defects/export/jobs/{job_id}", response_model=schemas.ExportJob, tags=["Reports"], summary="Export job status and progress")
+def read_export_job(job_id: str, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
+    return export_jobs.runner.describe(_get_export_job(db, job_id, current_user))
+
+@app.get("/reports/defects/export/jobs/{job_id}/download", tags=["Reports"], summary="Download a finished export")
+def download_export_job(job_id: str, request: Request, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
+    job = _get_export_job(db, job_id, current_user)
+    if job.status != "done":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Export job is {export_jobs.runner.describe(job).status}")
+    path = export_jobs.runner.result(job)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Export has expired")
+    # A job's file never changes: strong ETag, Range and immutable caching as for attachments
+    return downloads.attachment_response(request, path, f"defects_report.{job.format}", export_jobs.MEDIA_TYPES[job.format], job.id)
+
 # Analytics API endpoints
+# Cached per query string until a write to one of these tables (see cached_response)
+ANALYTICS_TABLES = ("defects", "projects")
+
 @app.get("/reports/analytics/summary", response_model=schemas.AnalyticsSummary, tags=["Analytics"], summary="Get summary analytics for defects and projects")
 def get_analytics_summary(
     db: Session = Depends(get_db),
@@ -595,27 +926,10 @@ def get_analytics_summary(
         if current_user.role not in [schemas.UserRole.manager, schemas.UserRole.observer, schemas.UserRole.admin, schemas.UserRole.engineer]:
             raise HTTPException(status_code=403, detail="Not authorized to view analytics")
 
-        query = db.query(models.Defect)
-        if start_date: query = query.filter(models.Defect.created_at >= start_date)
-        if end_date: query = query.filter(models.Defect.created_at <= end_date)
-        defects = query.all()
-
-        total_defects = len(defects)
-        
-        overdue_defects = 0
-        completed_defects = 0
-        active_projects_set = set()
-
-        for defect in defects:
-            if defect.due_date and defect.due_date < datetime.now() and defect.status not in [schemas.DefectStatus.closed, schemas.DefectStatus.cancelled]:
-                overdue_defects += 1
-            if defect.status in [schemas.DefectStatus.closed, schemas.DefectStatus.cancelled]:
-                completed_defects += 1
-            if defect.status not in [schemas.DefectStatus.closed, schemas.DefectStatus.cancelled]:
-                active_projects_set.add(defect.project_id)
-        
+        total_defects, overdue_defects, completed_defects, active_projects = crud.get_defect_summary(
+            db, start_date=start_date, end_date=end_date
+        )
         completion_percentage = (completed_defects / total_defects * 100) if total_defects > 0 else 0.0
-        active_projects = len(active_projects_set)
 
         return schemas.AnalyticsSummary(
             total_defects=total_defects,
@@ -626,11 +940,12 @@ def get_analytics_summary(
     except HTTPException as e:
         raise e
     except Exception as e:
-        logger.error(f"Error in get_analytics_summary: {e}", exc_info=True)
+        logger.error("Error in get_analytics_summary: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to retrieve summary analytics.")
 
 @app.get("/reports/analytics/status-distribution", response_model=List[schemas.DefectCountByStatus], tags=["Analytics"], summary="Get defect distribution by status")
 def get_status_distribution(
+    request: Request,
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user),
     start_date: Optional[datetime] = Query(None),
@@ -640,20 +955,20 @@ def get_status_distribution(
         if current_user.role not in [schemas.UserRole.manager, schemas.UserRole.observer, schemas.UserRole.admin, schemas.UserRole.engineer]:
             raise HTTPException(status_code=403, detail="Not authorized to view analytics")
         
-        query = db.query(models.Defect.status, func.count(models.Defect.id)).group_by(models.Defect.status)
-        if start_date: query = query.filter(models.Defect.created_at >= start_date)
-        if end_date: query = query.filter(models.Defect.created_at <= end_date)
-        
-        results = query.all()
-        return [schemas.DefectCountByStatus(status=status, count=count) for status, count in results]
+        def build():
+            results = crud.get_defect_counts(db, "status", start_date, end_date)
+            return _list_adapter(schemas.DefectCountByStatus).dump_json([schemas.DefectCountByStatus(status=status, count=count) for status, count in results])
+
+        return cached_response(request, db, ANALYTICS_TABLES, build)
     except HTTPException as e:
         raise e
     except Exception as e:
-        logger.error(f"Error in get_status_distribution: {e}", exc_info=True)
+        logger.error("Error in get_status_distribution: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to retrieve status distribution.")
 
 @app.get("/reports/analytics/priority-distribution", response_model=List[schemas.DefectCountByPriority], tags=["Analytics"], summary="Get defect distribution by priority")
 def get_priority_distribution(
+    request: Request,
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user),
     start_date: Optional[datetime] = Query(None),
@@ -663,16 +978,15 @@ def get_priority_distribution(
         if current_user.role not in [schemas.UserRole.manager, schemas.UserRole.observer, schemas.UserRole.admin, schemas.UserRole.engineer]:
             raise HTTPException(status_code=403, detail="Not authorized to view analytics")
 
-        query = db.query(models.Defect.priority, func.count(models.Defect.id)).group_by(models.Defect.priority)
-        if start_date: query = query.filter(models.Defect.created_at >= start_date)
-        if end_date: query = query.filter(models.Defect.created_at <= end_date)
-        
-        results = query.all()
-        return [schemas.DefectCountByPriority(priority=priority, count=count) for priority, count in results]
+        def build():
+            results = crud.get_defect_counts(db, "priority", start_date, end_date)
+            return _list_adapter(schemas.DefectCountByPriority).dump_json([schemas.DefectCountByPriority(priority=priority, count=count) for priority, count in results])
+
+        return cached_response(request, db, ANALYTICS_TABLES, build)
     except HTTPException as e:
         raise e
     except Exception as e:
-        logger.error(f"Error in get_priority_distribution: {e}", exc_info=True)
+        logger.error("Error in get_priority_distribution: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to retrieve priority distribution.")
 
 @app.get("/reports/analytics/creation-trend", response_model=List[schemas.DefectCreationTrendItem], tags=["Analytics"], summary="Get defect creation trend over time")
@@ -688,24 +1002,20 @@ def get_creation_trend(
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
 
-        # Group by date (year, month, day)
-        results = db.query(
-            func.date(models.Defect.created_at).label('date'),
-            func.count(models.Defect.id).label('count')
-        ).filter(
-            models.Defect.created_at >= start_date,
-            models.Defect.created_at <= end_date
-        ).group_by(func.date(models.Defect.created_at)).order_by('date').all()
-
-        return [schemas.DefectCreationTrendItem(date=date, count=count) for date, count in results]
+        results = crud.get_defect_creation_trend(db, start_date, end_date)
+        return [
+            schemas.DefectCreationTrendItem(date=datetime.combine(day, datetime.min.time()), count=count)
+            for day, count in results
+        ]
     except HTTPException as e:
         raise e
     except Exception as e:
-        logger.error(f"Error in get_creation_trend: {e}", exc_info=True)
+        logger.error("Error in get_creation_trend: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to retrieve creation trend.")
 
 @app.get("/reports/analytics/project-performance", response_model=List[schemas.ProjectPerformanceItem], tags=["Analytics"], summary="Get project performance statistics")
 def get_project_performance(
+    request: Request,
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user),
     start_date: Optional[datetime] = Query(None),
@@ -715,50 +1025,22 @@ def get_project_performance(
         if current_user.role not in [schemas.UserRole.manager, schemas.UserRole.observer, schemas.UserRole.admin]:
             raise HTTPException(status_code=403, detail="Not authorized to view analytics")
 
-        # Subquery for total defects per project
-        total_defects_subquery = db.query(
-            models.Defect.project_id,
-            func.count(models.Defect.id).label('total_defects')
-        ).group_by(models.Defect.project_id).subquery()
-
-        # Subquery for completed defects per project
-        completed_defects_subquery = db.query(
-            models.Defect.project_id,
-            func.count(models.Defect.id).label('completed_defects')
-        ).filter(
-            models.Defect.status.in_([schemas.DefectStatus.closed, schemas.DefectStatus.cancelled])
-        ).group_by(models.Defect.project_id).subquery()
-
-        # Main query to join project info with defect counts
-        results = db.query(
-            models.Project.id,
-            models.Project.title,
-            total_defects_subquery.c.total_defects,
-            completed_defects_subquery.c.completed_defects
-        ).outerjoin(
-            total_defects_subquery,
-            models.Project.id == total_defects_subquery.c.project_id
-        ).outerjoin(
-            completed_defects_subquery,
-            models.Project.id == completed_defects_subquery.c.project_id
-        ).all()
-
-        performance_data = []
-        for project_id, project_title, total_defects, completed_defects in results:
-            total_defects = total_defects if total_defects is not None else 0
-            completed_defects = completed_defects if completed_defects is not None else 0
-            completion_percentage = (completed_defects / total_defects * 100) if total_defects > 0 else 0.0
-            performance_data.append(schemas.ProjectPerformanceItem(
-                project_id=project_id,
-                project_title=project_title,
-                completed_defects=completed_defects,
-                total_defects=total_defects,
-                completion_percentage=round(completion_percentage, 2)
-            ))
-        
-        return performance_data
+        def build():
+            performance_data = []
+            for project_id, project_title, total_defects, completed_defects in crud.get_project_performance(db):
+                completion_percentage = (completed_defects / total_defects * 100) if total_defects > 0 else 0.0
+                performance_data.append(schemas.ProjectPerformanceItem(
+                    project_id=project_id,
+                    project_title=project_title,
+                    completed_defects=completed_defects,
+                    total_defects=total_defects,
+                    completion_percentage=round(completion_percentage, 2)
+                ))
+            return _list_adapter(schemas.ProjectPerformanceItem).dump_json(performance_data)
+
+        return cached_response(request, db, ANALYTICS_TABLES, build)
     except HTTPException as e:
         raise e
     except Exception as e:
-        logger.error(f"Error in get_project_performance: {e}", exc_info=True)
+        logger.error("Error in get_project_performance: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to retrieve project performance.")
@@ -0,0 +1,214 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import logging_setup
+from .cache import response_cache, user_cache
+
+# In-process metrics in the Prometheus text format (served at GET /metrics).
+# Recording is a dict lookup, a bisect and a few additions under a per-metric lock; all the
+# formatting happens at scrape time. Each worker process keeps its own numbers.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# When set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+BCRYPT_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.5, 5.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def render(self) -> list:
+        """Exposition lines for this metric, header included."""
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, key)} {_number(v)}" for key, v in values]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labelvalues) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def snapshot(self, *labelvalues) -> Tuple[list, float]:
+        with self._lock:
+            counts, total = self._series.get(labelvalues, [[0] * (len(self.buckets) + 1), 0.0])
+            return list(counts), total
+
+    def render(self) -> list:
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        lines = self.header()
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class CallbackMetric(Metric):
+    """Value(s) read at scrape time: callback() returns a number or an iterable of (labelvalues, number)."""
+
+    def __init__(self, name: str, documentation: str, callback: Callable, kind: str = "gauge", labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.callback = callback
+
+    def render(self) -> list:
+        result = self.callback()
+        samples: Iterable = [((), result)] if isinstance(result, (int, float)) else result
+        return self.header() + [f"{self.name}{_labels(self.labelnames, key)} {_number(v)}" for key, v in samples]
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+_in_progress = [0]
+
+HTTP_REQUESTS = REGISTRY.register(Counter("http_requests_total", "HTTP requests by route template and status", ("method", "route", "status")))
+HTTP_DURATION = REGISTRY.register(Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route")))
+HTTP_DB_DURATION = REGISTRY.register(Histogram(
+    "http_request_db_duration_seconds", "Time spent in SQL statements per HTTP request", ("method", "route"), SQL_BUCKETS + (2.5, 5.0, 10.0)
+))
+HTTP_IN_PROGRESS = REGISTRY.register(CallbackMetric("http_requests_in_progress", "HTTP requests being served", lambda: _in_progress[0]))
+SQL_DURATION = REGISTRY.register(Histogram("db_statement_duration_seconds", "SQL statement execution time", ("operation",), SQL_BUCKETS))
+PASSWORD_HASH_DURATION = REGISTRY.register(Histogram("password_hash_duration_seconds", "bcrypt hash/verify time", ("operation",), BCRYPT_BUCKETS))
+AUTH_CACHE_LOOKUPS = REGISTRY.register(Counter("auth_cache_lookups_total", "Current-user lookups by cache result", ("result",)))
+REGISTRY.register(CallbackMetric("auth_cache_entries", "Tokens in the current-user cache", lambda: len(user_cache)))
+REGISTRY.register(CallbackMetric(
+    "response_cache_requests_total", "Response cache lookups by result",
+    lambda: [((result,), response_cache.stats()[key]) for result, key in (("hit", "hits"), ("miss", "misses"), ("error", "errors"))],
+    kind="counter", labelnames=("result",),
+))
+REGISTRY.register(CallbackMetric(
+    "log_records_dropped_total", "Log records dropped because the logging queue was full", logging_setup.dropped_records, kind="counter"
+))
+
+class RequestStats:
+    __slots__ = ("db_seconds", "statements")
+
+    def __init__(self):
+        self.db_seconds = 0.0
+        self.statements = 0
+
+# Set by the request middleware; sync handlers run in the threadpool with a copy of the context,
+# which still points at the same RequestStats object
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+def request_started() -> Tuple[RequestStats, object]:
+    _in_progress[0] += 1
+    stats = RequestStats()
+    return stats, current_request.set(stats)
+
+def request_finished(method: str, route: str, status_code: int, seconds: float, stats: RequestStats, token) -> None:
+    _in_progress[0] -= 1
+    current_request.reset(token)
+    HTTP_REQUESTS.inc(method, route, status_code)
+    HTTP_DURATION.observe(seconds, method, route)
+    HTTP_DB_DURATION.observe(stats.db_seconds, method, route)
+
+def observe_auth_cache(hit: bool, seconds: float) -> None:
+    AUTH_CACHE_LOOKUPS.inc("hit" if hit else "miss")
+
+def register_pool(engine) -> None:
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return  # SQLite :memory: / StaticPool have no pool to report on
+    REGISTRY.register(CallbackMetric("db_pool_checked_out", "Connections currently checked out of the pool", pool.checkedout))
+    REGISTRY.register(CallbackMetric("db_pool_size", "Configured pool size", pool.size))
+    REGISTRY.register(CallbackMetric("db_pool_overflow", "Connections open beyond the pool size (negative: unused pool slots)", pool.overflow))
+
+# Every engine in the process (the app's, scripts', tests') reports statement timings.
+# The start time rides on the execution context, which lives exactly as long as the statement.
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_start = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_metrics_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    operation = statement.lstrip()[:6].upper()
+    SQL_DURATION.observe(elapsed, operation if operation in ("SELECT", "INSERT", "UPDATE", "DELETE") else "OTHER")
+    stats = current_request.get()
+    if stats is not None:
+        stats.db_seconds += elapsed
+        stats.statements += 1
@@ -0,0 +1,114 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+
+Databases created before migrations were introduced (via Base.metadata.create_all)
+already have these tables; they are left untouched and only stamped.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("username", sa.String(), nullable=False),
+            sa.Column("email", sa.String(), nullable=False),
+            sa.Column("hashed_password", sa.String(), nullable=False),
+            sa.Column("role", sa.Enum("manager", "engineer", "observer", "admin", name="user_roles"), nullable=False),
+            sa.Column("is_active", sa.Boolean(), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_username", "users", ["username"], unique=True)
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    if "projects" not in existing:
+        op.create_table(
+            "projects",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("title", sa.String(), nullable=False),
+            sa.Column("description", sa.Text(), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.Column("owner_id", sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(["owner_id"], ["users.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_projects_id", "projects", ["id"])
+        op.create_index("ix_projects_title", "projects", ["title"])
+
+    if "defects" not in existing:
+        op.create_table(
+            "defects",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("title", sa.String(), nullable=False),
+            sa.Column("description", sa.Text(), nullable=True),
+            sa.Column("priority", sa.Enum("Низкий", "Средний", "Высокий", "Критический", name="defect_priorities"), nullable=False),
+            sa.Column("status", sa.Enum("Новая", "В работе", "На проверке", "Закрыта", "Отменена", name="defect_statuses"), nullable=False),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("due_date", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("reporter_id", sa.Integer(), nullable=False),
+            sa.Column("assignee_id", sa.Integer(), nullable=True),
+            sa.Column("project_id", sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(["assignee_id"], ["users.id"]),
+            sa.ForeignKeyConstraint(["project_id"], ["projects.id"]),
+            sa.ForeignKeyConstraint(["reporter_id"], ["users.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_defects_id", "defects", ["id"])
+        op.create_index("ix_defects_title", "defects", ["title"])
+
+    if "comments" not in existing:
+        op.create_table(
+            "comments",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("content", sa.Text(), nullable=False),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.Column("author_id", sa.Integer(), nullable=False),
+            sa.Column("defect_id", sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(["author_id"], ["users.id"]),
+            sa.ForeignKeyConstraint(["defect_id"], ["defects.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_comments_id", "comments", ["id"])
+
+    if "attachments" not in existing:
+        op.create_table(
+            "attachments",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("filename", sa.String(), nullable=False),
+            sa.Column("file_path", sa.String(), nullable=False),
+            sa.Column("uploaded_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.Column("uploader_id", sa.Integer(), nullable=False),
+            sa.Column("defect_id", sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(["defect_id"], ["defects.id"]),
+            sa.ForeignKeyConstraint(["uploader_id"], ["users.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_attachments_id", "attachments", ["id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("attachments")
+    op.drop_table("comments")
+    op.drop_table("defects")
+    op.drop_table("projects")
+    op.drop_table("users")
@@ -0,0 +1,46 @@
+"""indexes for the defect filter combinations
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+
+Covers the filters issued by GET /defects/ and /reports/defects/export, plus the
+per-defect lookups of comments and attachments.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DEFECT_INDEXES = {
+    "ix_defects_project_status": ["project_id", "status"],
+    "ix_defects_project_priority": ["project_id", "priority"],
+    "ix_defects_status_priority": ["status", "priority"],
+    "ix_defects_priority": ["priority"],
+    "ix_defects_assignee_status": ["assignee_id", "status"],
+    "ix_defects_reporter_status": ["reporter_id", "status"],
+    "ix_defects_created_at": ["created_at"],
+    "ix_defects_due_date_status": ["due_date", "status"],
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for name, columns in DEFECT_INDEXES.items():
+        op.create_index(name, "defects", columns)
+    op.create_index("ix_comments_defect_id", "comments", ["defect_id"])
+    op.create_index("ix_attachments_defect_id", "attachments", ["defect_id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_attachments_defect_id", table_name="attachments")
+    op.drop_index("ix_comments_defect_id", table_name="comments")
+    for name in reversed(list(DEFECT_INDEXES)):
+        op.drop_index(name, table_name="defects")
@@ -0,0 +1,31 @@
+"""full-text search index for defects
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00
+
+SQLite only: an FTS5 table over defect titles, descriptions and comments, kept in
+sync by triggers. Other backends (or SQLite without FTS5) keep using LIKE.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from backend import search
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    search.create_search_index(op.get_bind())
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    search.drop_search_index(op.get_bind())
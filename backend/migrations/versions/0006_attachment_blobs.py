@@ -0,0 +1,45 @@
+"""content-addressed attachment blobs
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 00:00:00
+
+blobs holds one row per stored file (by SHA-256) with the number of attachments using it;
+attachments gain the hash and size of their blob. Existing attachments keep their file_path
+and have NULL sha256.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, Sequence[str], None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "blobs",
+        sa.Column("sha256", sa.String(length=64), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("ref_count", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint("sha256"),
+    )
+    op.add_column("attachments", sa.Column("sha256", sa.String(length=64), nullable=True))
+    op.add_column("attachments", sa.Column("size", sa.Integer(), nullable=True))
+    op.create_index("ix_attachments_sha256", "attachments", ["sha256"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_attachments_sha256", table_name="attachments")
+    with op.batch_alter_table("attachments") as batch_op:
+        batch_op.drop_column("size")
+        batch_op.drop_column("sha256")
+    op.drop_table("blobs")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Enum
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, ForeignKey, Text, Enum, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -53,6 +53,21 @@ class Defect(Base):
     comments = relationship("Comment", back_populates="defect")
     attachments = relationship("Attachment", back_populates="defect")
 
+    # Composite indexes for the filter combinations of GET /defects/ and the export (migration 0002)
+    __table_args__ = (
+        Index("ix_defects_project_status", "project_id", "status"),
+        Index("ix_defects_project_priority", "project_id", "priority"),
+        Index("ix_defects_status_priority", "status", "priority"),
+        Index("ix_defects_priority", "priority"),
+        Index("ix_defects_assignee_status", "assignee_id", "status"),
+        Index("ix_defects_reporter_status", "reporter_id", "status"),
+        Index("ix_defects_created_at", "created_at"),
+        Index("ix_defects_due_date_status", "due_date", "status"),
+    )
+
+    # created_at (a server default) is read back on INSERT so rollups can bucket the new row by day
+    __mapper_args__ = {"eager_defaults": True}
+
 class Comment(Base):
     __tablename__ = "comments"
 
@@ -60,7 +75,7 @@ class Comment(Base):
     content = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     author_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    defect_id = Column(Integer, ForeignKey("defects.id"), nullable=False)
+    defect_id = Column(Integer, ForeignKey("defects.id"), nullable=False, index=True)
 
     author = relationship("User", back_populates="comments")
     defect = relationship("Defect", back_populates="comments")
@@ -73,7 +88,64 @@ class Attachment(Base):
     file_path = Column(String, nullable=False)
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
     uploader_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    defect_id = Column(Integer, ForeignKey("defects.id"), nullable=False)
+    defect_id = Column(Integer, ForeignKey("defects.id"), nullable=False, index=True)
+    # Content hash of the stored blob (see backend/storage.py); NULL for files uploaded before blobs
+    sha256 = Column(String(64), nullable=True, index=True)
+    size = Column(Integer, nullable=True)
 
     uploader = relationship("User", back_populates="attachments")
     defect = relationship("Defect", back_populates="attachments")
+
+# Content-addressed attachment files; ref_count is the number of attachments pointing at the blob
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+# Analytics rollups, maintained by backend/rollups.py in the same transaction as defect writes
+class DefectCount(Base):
+    __tablename__ = "defect_counts"
+
+    project_id = Column(Integer, primary_key=True)
+    status = Column(String, primary_key=True)
+    priority = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class DefectDailyCount(Base):
+    __tablename__ = "defect_daily_counts"
+
+    day = Column(Date, primary_key=True)
+    project_id = Column(Integer, primary_key=True)
+    status = Column(String, primary_key=True)
+    priority = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+# One row per tracked table, bumped by backend/versions.py in every transaction that writes to it
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+
+# Background defect exports (backend/export_jobs.py); the worker process updates progress here
+class ExportJob(Base):
+    __tablename__ = "export_jobs"
+
+    id = Column(String(32), primary_key=True)
+    # Hash of format, filters and the defects data version: identical requests share a job
+    key = Column(String(64), nullable=False, index=True)
+    format = Column(String, nullable=False)
+    status = Column(String, nullable=False)  # queued | running | done | failed
+    processed = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=True)
+    size = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+    created_by = Column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=True, index=True)
@@ -0,0 +1,365 @@
+import functools
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import anyio.to_thread
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Opt-in request profiling. While enabled, a sampler thread records the stacks of threads that are
+# serving a request every PROFILE_INTERVAL_MS, and each request collects its SQL statements with
+# timings. When the request ends the profile is kept if the request was sampled (PROFILE_SAMPLE_RATE)
+# or ran longer than PROFILE_SLOW_MS, and written as JSON to PROFILE_DIR, where only the newest
+# PROFILE_MAX_FILES are kept. Disabled, the cost per request is one settings check.
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "1000"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+
+MAX_STACK_DEPTH = 64
+MAX_STATEMENTS = 500
+MAX_STATEMENT_LENGTH = 2000
+TOP_STACKS = 100
+
+# Settings changed through PUT /admin/profiling are written here; every worker process re-reads
+# the file when its mtime changes (checked at most once per second)
+SETTINGS_FILE = "settings.json"
+_RELOAD_INTERVAL = 1.0
+PROFILE_ID = re.compile(r"^\d{13}-[0-9a-f]{8}$")
+
+class Settings:
+    __slots__ = ("enabled", "sample_rate", "slow_ms", "interval_ms")
+
+    def __init__(self, enabled: bool = PROFILE_ENABLED, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 slow_ms: float = PROFILE_SLOW_MS, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.interval_ms = interval_ms
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class Profiler:
+    def __init__(self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES,
+                 settings: Optional[Settings] = None, rng=random.random):
+        self.directory = directory
+        self.max_files = max_files
+        self.settings = settings or Settings()
+        self.rng = rng
+        self.kept = 0
+        self._settings_mtime = None
+        self._next_reload = 0.0
+        self._sampler: Optional[threading.Thread] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    # --- Settings ---
+
+    def _settings_path(self) -> str:
+        return os.path.join(self.directory, SETTINGS_FILE)
+
+    def current_settings(self) -> Settings:
+        now = time.monotonic()
+        if now >= self._next_reload:
+            self._next_reload = now + _RELOAD_INTERVAL
+            try:
+                mtime = os.stat(self._settings_path()).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime is not None and mtime != self._settings_mtime:
+                self._settings_mtime = mtime
+                self._load_settings()
+        return self.settings
+
+    def _load_settings(self) -> None:
+        try:
+            with open(self._settings_path(), encoding="utf-8") as f:
+                values = json.load(f)
+            self.settings = Settings(**{name: values[name] for name in Settings.__slots__ if name in values})
+        except (OSError, ValueError, TypeError):
+            logger.exception("Could not read profiling settings from %s", self._settings_path())
+
+    def update_settings(self, **values) -> Settings:
+        current = self.current_settings().as_dict()
+        current.update({name: value for name, value in values.items() if value is not None})
+        self.settings = Settings(**current)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._settings_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(current, f)
+        os.replace(tmp_path, self._settings_path())
+        self._settings_mtime = os.stat(self._settings_path()).st_mtime_ns
+        return self.settings
+
+    # --- Request lifecycle ---
+
+    def start(self, method: str, path: str) -> Optional["Trace"]:
+        settings = self.current_settings()
+        if not settings.enabled:
+            return None
+        trace = Trace(method, path, settings)
+        trace.token = current_trace.set(trace)
+        # The thread running the middleware (the event loop) serves the request until it hops to
+        # the threadpool; those hops tag their worker thread themselves (see instrument_threadpool)
+        _tag_thread(trace)
+        self._ensure_sampler()
+        return trace
+
+    def finish(self, trace: "Trace", route: str, status_code: int, duration: float) -> Optional[str]:
+        """Stops sampling the request and writes its profile if it is kept. Returns the profile id."""
+        current_trace.reset(trace.token)
+        # Threadpool hops untag their threads when they return; this is the thread start() tagged
+        _untag_thread(trace)
+        with self._lock:
+            samples = Counter(trace.samples)
+        duration_ms = duration * 1000
+        if duration_ms >= trace.settings.slow_ms:
+            reason = "slow"
+        elif trace.settings.sample_rate > 0 and self.rng() < trace.settings.sample_rate:
+            reason = "sampled"
+        else:
+            return None
+        profile_id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        profile = trace.to_dict(profile_id, route, status_code, duration_ms, reason, samples, trace.unattributed)
+        self.kept += 1
+        # File I/O stays off the event loop
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-writer")
+        self._writer.submit(self._write, profile_id, profile)
+        return profile_id
+
+    def _write(self, profile_id: str, profile: dict) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = os.path.join(self.directory, profile_id + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(profile, f, default=str)
+            os.replace(tmp_path, os.path.join(self.directory, profile_id + ".json"))
+            for old_id in self.profile_ids()[self.max_files:]:
+                os.remove(os.path.join(self.directory, old_id + ".json"))
+        except OSError:
+            logger.exception("Could not write profile %s", profile_id)
+
+    def flush(self) -> None:
+        # Waits for pending profile writes (tests, shutdown)
+        if self._writer is not None:
+            self._writer.submit(lambda: None).result()
+
+    # --- Reading profiles ---
+
+    def profile_ids(self) -> List[str]:
+        # Newest first; ids start with a millisecond timestamp
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted((name[:-5] for name in names if name.endswith(".json") and PROFILE_ID.match(name[:-5])), reverse=True)
+
+    def list_profiles(self, limit: int = 50) -> List[dict]:
+        summaries = []
+        for profile_id in self.profile_ids()[:limit]:
+            profile = self.load(profile_id)
+            if profile is not None:
+                summaries.append({key: profile[key] for key in SUMMARY_FIELDS})
+        return summaries
+
+    def load(self, profile_id: str) -> Optional[dict]:
+        if not PROFILE_ID.match(profile_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, profile_id + ".json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # --- Sampler ---
+
+    def _ensure_sampler(self) -> None:
+        if self._sampler is None or not self._sampler.is_alive():
+            with self._lock:
+                if self._sampler is None or not self._sampler.is_alive():
+                    self._sampler = threading.Thread(target=self._sample_loop, name="profile-sampler", daemon=True)
+                    self._sampler.start()
+
+    def _sample_loop(self) -> None:
+        while True:
+            # Sleeps until some thread is tagged with a request being profiled
+            _threads_active.wait()
+            time.sleep(self.settings.interval_ms / 1000)
+            frames = sys._current_frames()
+            with self._lock:
+                if not _active_threads:
+                    _threads_active.clear()
+                    continue
+                # Copied first: request threads tag and untag themselves without the lock
+                for thread_id, traces in list(_active_threads.items()):
+                    frame = frames.get(thread_id)
+                    # An event loop waiting in select() is not doing work for the request
+                    if frame is None or frame.f_code.co_filename.endswith("selectors.py"):
+                        continue
+                    traces = set(traces)
+                    if len(traces) == 1:
+                        traces.pop().samples[_stack(frame)] += 1
+                    else:
+                        # The event loop interleaves these requests; the stack belongs to one of them
+                        for trace in traces:
+                            trace.unattributed += 1
+            del frames
+
+SUMMARY_FIELDS = ("id", "created_at", "method", "path", "route", "status", "duration_ms", "reason", "sql_ms", "statements", "samples")
+
+def _stack(frame) -> tuple:
+    # Root-first tuple of (code, line); formatted only for the profiles that are kept
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        stack.append((frame.f_code, frame.f_lineno))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+def _frame_name(code, lineno: int) -> str:
+    return f"{code.co_name} ({code.co_filename}:{lineno})"
+
+class Trace:
+    __slots__ = ("method", "path", "settings", "started", "started_at", "samples", "unattributed", "statements", "sql_seconds", "token")
+
+    def __init__(self, method: str, path: str, settings: Settings):
+        self.method = method
+        self.path = path
+        self.settings = settings
+        self.started = time.perf_counter()
+        self.started_at = datetime.now(timezone.utc)
+        self.samples: Counter = Counter()
+        # Samples taken while the thread was shared with other profiled requests
+        self.unattributed = 0
+        self.statements: List[dict] = []
+        self.sql_seconds = 0.0
+        self.token = None
+
+    def to_dict(self, profile_id: str, route: str, status_code: int, duration_ms: float, reason: str, samples: Counter, unattributed: int = 0) -> dict:
+        stacks = [
+            {"count": count, "frames": [_frame_name(code, lineno) for code, lineno in stack]}
+            for stack, count in samples.most_common(TOP_STACKS)
+        ]
+        # Self/total sample counts per function, a flat view of the same samples
+        functions: Dict[str, List[int]] = {}
+        for stack, count in samples.items():
+            seen = set()
+            for i, (code, _) in enumerate(stack):
+                name = f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                entry = functions.setdefault(name, [0, 0])
+                if i == len(stack) - 1:
+                    entry[0] += count
+                if name not in seen:
+                    entry[1] += count
+                    seen.add(name)
+        return {
+            "id": profile_id,
+            "created_at": self.started_at.isoformat(timespec="milliseconds"),
+            "method": self.method,
+            "path": self.path,
+            "route": route,
+            "status": status_code,
+            "duration_ms": round(duration_ms, 2),
+            "reason": reason,
+            "interval_ms": self.settings.interval_ms,
+            "samples": sum(samples.values()),
+            "unattributed_samples": unattributed,
+            "sql_ms": round(self.sql_seconds * 1000, 2),
+            "statements": len(self.statements),
+            "sql": self.statements,
+            "stacks": stacks,
+            "functions": [
+                {"function": name, "self": own, "total": total}
+                for name, (own, total) in sorted(functions.items(), key=lambda item: -item[1][1])[:TOP_STACKS]
+            ],
+            # Collapsed stacks ("a;b;c count"), the input format of flamegraph tools
+            "collapsed": [
+                ";".join(code.co_name for code, _ in stack) + f" {count}" for stack, count in samples.most_common()
+            ],
+        }
+
+# Set by the request middleware and copied into the threadpool for sync handlers
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+# Threads currently working for profiled requests: the event loop thread from the start of each
+# request, a threadpool thread while it runs a sync endpoint, dependency or response validation
+# for one. Only its own thread changes a thread's list. A thread listing several requests (the
+# event loop with several in flight) is not sampled into any of them; each counts the sample as
+# unattributed instead.
+_active_threads: Dict[int, List[Trace]] = {}
+_threads_active = threading.Event()
+_run_sync = anyio.to_thread.run_sync
+
+def _tag_thread(trace: Trace) -> None:
+    _active_threads.setdefault(threading.get_ident(), []).append(trace)
+    _threads_active.set()
+
+def _untag_thread(trace: Trace) -> None:
+    thread_id = threading.get_ident()
+    traces = _active_threads.get(thread_id)
+    if traces is not None and trace in traces:
+        traces.remove(trace)
+        if not traces:
+            _active_threads.pop(thread_id, None)
+
+def _run_tagged(trace: Trace, func, *args):
+    _tag_thread(trace)
+    try:
+        return func(*args)
+    finally:
+        _untag_thread(trace)
+
+async def _run_sync_profiled(func, *args, **kwargs):
+    trace = current_trace.get()
+    if trace is None:
+        return await _run_sync(func, *args, **kwargs)
+    return await _run_sync(functools.partial(_run_tagged, trace, func), *args, **kwargs)
+
+def instrument_threadpool() -> None:
+    """
+    Routes anyio.to_thread.run_sync, which Starlette and FastAPI use for every threadpool hop,
+    through a wrapper that tags the worker thread while it runs for a profiled request. Outside
+    profiled requests the cost is one context variable lookup.
+    """
+    anyio.to_thread.run_sync = _run_sync_profiled
+
+profiler = Profiler()
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is None or current_trace.get() is None:
+        return
+    context._profile_start = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_profile_start", None)
+    trace = current_trace.get()
+    if start is None or trace is None:
+        return
+    elapsed = time.perf_counter() - start
+    trace.sql_seconds += elapsed
+    if len(trace.statements) < MAX_STATEMENTS:
+        trace.statements.append({
+            "offset_ms": round((start - trace.started) * 1000, 3),
+            "duration_ms": round(elapsed * 1000, 3),
+            "statement": statement[:MAX_STATEMENT_LENGTH],
+            "executemany": executemany,
+        })
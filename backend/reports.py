@@ -0,0 +1,128 @@
+import csv
+import os
+import tempfile
+import zipfile
+from io import StringIO
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
+
+from openpyxl import Workbook, load_workbook
+
+EXPORT_HEADER = ["ID", "Title", "Description", "Priority", "Status", "Created At", "Updated At", "Due Date", "Reporter ID", "Assignee ID", "Project ID"]
+
+CSV_MEDIA_TYPE = "text/csv"
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Import reads files in the export layout; these columns are filled in by the server and ignored
+IMPORT_FIELDS = {
+    "Title": "title",
+    "Description": "description",
+    "Priority": "priority",
+    "Status": "status",
+    "Due Date": "due_date",
+    "Assignee ID": "assignee_id",
+    "Project ID": "project_id",
+}
+
+# Number of CSV rows rendered into a single chunk of the response body
+CSV_CHUNK_ROWS = 500
+# Size of the chunks the finished XLSX file is streamed in
+FILE_CHUNK_SIZE = 64 * 1024
+
+def defect_row(defect) -> list:
+    return [
+        defect.id,
+        defect.title,
+        defect.description,
+        defect.priority if defect.priority else "",
+        defect.status if defect.status else "",
+        defect.created_at.isoformat() if defect.created_at else "",
+        defect.updated_at.isoformat() if defect.updated_at else "",
+        defect.due_date.isoformat() if defect.due_date else "",
+        defect.reporter_id,
+        defect.assignee_id,
+        defect.project_id
+    ]
+
+def iter_csv(defects: Iterable) -> Iterator[str]:
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADER)
+    pending = 0
+    for defect in defects:
+        writer.writerow(defect_row(defect))
+        pending += 1
+        if pending >= CSV_CHUNK_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+def write_xlsx(defects: Iterable, file_obj) -> None:
+    # Write-only workbooks spool rows to disk instead of keeping every cell in memory
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Defects Report")
+    ws.append(EXPORT_HEADER)
+    for defect in defects:
+        ws.append(defect_row(defect))
+    wb.save(file_obj)
+
+def iter_xlsx(defects: Iterable) -> Iterator[bytes]:
+    # XLSX is a zip archive, so it has to be finished before it can be sent; it is built in a
+    # temporary file and streamed from there in fixed-size chunks
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            write_xlsx(defects, tmp)
+        with open(path, "rb") as f:
+            while chunk := f.read(FILE_CHUNK_SIZE):
+                yield chunk
+    finally:
+        os.remove(path)
+
+def _import_row(header: list, values) -> dict:
+    row = {}
+    for name, value in zip(header, values):
+        field = IMPORT_FIELDS.get(name)
+        # Empty cells fall back to the model defaults (or None for optional fields)
+        if field and value not in (None, ""):
+            row[field] = value.strip() if isinstance(value, str) else value
+    return row
+
+# Both readers yield (row number in the file, row) so errors point at the line the user sees
+def _decoded_lines(file_obj: BinaryIO) -> Iterator[str]:
+    # Line by line rather than TextIOWrapper's 8 KB blocks, so a decoding error stops the import
+    # at the line that has it; line endings are kept, as csv expects with newline=""
+    for index, line in enumerate(file_obj):
+        yield line.decode("utf-8-sig" if index == 0 else "utf-8")
+
+def iter_csv_import(file_obj: BinaryIO) -> Iterator[Tuple[int, dict]]:
+    reader = csv.reader(_decoded_lines(file_obj))
+    header = [name.strip() for name in next(reader, [])]
+    for values in reader:
+        if any(values):
+            yield reader.line_num, _import_row(header, values)
+
+# Errors that mean the rest of the file cannot be read (as opposed to an invalid row)
+READ_ERRORS = (UnicodeDecodeError, csv.Error, zipfile.BadZipFile)
+
+def read_until_error(rows: Iterable[Tuple[int, dict]], errors: List[Tuple[int, Exception]]) -> Iterator[Tuple[int, dict]]:
+    # Stops at the first unreadable row and appends (its row number, error) to errors, so that the
+    # rows before it are still imported and the caller can say where the import stopped
+    row_number = 1
+    try:
+        for row_number, row in rows:
+            yield row_number, row
+    except READ_ERRORS as e:
+        errors.append((row_number + 1, e))
+
+def iter_xlsx_import(file_obj: BinaryIO) -> Iterator[Tuple[int, dict]]:
+    wb = load_workbook(file_obj, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = [str(name).strip() if name is not None else "" for name in next(rows, ())]
+        for row_number, values in enumerate(rows, start=2):
+            if any(value not in (None, "") for value in values):
+                yield row_number, _import_row(header, values)
+    finally:
+        wb.close()
@@ -0,0 +1,177 @@
+import argparse
+import sys
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, Optional, Sequence
+
+from sqlalchemy import Date, delete, func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import models
+
+# Analytics rollups:
+#   defect_counts        project x status x priority -> count       (unfiltered analytics)
+#   defect_daily_counts  day x project x status x priority -> count (analytics over a date range)
+# crud applies +1/-1 deltas in the same transaction as each defect write, so the analytics
+# endpoints read O(projects) / O(days) rows instead of scanning defects.
+COUNTS = models.DefectCount.__table__
+DAILY = models.DefectDailyCount.__table__
+
+COUNT_COLUMNS = ("project_id", "status", "priority")
+DAILY_COLUMNS = ("day", "project_id", "status", "priority")
+
+def _value(v):
+    return getattr(v, "value", v)
+
+def _day(created_at: Optional[datetime]) -> Optional[date]:
+    return created_at.date() if created_at is not None else None
+
+def defect_key(defect) -> tuple:
+    # (project_id, status, priority, creation day): the dimensions a defect is counted under
+    return (defect.project_id, _value(defect.status), _value(defect.priority), _day(defect.created_at))
+
+def _dialect_name(db) -> str:
+    bind = db.get_bind() if hasattr(db, "get_bind") else db
+    return bind.dialect.name
+
+def _increment(db, table, columns: Sequence[str], deltas: Counter) -> None:
+    rows = [dict(zip(columns, key), count=delta) for key, delta in deltas.items() if delta]
+    if not rows:
+        return
+    upsert = postgresql.insert if _dialect_name(db) == "postgresql" else sqlite.insert
+    stmt = upsert(table)
+    stmt = stmt.on_conflict_do_update(index_elements=list(columns), set_={"count": table.c.count + stmt.excluded.count})
+    db.execute(stmt, rows)
+
+def apply(db, deltas: Counter) -> None:
+    # deltas: defect_key -> change in count
+    totals, daily = Counter(), Counter()
+    for (project_id, status, priority, day), delta in deltas.items():
+        totals[(project_id, status, priority)] += delta
+        if day is not None:
+            daily[(day, project_id, status, priority)] += delta
+    _increment(db, COUNTS, COUNT_COLUMNS, totals)
+    _increment(db, DAILY, DAILY_COLUMNS, daily)
+
+def record_created(db, keys: Iterable[tuple]) -> None:
+    apply(db, Counter(keys))
+
+def record_deleted(db, keys: Iterable[tuple]) -> None:
+    apply(db, Counter({key: -n for key, n in Counter(keys).items()}))
+
+def record_changed(db, old_key: tuple, new_key: tuple) -> None:
+    if old_key != new_key:
+        apply(db, Counter({old_key: -1, new_key: 1}))
+
+def _defect_day():
+    return func.date(models.Defect.created_at, type_=Date)
+
+def keys_for(db, defect_ids: Sequence[int]) -> Counter:
+    # Current defect_key counts of the given defects, for writes that bypass the ORM (UPDATE ... IN)
+    d = models.Defect
+    rows = db.execute(
+        select(d.project_id, d.status, d.priority, _defect_day(), func.count())
+        .where(d.id.in_(list(defect_ids)))
+        .group_by(d.project_id, d.status, d.priority, _defect_day())
+    )
+    return Counter({(project_id, status, priority, day): n for project_id, status, priority, day, n in rows})
+
+# --- Reads ---
+
+def _midnight(day: date, like: datetime) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=like.tzinfo)
+
+def _scan(db, dims: Sequence[str], lower: Optional[datetime], upper: Optional[datetime], upper_inclusive: bool) -> Counter:
+    d = models.Defect
+    columns = [_defect_day() if dim == "day" else getattr(d, dim) for dim in dims]
+    query = select(*columns, func.count()).group_by(*columns)
+    if lower is not None:
+        query = query.where(d.created_at >= lower)
+    if upper is not None:
+        query = query.where(d.created_at <= upper if upper_inclusive else d.created_at < upper)
+    return Counter({tuple(row[:-1]): row[-1] for row in db.execute(query)})
+
+def _sum_table(db, table, dims: Sequence[str], first_day: Optional[date] = None, last_day: Optional[date] = None) -> Counter:
+    columns = [table.c[dim] for dim in dims]
+    query = select(*columns, func.sum(table.c.count)).group_by(*columns)
+    if first_day is not None:
+        query = query.where(table.c.day >= first_day)
+    if last_day is not None:
+        query = query.where(table.c.day <= last_day)
+    # int(): PostgreSQL returns SUM(integer) as numeric
+    return Counter({tuple(row[:-1]): int(row[-1]) for row in db.execute(query)})
+
+def count_defects(db, dims: Sequence[str], start: Optional[datetime] = None, end: Optional[datetime] = None) -> Counter:
+    """
+    Defect counts grouped by `dims` (any of project_id, status, priority, day) for defects
+    created in [start, end]. Whole days come from defect_daily_counts; the partial days at
+    either edge of the range are counted from defects via ix_defects_created_at, so the
+    result is exact for arbitrary timestamps.
+    """
+    if start is None and end is None and "day" not in dims:
+        result = _sum_table(db, COUNTS, dims)
+    else:
+        first_full = None if start is None else (start.date() if start.time() == time.min else start.date() + timedelta(days=1))
+        last_full = None if end is None else end.date() - timedelta(days=1)
+        if first_full is not None and last_full is not None and first_full > last_full:
+            result = _scan(db, dims, start, end, upper_inclusive=True)
+        else:
+            result = _sum_table(db, DAILY, dims, first_full, last_full)
+            if start is not None and start.time() != time.min:
+                result.update(_scan(db, dims, start, _midnight(first_full, start), upper_inclusive=False))
+            if end is not None:
+                result.update(_scan(db, dims, _midnight(last_full + timedelta(days=1), end), end, upper_inclusive=True))
+    return Counter({key: n for key, n in result.items() if n})
+
+# --- Maintenance ---
+
+def rebuild(db) -> None:
+    # Recomputes both tables from defects in one transaction-scoped pass
+    d = models.Defect
+    db.execute(delete(COUNTS))
+    db.execute(delete(DAILY))
+    db.execute(insert(COUNTS).from_select(
+        list(COUNT_COLUMNS) + ["count"],
+        select(d.project_id, d.status, d.priority, func.count()).group_by(d.project_id, d.status, d.priority),
+    ))
+    db.execute(insert(DAILY).from_select(
+        list(DAILY_COLUMNS) + ["count"],
+        select(_defect_day(), d.project_id, d.status, d.priority, func.count())
+        .where(d.created_at.isnot(None))
+        .group_by(_defect_day(), d.project_id, d.status, d.priority),
+    ))
+
+def check(db) -> list:
+    # Differences between the rollups and a full aggregation of defects: (table, key, stored, actual)
+    problems = []
+    for table, columns in ((COUNTS, COUNT_COLUMNS), (DAILY, DAILY_COLUMNS)):
+        actual = _scan(db, columns, None, None, upper_inclusive=True)
+        if table is DAILY:
+            actual = Counter({key: n for key, n in actual.items() if key[0] is not None})
+        stored = Counter({key: n for key, n in _sum_table(db, table, columns).items() if n})
+        for key in sorted(set(actual) | set(stored), key=str):
+            if actual[key] != stored[key]:
+                problems.append((table.name, key, stored[key], actual[key]))
+    return problems
+
+def main(argv=None) -> int:
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rebuild or verify the analytics rollup tables")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    args = parser.parse_args(argv)
+
+    with SessionLocal() as db:
+        if args.command == "rebuild":
+            rebuild(db)
+            db.commit()
+            print("Rollups rebuilt")
+            return 0
+        problems = check(db)
+        for table, key, stored, actual in problems:
+            print(f"{table} {key}: stored {stored}, actual {actual}")
+        print("Rollups are consistent" if not problems else f"{len(problems)} mismatched rows")
+        return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from enum import Enum
 
 from pydantic import BaseModel, EmailStr, Field, ConfigDict
@@ -31,14 +31,16 @@ class ProjectBase(BaseModel):
 class ProjectCreate(ProjectBase):
     pass
 
-class Project(ProjectBase):
+class ProjectSummary(ProjectBase):
     id: int
     created_at: datetime
     owner_id: int
-    defects: List["Defect"] = [] # Forward reference
 
     model_config = ConfigDict(from_attributes=True)
 
+class Project(ProjectSummary):
+    defects: List["Defect"] = [] # Forward reference
+
 class DefectPriority(str, Enum):
     low = "Низкий"
     medium = "Средний"
@@ -71,18 +73,29 @@ class DefectUpdate(DefectBase):
     due_date: Optional[datetime] = None
     assignee_id: Optional[int] = None
 
-class Defect(DefectBase):
+class DefectBatchItem(DefectUpdate):
+    id: int
+
+class DefectBatchUpdate(BaseModel):
+    # Either one patch for all ids, or a patch per defect in items
+    ids: List[int] = []
+    patch: Optional[DefectUpdate] = None
+    items: List[DefectBatchItem] = []
+
+class DefectSummary(DefectBase):
     id: int
     created_at: datetime
     updated_at: Optional[datetime] = None
     reporter_id: int
     assignee_id: Optional[int] = None
     project_id: int
-    comments: List["Comment"] = [] # Forward reference
-    attachments: List["Attachment"] = [] # Forward reference
 
     model_config = ConfigDict(from_attributes=True)
 
+class Defect(DefectSummary):
+    comments: List["Comment"] = [] # Forward reference
+    attachments: List["Attachment"] = [] # Forward reference
+
 class CommentBase(BaseModel):
     content: str
 
@@ -97,6 +110,10 @@ class Comment(CommentBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+class AttachmentVariant(str, Enum):
+    thumbnail = "thumbnail"
+    preview = "preview"
+
 class AttachmentBase(BaseModel):
     filename: str
     file_path: str
@@ -105,12 +122,16 @@ class AttachmentCreate(BaseModel):
     filename: str
     file_path: str
     defect_id: int
+    sha256: Optional[str] = None
+    size: Optional[int] = None
 
 class Attachment(AttachmentBase):
     id: int
     uploaded_at: datetime
     uploader_id: int
     defect_id: int
+    sha256: Optional[str] = None
+    size: Optional[int] = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -140,6 +161,23 @@ class DefectCreationTrendItem(BaseModel):
     date: datetime
     count: int
 
+class DefectBulkCreate(BaseModel):
+    # Rows are validated one by one so a bad row is reported instead of rejecting the whole request
+    defects: List[Dict[str, Any]]
+
+class DefectImportError(BaseModel):
+    row: int
+    errors: List[str]
+
+class DefectImportResult(BaseModel):
+    created: int
+    failed: int
+    errors: List[DefectImportError] = []
+    # Set when the file could not be read to the end: rows before stopped_at_row were imported
+    # (created/failed above), that row and the ones after it were not
+    stopped_at_row: Optional[int] = None
+    error: Optional[str] = None
+
 class ProjectPerformanceItem(BaseModel):
     project_id: int
     project_title: str
@@ -147,6 +185,46 @@ class ProjectPerformanceItem(BaseModel):
     total_defects: int
     completion_percentage: float
 
+class ProfilingSettings(BaseModel):
+    enabled: bool
+    sample_rate: float = Field(ge=0, le=1)
+    slow_ms: float = Field(ge=0)
+    interval_ms: float = Field(ge=1)
+
+class ProfilingSettingsUpdate(BaseModel):
+    enabled: Optional[bool] = None
+    sample_rate: Optional[float] = Field(default=None, ge=0, le=1)
+    slow_ms: Optional[float] = Field(default=None, ge=0)
+    interval_ms: Optional[float] = Field(default=None, ge=1)
+
+class ExportJobCreate(BaseModel):
+    # Same filters as GET /reports/defects/export
+    format: str = Field("csv", pattern="^(csv|xlsx)$")
+    project_id: Optional[int] = None
+    status: Optional[DefectStatus] = None
+    priority: Optional[DefectPriority] = None
+    assignee_id: Optional[int] = None
+    reporter_id: Optional[int] = None
+    created_start_date: Optional[datetime] = None
+    created_end_date: Optional[datetime] = None
+    due_start_date: Optional[datetime] = None
+    due_end_date: Optional[datetime] = None
+    search_query: Optional[str] = None
+
+class ExportJob(BaseModel):
+    id: str
+    format: str
+    status: str
+    processed: int
+    total: Optional[int] = None
+    progress: float
+    size: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    download_url: Optional[str] = None
+
 # Update forward refs
 Project.model_rebuild()
 Defect.model_rebuild()
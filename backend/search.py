@@ -0,0 +1,119 @@
+import re
+from weakref import WeakKeyDictionary
+
+from sqlalchemy import column, event, or_, table
+from sqlalchemy.exc import OperationalError
+
+from . import models
+from .database import Base
+
+# SQLite FTS5 index over defect titles, descriptions and the text of their comments.
+# rowid of the index is the defect id; triggers keep it in sync with defects and comments,
+# so ORM writes and bulk statements are covered alike.
+SEARCH_TABLE = "defect_search"
+
+defect_search = table(SEARCH_TABLE, column("rowid"), column("rank"), column(SEARCH_TABLE))
+
+_COMMENTS_OF = "(SELECT coalesce(group_concat(content, ' '), '') FROM comments WHERE defect_id = {})"
+
+CREATE_STATEMENTS = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    "title, description, comments, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    f"""CREATE TRIGGER IF NOT EXISTS defects_search_insert AFTER INSERT ON defects BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, title, description, comments)
+        VALUES (new.id, new.title, coalesce(new.description, ''), '');
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS defects_search_update AFTER UPDATE OF title, description ON defects BEGIN
+        UPDATE {SEARCH_TABLE} SET title = new.title, description = coalesce(new.description, '') WHERE rowid = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS defects_search_delete AFTER DELETE ON defects BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS comments_search_insert AFTER INSERT ON comments BEGIN
+        UPDATE {SEARCH_TABLE} SET comments = {_COMMENTS_OF.format("new.defect_id")} WHERE rowid = new.defect_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS comments_search_update AFTER UPDATE OF content, defect_id ON comments BEGIN
+        UPDATE {SEARCH_TABLE} SET comments = {_COMMENTS_OF.format("old.defect_id")} WHERE rowid = old.defect_id;
+        UPDATE {SEARCH_TABLE} SET comments = {_COMMENTS_OF.format("new.defect_id")} WHERE rowid = new.defect_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS comments_search_delete AFTER DELETE ON comments BEGIN
+        UPDATE {SEARCH_TABLE} SET comments = {_COMMENTS_OF.format("old.defect_id")} WHERE rowid = old.defect_id;
+    END""",
+]
+
+BACKFILL_STATEMENT = f"""
+    INSERT INTO {SEARCH_TABLE}(rowid, title, description, comments)
+    SELECT d.id, d.title, coalesce(d.description, ''), {_COMMENTS_OF.format("d.id")}
+    FROM defects d
+"""
+
+DROP_STATEMENTS = [
+    "DROP TRIGGER IF EXISTS comments_search_delete",
+    "DROP TRIGGER IF EXISTS comments_search_update",
+    "DROP TRIGGER IF EXISTS comments_search_insert",
+    "DROP TRIGGER IF EXISTS defects_search_delete",
+    "DROP TRIGGER IF EXISTS defects_search_update",
+    "DROP TRIGGER IF EXISTS defects_search_insert",
+    f"DROP TABLE IF EXISTS {SEARCH_TABLE}",
+]
+
+_enabled_engines = WeakKeyDictionary()
+
+def _has_search_table(connection) -> bool:
+    return connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (SEARCH_TABLE,)
+    ).first() is not None
+
+def create_search_index(connection) -> bool:
+    # Returns False when the backend is not SQLite or SQLite was built without FTS5
+    if connection.dialect.name != "sqlite":
+        return False
+    if _has_search_table(connection):
+        return True
+    try:
+        for statement in CREATE_STATEMENTS:
+            connection.exec_driver_sql(statement)
+    except OperationalError:
+        return False
+    connection.exec_driver_sql(BACKFILL_STATEMENT)
+    return True
+
+def drop_search_index(connection) -> None:
+    if connection.dialect.name == "sqlite":
+        for statement in DROP_STATEMENTS:
+            connection.exec_driver_sql(statement)
+        _enabled_engines.pop(connection.engine, None)
+
+@event.listens_for(Base.metadata, "after_create")
+def _after_create(target, connection, **kw):
+    create_search_index(connection)
+
+@event.listens_for(Base.metadata, "before_drop")
+def _before_drop(target, connection, **kw):
+    drop_search_index(connection)
+
+def is_enabled(session) -> bool:
+    bind = session.get_bind()
+    if bind.dialect.name != "sqlite":
+        return False
+    engine = getattr(bind, "engine", bind)
+    if not _enabled_engines.get(engine):
+        # Only positive answers are cached, so an index created later is picked up
+        _enabled_engines[engine] = _has_search_table(session.connection())
+    return _enabled_engines[engine]
+
+def to_match_expression(search_query: str) -> str:
+    # Every word becomes a quoted prefix term ("word"*); terms are ANDed by FTS5
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", search_query))
+
+def uses_index(session, search_query: str) -> bool:
+    return bool(to_match_expression(search_query)) and is_enabled(session)
+
+def filter_defects(query, search_query: str):
+    if uses_index(query.session, search_query):
+        return query.join(defect_search, defect_search.c.rowid == models.Defect.id).filter(
+            defect_search.c[SEARCH_TABLE].match(to_match_expression(search_query))
+        )
+    return query.filter(
+        or_(models.Defect.title.contains(search_query), models.Defect.description.contains(search_query))
+    )
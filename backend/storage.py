@@ -0,0 +1,195 @@
+import argparse
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from typing import BinaryIO, NamedTuple
+
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from . import crud
+
+logger = logging.getLogger(__name__)
+
+# Attachment files are stored once per distinct content under blobs/<aa>/<bb>/<sha256>; the blobs
+# table counts the attachments that use each file. Re-uploading a file that is already stored
+# costs one hashing pass over the upload and no disk write. Files whose last reference is gone are
+# left for collect_garbage (python -m backend.storage gc): removing them on the request path would
+# race with a concurrent upload of the same content that found the file and reused it.
+ATTACHMENTS_DIR = os.getenv("ATTACHMENTS_DIR", "./attachments")
+CHUNK_SIZE = 1024 * 1024
+# Quotas in bytes; 0 disables the check
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(50 * 1024 * 1024)))
+# Sum of the attachment sizes of one defect (a shared file counts for every defect using it)
+ATTACHMENT_DEFECT_QUOTA_BYTES = int(os.getenv("ATTACHMENT_DEFECT_QUOTA_BYTES", str(500 * 1024 * 1024)))
+# Sum of the distinct blobs on disk
+ATTACHMENT_STORAGE_QUOTA_BYTES = int(os.getenv("ATTACHMENT_STORAGE_QUOTA_BYTES", "0"))
+
+# Multipart framing (boundary lines, part headers) allowed on top of the file itself
+UPLOAD_OVERHEAD_BYTES = 64 * 1024
+UPLOAD_PATH = re.compile(r"^/defects/\d+/attachments/?$")
+
+class QuotaExceeded(Exception):
+    pass
+
+class UploadSizeLimit:
+    """
+    ASGI middleware for attachment uploads. A body that cannot fit ATTACHMENT_MAX_BYTES gets 413
+    before it is received: from Content-Length before the first byte is read, or as soon as a
+    streamed body goes past the limit. Without it python-multipart spools the whole upload before
+    store_upload() can check its size.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not ATTACHMENT_MAX_BYTES or not UPLOAD_PATH.match(scope["path"]):
+            return await self.app(scope, receive, send)
+        limit = ATTACHMENT_MAX_BYTES + UPLOAD_OVERHEAD_BYTES
+        declared = dict(scope["headers"]).get(b"content-length")
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            # Raised while FastAPI parses the form, so it is answered like any HTTPException
+            if declared is not None and declared.isdigit() and int(declared) > limit:
+                raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=f"File is larger than the {ATTACHMENT_MAX_BYTES} byte limit")
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=f"File is larger than the {ATTACHMENT_MAX_BYTES} byte limit")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+class StoredBlob(NamedTuple):
+    sha256: str
+    size: int
+    path: str
+
+class BlobStore:
+    def __init__(self, root: str = ATTACHMENTS_DIR, chunk_size: int = CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+
+    def path_for(self, sha256: str) -> str:
+        return os.path.join(self.root, "blobs", sha256[:2], sha256[2:4], sha256)
+
+    def touch(self, sha256: str) -> bool:
+        # Reusing a stored blob refreshes its mtime, so collect_garbage's age check skips it while
+        # the new reference commits. False if the blob is not stored.
+        try:
+            os.utime(self.path_for(sha256))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def hash_stream(self, fileobj: BinaryIO, max_bytes: int = 0):
+        """(sha256, size) of the rest of fileobj, read in chunks into one reused buffer."""
+        digest = hashlib.sha256()
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        size = 0
+        while True:
+            n = fileobj.readinto(buffer)
+            if not n:
+                break
+            size += n
+            if max_bytes and size > max_bytes:
+                raise QuotaExceeded(f"File is larger than the {max_bytes} byte limit")
+            digest.update(view[:n])
+        return digest.hexdigest(), size
+
+    def write(self, fileobj: BinaryIO, sha256: str) -> str:
+        # Copied to a temporary file next to the blob and renamed, so a blob path only ever holds
+        # complete content; concurrent writers of the same blob write identical bytes
+        path = self.path_for(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                shutil.copyfileobj(fileobj, out, self.chunk_size)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return path
+
+blob_store = BlobStore()
+
+def store_upload(db: Session, fileobj: BinaryIO, defect_id: int, store: BlobStore = blob_store) -> StoredBlob:
+    """
+    Hashes the upload, checks the quotas and writes the blob if it is not stored yet. The caller
+    records the attachment (crud.create_attachment takes the blob reference) and then calls
+    ensure_stored(), which covers a concurrent delete of the last reference in between.
+    """
+    fileobj.seek(0)
+    sha256, size = store.hash_stream(fileobj, ATTACHMENT_MAX_BYTES)
+    if ATTACHMENT_DEFECT_QUOTA_BYTES and crud.get_defect_attachment_bytes(db, defect_id) + size > ATTACHMENT_DEFECT_QUOTA_BYTES:
+        raise QuotaExceeded(f"Attachments of this defect would exceed {ATTACHMENT_DEFECT_QUOTA_BYTES} bytes")
+    known = crud.get_blob(db, sha256) is not None
+    if not known and ATTACHMENT_STORAGE_QUOTA_BYTES and crud.get_blob_storage_bytes(db) + size > ATTACHMENT_STORAGE_QUOTA_BYTES:
+        raise QuotaExceeded(f"Attachment storage would exceed {ATTACHMENT_STORAGE_QUOTA_BYTES} bytes")
+    if not (known and store.touch(sha256)):
+        fileobj.seek(0)
+        store.write(fileobj, sha256)
+    return StoredBlob(sha256, size, store.path_for(sha256))
+
+def ensure_stored(fileobj: BinaryIO, blob: StoredBlob, store: BlobStore = blob_store) -> None:
+    if not store.touch(blob.sha256):
+        fileobj.seek(0)
+        store.write(fileobj, blob.sha256)
+
+def _modified_after(path: str, cutoff: float) -> bool:
+    try:
+        return os.path.getmtime(path) > cutoff
+    except FileNotFoundError:
+        return False
+
+def collect_garbage(db: Session, store: BlobStore = blob_store, min_age_seconds: float = 3600) -> int:
+    """
+    Removes blob files without a blobs row: blobs whose last attachment was deleted, files left
+    behind when an upload failed after writing them, and previews of both. Recently written or
+    reused files are skipped, their upload may still be committing.
+    """
+    removed = 0
+    cutoff = time.time() - min_age_seconds
+    for directory, _, names in os.walk(os.path.join(store.root, "blobs")):
+        for name in names:
+            path = os.path.join(directory, name)
+            # "<sha256>" or "<sha256>.<variant>.jpg"; temporary ".upload-*" files have no hash
+            sha256 = name.split(".", 1)[0]
+            if sha256 and crud.get_blob(db, sha256) is not None:
+                continue
+            # After the row lookup: an upload reusing the blob touches it before committing its row
+            if _modified_after(path, cutoff) or (sha256 and _modified_after(store.path_for(sha256), cutoff)):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+    return removed
+
+def main(argv=None) -> int:
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Attachment blob storage maintenance")
+    parser.add_argument("command", choices=["gc"])
+    parser.add_argument("--min-age", type=float, default=3600, help="Skip files modified less than this many seconds ago")
+    args = parser.parse_args(argv)
+
+    with SessionLocal() as db:
+        removed = collect_garbage(db, min_age_seconds=args.min_age)
+    print(f"Removed {removed} unreferenced blob files")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,22 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+# Logs go to stderr only; set before backend.main configures logging on import
+os.environ["LOG_FILE"] = ""
+# The application engine points at a throwaway file instead of the repository's sql_app.db
+_database_dir = tempfile.TemporaryDirectory(prefix="techframe-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_database_dir.name, 'app.db')}"
+
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, insert
 from sqlalchemy.orm import sessionmaker, Session
 from fastapi.testclient import TestClient
 
+from backend import crud, models, schemas
 from backend.database import Base
-from backend.main import app, get_db
+from backend.main import app, get_db, pwd_context
+from backend.cache import response_cache, user_cache
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 
@@ -32,5 +44,42 @@ def client_fixture(db_session: Session):
             db_session.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    user_cache.clear()  # ids are reused once the tables are recreated
+    response_cache.clear()
     with TestClient(app) as client:
         yield client
+
+@contextmanager
+def count_statements(db_session: Session):
+    bind = db_session.get_bind()
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(bind, "before_cursor_execute", count)
+    try:
+        yield statements
+    finally:
+        event.remove(bind, "before_cursor_execute", count)
+
+def populate(db_session: Session, user_id: int, projects: int, defects_per_project: int = 3):
+    for p in range(projects):
+        project = crud.create_user_project(db_session, project=schemas.ProjectCreate(title=f"Project {p}"), user_id=user_id)
+        db_session.execute(insert(models.Defect), [
+            {"title": f"Defect {p}.{d}", "priority": "Низкий", "status": "Новая", "reporter_id": user_id, "project_id": project.id}
+            for d in range(defects_per_project)
+        ])
+    defect_ids = [d.id for d in db_session.query(models.Defect.id)]
+    db_session.execute(insert(models.Comment), [{"content": "c", "author_id": user_id, "defect_id": i} for i in defect_ids])
+    db_session.execute(insert(models.Attachment), [{"filename": "f", "file_path": "f", "uploader_id": user_id, "defect_id": i} for i in defect_ids])
+    db_session.commit()
+
+@pytest.fixture(name="auth")
+def auth_fixture(client: TestClient, db_session: Session):
+    # (user id, headers) of a manager, with the auth cache already warm
+    user = crud.create_user(db_session, user=schemas.UserCreate(username="counter", email="counter@example.com", password="pass", role="manager"), pwd_context=pwd_context)
+    token = client.post("/token", data={"username": "counter", "password": "pass"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    client.get("/users/me/", headers=headers)  # warm the auth cache
+    return user.id, headers
@@ -1,3 +1,13 @@
+"""
+Load profile for the backend.
+
+    uvicorn backend.main:app --workers 1
+    locust -f backend/tests/locustfile.py --headless -u 60 -r 10 -t 2m
+
+Compare requests/s and p95 of /users/, /admin/users/ and POST /defects/ before and after
+a change: with 50+ users these endpoints used to run their queries on the event loop and
+serialize every other request behind them.
+"""
 from locust import HttpUser, task, between
 import random
 
@@ -82,6 +92,32 @@ class WebsiteUser(HttpUser):
         if headers:
             self.client.get("/defects/", headers=headers)
 
+    @task(3)
+    def list_users(self):
+        user_data = random.choice(self.test_users)
+        headers = self.get_auth_headers(user_data["username"])
+        self.client.get("/users/", headers=headers)
+
+    @task(1)
+    def admin_list_users(self):
+        headers = self.get_auth_headers("manager_0")
+        if headers:
+            self.client.get("/admin/users/", headers=headers, name="/admin/users/")
+
+    @task(2)
+    def create_defect(self):
+        headers = self.get_auth_headers("manager_0")
+        if not headers:
+            return
+        projects = self.client.get("/projects/", headers=headers, params={"limit": 1}).json()
+        if projects:
+            self.client.post(
+                "/defects/",
+                headers=headers,
+                json={"title": f"Load defect {random.randint(1, 10000)}", "project_id": projects[0]["id"]},
+                name="/defects/ [create defect]"
+            )
+
     @task(1)
     def export_defects_csv(self):
         headers = self.get_auth_headers("manager_0") or self.get_auth_headers("observer_0")
@@ -102,4 +102,189 @@ def test_delete_project_authorization(client: TestClient):
     assert r_forbidden.status_code == 403
 
     r_ok = client.delete(f"/projects/{pid}", headers=auth_headers(admin_token))
-    assert r_ok.status_code == 204
\ No newline at end of file
+    assert r_ok.status_code == 204
+
+def test_export_defects_streams_all_batches(client: TestClient, monkeypatch):
+    import csv
+    import io
+    from openpyxl import load_workbook
+    from backend import main
+
+    manager = create_user(client, "exp_manager", "exp_manager@example.com", "pass", "manager")
+    token = login_token(client, manager["username"], "pass")
+
+    r_proj = client.post(f"/users/{manager['id']}/projects/", headers=auth_headers(token), json={"title": "ExportProj", "description": ""})
+    project_id = r_proj.json()["id"]
+    for i in range(5):
+        r = client.post("/defects/", headers=auth_headers(token), json={"title": f"Export {i}", "description": "", "project_id": project_id})
+        assert r.status_code == 200
+
+    # Force several keyset batches so batch boundaries are exercised
+    monkeypatch.setattr(main, "EXPORT_BATCH_SIZE", 2)
+
+    r_csv = client.get("/reports/defects/export", headers=auth_headers(token), params={"format": "csv"})
+    assert r_csv.status_code == 200
+    rows = list(csv.reader(io.StringIO(r_csv.text)))
+    assert rows[0][0] == "ID"
+    assert [row[1] for row in rows[1:]] == [f"Export {i}" for i in range(5)]
+
+    r_xlsx = client.get("/reports/defects/export", headers=auth_headers(token), params={"format": "xlsx"})
+    assert r_xlsx.status_code == 200
+    ws = load_workbook(io.BytesIO(r_xlsx.content)).active
+    values = list(ws.iter_rows(values_only=True))
+    assert values[0][0] == "ID"
+    assert len(values) == 6
+
+
+def test_defects_cursor_pagination(client: TestClient):
+    manager = create_user(client, "page_manager", "page_manager@example.com", "pass", "manager")
+    token = login_token(client, manager["username"], "pass")
+
+    r_proj = client.post(f"/users/{manager['id']}/projects/", headers=auth_headers(token), json={"title": "PageProj", "description": ""})
+    project_id = r_proj.json()["id"]
+    created = [
+        client.post("/defects/", headers=auth_headers(token), json={"title": f"Page {i}", "description": "", "project_id": project_id}).json()["id"]
+        for i in range(5)
+    ]
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        r = client.get("/defects/", headers=auth_headers(token), params=params)
+        assert r.status_code == 200
+        seen += [d["id"] for d in r.json()]
+        cursor = r.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == created
+
+    r_bad = client.get("/defects/", headers=auth_headers(token), params={"cursor": "not-a-cursor"})
+    assert r_bad.status_code == 400
+
+    # Filtered by status, SQLite reads ix_defects_status_priority: rows come in priority order
+    # unless the page is sorted, and a cursor taken from an unsorted page skips defects
+    for i, priority in enumerate(["Высокий", "Низкий", "Высокий", "Низкий", "Высокий", "Низкий"]):
+        defect = {"title": f"Filtered {i}", "description": "", "project_id": project_id, "priority": priority}
+        created.append(client.post("/defects/", headers=auth_headers(token), json=defect).json()["id"])
+    r = client.get("/defects/", headers=auth_headers(token), params={"status": "Новая", "limit": 3})
+    seen = [d["id"] for d in r.json()]
+    cursor = r.headers["X-Next-Cursor"]
+    while cursor:
+        r = client.get("/defects/", headers=auth_headers(token), params={"status": "Новая", "limit": 3, "cursor": cursor})
+        seen += [d["id"] for d in r.json()]
+        cursor = r.headers.get("X-Next-Cursor")
+    assert seen == created
+
+
+def test_bulk_create_defects_reports_row_errors(client: TestClient, monkeypatch):
+    from backend import crud
+
+    manager = create_user(client, "bulk_manager", "bulk_manager@example.com", "pass", "manager")
+    observer = create_user(client, "bulk_observer", "bulk_observer@example.com", "pass", "observer")
+    token = login_token(client, manager["username"], "pass")
+    project_id = client.post(f"/users/{manager['id']}/projects/", headers=auth_headers(token), json={"title": "BulkProj"}).json()["id"]
+
+    monkeypatch.setattr(crud, "BULK_CHUNK_SIZE", 2)
+    rows = [
+        {"title": "Bulk 1", "project_id": project_id},
+        {"title": "Bulk 2", "project_id": project_id, "priority": "Высокий", "assignee_id": manager["id"]},
+        {"project_id": project_id},
+        {"title": "Bulk 4", "project_id": 9999},
+        {"title": "Bulk 5", "project_id": project_id, "status": "Неизвестно"},
+    ]
+    r = client.post("/defects/bulk", headers=auth_headers(token), json={"defects": rows})
+    assert r.status_code == 200
+    body = r.json()
+    assert (body["created"], body["failed"]) == (2, 3)
+    assert [e["row"] for e in body["errors"]] == [3, 4, 5]
+    assert body["errors"][1]["errors"] == ["project_id: Project 9999 not found"]
+
+    defects = client.get("/defects/", headers=auth_headers(token), params={"project_id": project_id}).json()
+    assert sorted((d["title"], d["reporter_id"]) for d in defects) == [("Bulk 1", manager["id"]), ("Bulk 2", manager["id"])]
+
+    observer_token = login_token(client, observer["username"], "pass")
+    assert client.post("/defects/bulk", headers=auth_headers(observer_token), json={"defects": rows}).status_code == 403
+
+    # Nothing is inserted from a request over the row limit
+    from backend import main
+    monkeypatch.setattr(main, "BULK_CREATE_MAX_ROWS", 4)
+    r = client.post("/defects/bulk", headers=auth_headers(token), json={"defects": rows})
+    assert r.status_code == 413 and "At most 4 defects" in r.json()["detail"]
+    assert len(client.get("/defects/", headers=auth_headers(token), params={"project_id": project_id}).json()) == 2
+
+
+def test_import_defects_from_exported_files(client: TestClient):
+    manager = create_user(client, "imp_manager", "imp_manager@example.com", "pass", "manager")
+    token = login_token(client, manager["username"], "pass")
+    project_id = client.post(f"/users/{manager['id']}/projects/", headers=auth_headers(token), json={"title": "ImportProj"}).json()["id"]
+    for i in range(3):
+        client.post("/defects/", headers=auth_headers(token), json={"title": f"Import {i}", "project_id": project_id, "priority": "Средний"})
+
+    exported = {
+        fmt: client.get("/reports/defects/export", headers=auth_headers(token), params={"format": fmt, "project_id": project_id}).content
+        for fmt in ("csv", "xlsx")
+    }
+    for fmt, content in exported.items():
+        r = client.post("/defects/import", headers=auth_headers(token), files={"file": (f"defects.{fmt}", content)})
+        assert r.status_code == 200, r.text
+        assert r.json() == {"created": 3, "failed": 0, "errors": [], "stopped_at_row": None, "error": None}
+
+    defects = client.get("/defects/", headers=auth_headers(token), params={"project_id": project_id}).json()
+    assert len(defects) == 9
+    assert {d["priority"] for d in defects} == {"Средний"}
+
+    bad_csv = "Title,Project ID\nNo project,\nOk," + str(project_id) + "\n"
+    r = client.post("/defects/import", headers=auth_headers(token), files={"file": ("bad.csv", bad_csv.encode())})
+    assert r.json()["created"] == 1
+    assert r.json()["errors"][0]["row"] == 2
+
+    r = client.post("/defects/import", headers=auth_headers(token), files={"file": ("defects.txt", b"x")})
+    assert r.status_code == 400
+
+    # A file that breaks off after the first committed chunk reports what was imported and where it stopped
+    lines = "".join(f"Broken {i},{project_id}\n" for i in range(1500))
+    broken = b"Title,Project ID\n" + lines.encode() + b"\xff\xfe,1\n"
+    r = client.post("/defects/import", headers=auth_headers(token), files={"file": ("broken.csv", broken)})
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert (body["created"], body["failed"]) == (1500, 0)
+    assert body["stopped_at_row"] == 1502 and "broken.csv" in body["error"]
+    r = client.get("/defects/", headers=auth_headers(token), params={"project_id": project_id, "limit": 2000})
+    assert len(r.json()) == 9 + 1 + 1500
+
+    r = client.post("/defects/import", headers=auth_headers(token), files={"file": ("broken.csv", b"Title,Project ID\n\xff,1\n")})
+    assert r.status_code == 400
+
+
+def test_batch_update_defects(client: TestClient):
+    manager = create_user(client, "batch_manager", "batch_manager@example.com", "pass", "manager")
+    engineer = create_user(client, "batch_engineer", "batch_engineer@example.com", "pass", "engineer")
+    manager_token = login_token(client, manager["username"], "pass")
+    engineer_token = login_token(client, engineer["username"], "pass")
+    project_id = client.post(f"/users/{manager['id']}/projects/", headers=auth_headers(manager_token), json={"title": "BatchProj"}).json()["id"]
+    ids = [
+        client.post("/defects/", headers=auth_headers(manager_token), json={"title": f"Batch {i}", "project_id": project_id}).json()["id"]
+        for i in range(4)
+    ]
+
+    r = client.put("/defects/batch", headers=auth_headers(manager_token), json={"ids": ids[:3], "patch": {"status": "Закрыта", "assignee_id": engineer["id"]}})
+    assert r.status_code == 200
+    assert [(d["id"], d["status"], d["assignee_id"]) for d in r.json()] == [(i, "Закрыта", engineer["id"]) for i in ids[:3]]
+    assert all(d["updated_at"] for d in r.json())
+
+    r = client.put("/defects/batch", headers=auth_headers(manager_token), json={"items": [
+        {"id": ids[0], "priority": "Высокий"},
+        {"id": ids[3], "title": "Renamed"},
+    ]})
+    assert [(d["title"], d["priority"], d["status"]) for d in r.json()] == [("Batch 0", "Высокий", "Закрыта"), ("Renamed", "Низкий", "Новая")]
+
+    # The engineer is assignee of the first three only, so the whole batch is rejected
+    r = client.put("/defects/batch", headers=auth_headers(engineer_token), json={"ids": ids, "patch": {"status": "В работе"}})
+    assert r.status_code == 403
+    r = client.put("/defects/batch", headers=auth_headers(engineer_token), json={"ids": ids[:3], "patch": {"status": "В работе"}})
+    assert {d["status"] for d in r.json()} == {"В работе"}
+    assert client.get(f"/defects/{ids[3]}", headers=auth_headers(manager_token)).json()["status"] == "Новая"
+
+    r = client.put("/defects/batch", headers=auth_headers(manager_token), json={"ids": [ids[0], 9999], "patch": {"status": "Закрыта"}})
+    assert r.status_code == 404
+    assert client.put("/defects/batch", headers=auth_headers(manager_token), json={"ids": ids}).status_code == 400
@@ -0,0 +1,66 @@
+import datetime
+import os
+import sqlite3
+
+import pytest
+
+from backend import backup_db, metrics
+
+def make_database(path, rows=1000):
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)")
+    connection.execute("INSERT INTO alembic_version VALUES ('0007_export_jobs')")
+    connection.execute("CREATE TABLE defects (id INTEGER PRIMARY KEY, title TEXT)")
+    connection.executemany("INSERT INTO defects (title) VALUES (?)", ((f"Defect {i}",) for i in range(rows)))
+    connection.commit()
+    connection.close()
+
+def test_backup_verify_and_restore(tmp_path):
+    source = str(tmp_path / "app.db")
+    make_database(source)
+    directory = str(tmp_path / "backups")
+    result = backup_db.backup_database(source, directory, pages=2)
+    assert result.path.endswith(".db.gz") and 0 < result.size < result.source_bytes
+    assert [b.path for b in backup_db.list_backups(directory)] == [result.path]
+    assert backup_db.verify_backup(result.path) == []
+
+    assert backup_db._read_status(directory)["last_size_bytes"] == result.size
+    backup_db.register_metrics()
+    assert "backup_last_size_bytes" in metrics.REGISTRY.render()
+
+    target = str(tmp_path / "restored.db")
+    backup_db.restore_backup(result.path, target)
+    restored = sqlite3.connect(target)
+    assert restored.execute("SELECT count(*) FROM defects").fetchone() == (1000,)
+    restored.close()
+    with pytest.raises(backup_db.BackupError):
+        backup_db.restore_backup(result.path, target)
+
+def test_verify_rejects_damaged_backups(tmp_path):
+    source = str(tmp_path / "app.db")
+    make_database(source)
+    result = backup_db.backup_database(source, str(tmp_path))
+    with open(result.path, "rb") as f:
+        data = f.read()
+    with open(result.path, "wb") as f:
+        f.write(data[: len(data) // 2])
+    assert backup_db.verify_backup(result.path)
+    assert backup_db.main(["verify", result.path]) == 1
+
+    target = str(tmp_path / "restored.db")
+    with pytest.raises(backup_db.BackupError):
+        backup_db.restore_backup(result.path, target)
+    assert not os.path.exists(target)
+
+def test_retention_keeps_last_daily_and_weekly():
+    start = datetime.datetime(2024, 3, 31, 23, 0)
+    # Every 6 hours for 60 days, newest first
+    backups = [backup_db.BackupFile(f"b{i}", start - datetime.timedelta(hours=6 * i)) for i in range(240)]
+    expired = backup_db.select_expired(backups, keep_last=3, keep_daily=7, keep_weekly=4)
+    kept = sorted((b.created for b in backups if b not in expired), reverse=True)
+    assert kept[:3] == [backups[i].created for i in range(3)]
+    # Newest 3, newest of each of 7 days (the first is already kept), last backup of 3 earlier weeks
+    assert len(kept) == 3 + 6 + 3
+    assert kept[-3:] == [datetime.datetime(2024, 3, d, 23, 0) for d in (24, 17, 10)]
+    assert backup_db.select_expired(backups[:2], keep_last=3) == []
@@ -0,0 +1,125 @@
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from backend import crud, models, schemas, versions
+from backend.cache import CachedResponse, MemoryBackend, ResponseCache, TTLCache, UserCache, response_cache, user_cache
+from backend.main import pwd_context
+from backend.tests.conftest import count_statements
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def snapshot(username: str, user_id: int = 1) -> schemas.User:
+    return schemas.User(id=user_id, username=username, email=f"{username}@example.com", is_active=True)
+
+def test_ttl_cache_expires_and_evicts_least_recently_used():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+    clock.now = 10
+    assert cache.get("a") is None
+    assert len(cache) == 1
+
+def test_user_cache_invalidates_every_token_of_a_user():
+    cache = UserCache(maxsize=10, ttl=60)
+    cache.set("token-1", snapshot("alice"))
+    cache.set("token-2", snapshot("alice"))
+    cache.set("token-3", snapshot("bob", 2))
+    cache.invalidate_user("alice")
+    assert cache.get("token-1") is None and cache.get("token-2") is None
+    assert cache.get("token-3").username == "bob"
+
+def test_current_user_is_served_from_cache_until_role_changes(client: TestClient, db_session: Session):
+    crud.create_user(db_session, user=schemas.UserCreate(username="boss", email="boss@example.com", password="pass", role="manager"), pwd_context=pwd_context)
+    worker = crud.create_user(db_session, user=schemas.UserCreate(username="worker", email="worker@example.com", password="pass"), pwd_context=pwd_context)
+    boss_headers = {"Authorization": f"Bearer {client.post('/token', data={'username': 'boss', 'password': 'pass'}).json()['access_token']}"}
+    worker_headers = {"Authorization": f"Bearer {client.post('/token', data={'username': 'worker', 'password': 'pass'}).json()['access_token']}"}
+
+    assert client.get("/users/me/", headers=worker_headers).json()["role"] == "engineer"
+    hits = user_cache.hits
+    with count_statements(db_session) as statements:
+        assert client.get("/users/me/", headers=worker_headers).status_code == 200
+    assert statements == []
+    assert user_cache.hits == hits + 1
+
+    r = client.put(f"/users/{worker.id}/role", params={"new_role": "observer"}, headers=boss_headers)
+    assert r.status_code == 200
+    assert client.get("/users/me/", headers=worker_headers).json()["role"] == "observer"
+
+class BrokenBackend:
+    def get(self, key):
+        raise ConnectionError("cache is down")
+
+    def set(self, key, value, ttl):
+        raise ConnectionError("cache is down")
+
+def test_response_cache_round_trip_and_backend_errors_are_misses():
+    cache = ResponseCache(MemoryBackend(maxsize=10, ttl=60), ttl=60)
+    key = cache.key("/reports/x", [("b", "2"), ("a", "1")], "defects:1")
+    assert key == cache.key("/reports/x", [("a", "1"), ("b", "2")], "defects:1")
+    assert cache.get(key) is None
+    cache.set(key, CachedResponse(b'[{"a":\n1}]', '"tag"', None))
+    assert cache.get(key) == CachedResponse(b'[{"a":\n1}]', '"tag"', None)
+
+    broken = ResponseCache(BrokenBackend())
+    broken.set(key, CachedResponse(b"[]", '"tag"', None))
+    assert broken.get(key) is None and broken.errors == 2
+
+def test_data_versions_follow_orm_and_bulk_writes(db_session: Session):
+    def version(table):
+        return versions.current(db_session, (table,))[0][1]
+
+    user = crud.create_user(db_session, user=schemas.UserCreate(username="owner", email="owner@example.com", password="pass"), pwd_context=pwd_context)
+    project = crud.create_user_project(db_session, project=schemas.ProjectCreate(title="P"), user_id=user.id)
+    assert (version("projects"), version("defects")) == (1, 0)
+
+    crud.bulk_create_defects(db_session, enumerate([{"title": "A", "project_id": project.id}, {"title": "B", "project_id": project.id}], start=1), reporter_id=user.id)
+    assert version("defects") == 1  # one bump per transaction
+    ids = [d.id for d in crud.get_defects(db_session)]
+    crud.batch_update_defects(db_session, {defect_id: schemas.DefectUpdate(title="C") for defect_id in ids})
+    crud.update_defect(db_session, defect_id=ids[0], defect=schemas.DefectUpdate(title="D"))
+    assert (version("projects"), version("defects")) == (1, 3)
+
+    # Bumped together by one statement at commit, not row by row as the flushes happen
+    with count_statements(db_session) as statements:
+        db_session.add(models.Comment(content="c", author_id=user.id, defect_id=ids[0]))
+        db_session.flush()
+        crud.update_defect(db_session, defect_id=ids[1], defect=schemas.DefectUpdate(title="E"))
+    bumps = [i for i, statement in enumerate(statements) if "data_versions" in statement]
+    writes = [i for i, statement in enumerate(statements) if statement.startswith(("INSERT INTO comments", "UPDATE defects"))]
+    assert len(bumps) == 1 and len(writes) == 2 and bumps[0] > max(writes)
+    assert (version("comments"), version("defects")) == (1, 4)
+
+def test_analytics_are_cached_until_defects_change(client: TestClient, db_session: Session):
+    manager = crud.create_user(db_session, user=schemas.UserCreate(username="boss", email="boss@example.com", password="pass", role="manager"), pwd_context=pwd_context)
+    project = crud.create_user_project(db_session, project=schemas.ProjectCreate(title="P"), user_id=manager.id)
+    headers = {"Authorization": f"Bearer {client.post('/token', data={'username': 'boss', 'password': 'pass'}).json()['access_token']}"}
+    client.post("/defects/", json={"title": "One", "project_id": project.id}, headers=headers)
+
+    first = client.get("/reports/analytics/status-distribution", headers=headers)
+    assert first.status_code == 200 and first.json() == [{"status": "Новая", "count": 1}]
+    etag = first.headers["ETag"]
+    assert first.headers["Last-Modified"]
+
+    hits = response_cache.hits
+    with count_statements(db_session) as statements:
+        again = client.get("/reports/analytics/status-distribution", headers=headers)
+        not_modified = client.get("/reports/analytics/status-distribution", headers={**headers, "If-None-Match": etag})
+    assert again.content == first.content and response_cache.hits == hits + 1
+    assert not_modified.status_code == 304 and not_modified.content == b""
+    assert len(statements) == 2  # only the data version lookups; the 304 skips the cache too
+
+    client.post("/defects/", json={"title": "Two", "project_id": project.id}, headers=headers)
+    changed = client.get("/reports/analytics/status-distribution", headers={**headers, "If-None-Match": etag})
+    assert changed.status_code == 200 and changed.json() == [{"status": "Новая", "count": 2}]
+    assert changed.headers["ETag"] != etag
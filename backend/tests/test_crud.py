@@ -3,8 +3,9 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
 
 from backend.database import Base
-from backend import models, schemas, crud
+from backend import models, rollups, schemas, crud
 from passlib.context import CryptContext
+from datetime import date, datetime, timedelta
 
 # Setup for test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
@@ -195,3 +196,76 @@ def test_delete_attachment(db_session: Session, test_attachment: models.Attachme
     crud.delete_attachment(db_session, attachment_id=test_attachment.id)
     deleted_attachment = crud.get_attachment(db_session, attachment_id=test_attachment.id)
     assert deleted_attachment is None
+
+def test_get_defect_summary(db_session: Session, test_user: models.User, test_project: models.Project):
+    past = datetime.now() - timedelta(days=1)
+    crud.create_defect(db_session, defect=schemas.DefectCreate(title="Overdue", project_id=test_project.id, due_date=past), reporter_id=test_user.id)
+    crud.create_defect(db_session, defect=schemas.DefectCreate(title="Closed", project_id=test_project.id, due_date=past, status=schemas.DefectStatus.closed), reporter_id=test_user.id)
+    crud.create_defect(db_session, defect=schemas.DefectCreate(title="Open", project_id=test_project.id), reporter_id=test_user.id)
+
+    total, overdue, completed, active_projects = crud.get_defect_summary(db_session)
+    assert (total, overdue, completed, active_projects) == (3, 1, 1, 1)
+
+def test_get_defect_creation_trend(db_session: Session, test_user: models.User, test_project: models.Project):
+    for _ in range(2):
+        crud.create_defect(db_session, defect=schemas.DefectCreate(title="Today", project_id=test_project.id), reporter_id=test_user.id)
+
+    now = datetime.now()
+    trend = crud.get_defect_creation_trend(db_session, now - timedelta(days=1), now + timedelta(days=1))
+    assert len(trend) == 1
+    day, count = trend[0]
+    assert isinstance(day, date) and count == 2
+
+def test_rollups_follow_defect_writes(db_session: Session, test_user: models.User, test_project: models.Project):
+    defect = crud.create_defect(db_session, defect=schemas.DefectCreate(title="One", project_id=test_project.id), reporter_id=test_user.id)
+    crud.bulk_create_defects(db_session, enumerate([{"title": f"Bulk {i}", "project_id": test_project.id} for i in range(3)], start=1), reporter_id=test_user.id)
+    crud.update_defect(db_session, defect_id=defect.id, defect=schemas.DefectUpdate(status=schemas.DefectStatus.closed))
+    ids = sorted(d.id for d in crud.get_defects(db_session))
+    crud.batch_update_defects(db_session, {ids[1]: schemas.DefectUpdate(priority=schemas.DefectPriority.high), ids[2]: schemas.DefectUpdate(status=schemas.DefectStatus.cancelled)})
+    crud.delete_defect(db_session, defect_id=ids[3])
+
+    assert rollups.check(db_session) == []
+    assert dict(crud.get_defect_counts(db_session, "status")) == {"Новая": 1, "Закрыта": 1, "Отменена": 1}
+    assert crud.get_project_performance(db_session) == [(test_project.id, test_project.title, 3, 2)]
+
+def test_count_defects_partial_days(db_session: Session, test_user: models.User, test_project: models.Project):
+    base = datetime(2024, 3, 1)
+    created = [base + timedelta(days=day, hours=hour) for day in range(4) for hour in (1, 12, 23)]
+    db_session.execute(models.Defect.__table__.insert(), [
+        {"title": f"D{i}", "priority": "Средний", "status": "Новая", "created_at": at, "reporter_id": test_user.id, "project_id": test_project.id}
+        for i, at in enumerate(created)
+    ])
+    rollups.rebuild(db_session)
+    db_session.commit()
+
+    for start, end in [
+        (base + timedelta(hours=6), base + timedelta(days=3, hours=6)),
+        (base, base + timedelta(days=2)),
+        (base + timedelta(hours=2), base + timedelta(hours=20)),
+        (None, base + timedelta(days=1, hours=12)),
+        (base + timedelta(days=2, hours=12), None),
+    ]:
+        expected = sum(1 for at in created if (start is None or at >= start) and (end is None or at <= end))
+        assert sum(rollups.count_defects(db_session, ("status",), start, end).values()) == expected, (start, end)
+
+def test_get_defects_full_text_search(db_session: Session, test_user: models.User, test_project: models.Project):
+    cracked = crud.create_defect(db_session, defect=schemas.DefectCreate(title="Трещина в стене", description="Подъезд 2", project_id=test_project.id), reporter_id=test_user.id)
+    leak = crud.create_defect(db_session, defect=schemas.DefectCreate(title="Протечка кровли", project_id=test_project.id), reporter_id=test_user.id)
+    crud.create_comment(db_session, comment=schemas.CommentCreate(content="Нужна герметизация швов", defect_id=leak.id), author_id=test_user.id)
+
+    assert [d.id for d in crud.get_defects(db_session, search_query="трещ")] == [cracked.id]
+    assert [d.id for d in crud.get_defects(db_session, search_query="герметизация")] == [leak.id]
+    assert [d.id for d in crud.get_defects(db_session, search_query="подъезд стене")] == [cracked.id]
+
+    crud.update_defect(db_session, defect_id=cracked.id, defect=schemas.DefectUpdate(title="Скол плитки"))
+    assert crud.get_defects(db_session, search_query="трещина") == []
+    crud.delete_defect(db_session, defect_id=cracked.id)
+    assert crud.get_defects(db_session, search_query="скол") == []
+
+def test_get_defects_ranked_search(db_session: Session, test_user: models.User, test_project: models.Project):
+    weak = crud.create_defect(db_session, defect=schemas.DefectCreate(title="Окно", description="Продувает окно у двери", project_id=test_project.id), reporter_id=test_user.id)
+    strong = crud.create_defect(db_session, defect=schemas.DefectCreate(title="Дверь", description="Дверь не закрывается, дверь перекошена", project_id=test_project.id), reporter_id=test_user.id)
+
+    assert [d.id for d in crud.get_defects(db_session, search_query="двер")] == [weak.id, strong.id]
+    assert [d.id for d in crud.get_defects(db_session, search_query="двер", ranked=True)] == [strong.id, weak.id]
+    assert [d.id for d in crud.get_defects(db_session, search_query="двер", after_id=weak.id)] == [strong.id]
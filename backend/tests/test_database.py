@@ -0,0 +1,22 @@
+from backend.database import create_db_engine, engine_options
+
+def read_pragmas(engine):
+    with engine.connect() as conn:
+        return {name: conn.exec_driver_sql(f"PRAGMA {name}").scalar() for name in ("journal_mode", "synchronous", "busy_timeout")}
+
+def test_production_profile_applies_pragmas(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'prod.db'}", profile="production")
+    assert read_pragmas(engine) == {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 5000}
+    assert engine.pool.size() > 5
+    engine.dispose()
+
+def test_default_profile_keeps_sqlite_defaults(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'plain.db'}", profile="default")
+    assert read_pragmas(engine)["journal_mode"] == "delete"
+    engine.dispose()
+
+def test_postgres_engine_is_pooled_with_pre_ping_and_statement_timeout():
+    engine = create_db_engine("postgresql://app:secret@db:5432/defects")
+    assert engine.pool._pre_ping
+    assert engine.pool.size() > 5
+    assert "statement_timeout" in engine_options(engine.url)["connect_args"]["options"]
@@ -0,0 +1,88 @@
+import time
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from backend import crud, export_jobs, models, schemas
+from backend.tests.conftest import populate
+
+def wait_for(client: TestClient, job_id: str, headers: dict, timeout: float = 60) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f"/reports/defects/export/jobs/{job_id}", headers=headers).json()
+        if job["status"] in ("done", "failed") or time.monotonic() > deadline:
+            return job
+        time.sleep(0.1)
+
+def test_export_job_runs_in_background_and_is_shared(client: TestClient, db_session: Session, auth, tmp_path, monkeypatch):
+    user_id, headers = auth
+    populate(db_session, user_id, projects=2, defects_per_project=3)
+    monkeypatch.setattr(export_jobs.runner, "directory", str(tmp_path))
+
+    r = client.post("/reports/defects/export/jobs", json={"format": "csv", "status": "Новая"}, headers=headers)
+    assert r.status_code == 202 and r.json()["status"] in ("queued", "running", "done")
+    job_id = r.json()["id"]
+    # Same export while the defects are unchanged: same job
+    assert client.post("/reports/defects/export/jobs", json={"status": "Новая"}, headers=headers).json()["id"] == job_id
+    assert client.post("/reports/defects/export/jobs", json={"format": "xlsx", "status": "Новая"}, headers=headers).json()["id"] != job_id
+
+    job = wait_for(client, job_id, headers)
+    assert (job["status"], job["processed"], job["total"], job["progress"]) == ("done", 6, 6, 100.0)
+    r = client.get(job["download_url"], headers=headers)
+    expected = client.get("/reports/defects/export", params={"format": "csv", "status": "Новая"}, headers=headers)
+    assert r.status_code == 200 and r.content == expected.content
+    assert r.headers["content-disposition"] == 'attachment; filename="defects_report.csv"'
+    assert client.get(job["download_url"], headers={**headers, "If-None-Match": r.headers["etag"]}).status_code == 304
+
+    # A write to defects changes the key: the next request exports the new data
+    crud.create_defect(db_session, defect=schemas.DefectCreate(title="New", priority="Низкий", status="Новая", project_id=1), reporter_id=user_id)
+    new_id = client.post("/reports/defects/export/jobs", json={"status": "Новая"}, headers=headers).json()["id"]
+    assert new_id != job_id and wait_for(client, new_id, headers)["total"] == 7
+
+def test_expired_and_unfinished_jobs(client: TestClient, db_session: Session, auth, tmp_path, monkeypatch):
+    user_id, headers = auth
+    monkeypatch.setattr(export_jobs.runner, "directory", str(tmp_path))
+    job = crud.create_export_job(db_session, "a" * 32, "key", "csv", user_id)
+    assert client.get(f"/reports/defects/export/jobs/{job.id}/download", headers=headers).status_code == 409
+
+    finished = export_jobs._utcnow()
+    crud.update_export_job(db_session, job.id, status="done", finished_at=finished, expires_at=finished)
+    (tmp_path / f"{job.id}.csv").write_text("ID\n")
+    assert client.get(f"/reports/defects/export/jobs/{job.id}/download", headers=headers).status_code == 404
+    export_jobs.runner.purge_expired(db_session)
+    assert crud.get_export_job(db_session, job.id) is None and not (tmp_path / f"{job.id}.csv").exists()
+    assert client.get("/reports/defects/export/jobs/unknown", headers=headers).status_code == 404
+
+def test_queued_jobs_stay_alive_while_they_wait(db_session: Session, auth):
+    user_id, _ = auth
+    runner = export_jobs.ExportJobRunner()
+    job = crud.create_export_job(db_session, "b" * 32, "key", "csv", user_id)
+    waited = export_jobs._utcnow() - timedelta(seconds=export_jobs.EXPORT_JOB_STALE_SECONDS + 60)
+    db_session.query(models.ExportJob).update({"updated_at": waited})
+    db_session.commit()
+    stale_before = export_jobs._utcnow() - timedelta(seconds=export_jobs.EXPORT_JOB_STALE_SECONDS)
+    assert crud.find_export_job(db_session, "key", stale_before) is None
+
+    # The process that queued the job refreshes it, so identical requests keep sharing it
+    runner._waiting[job.id] = db_session.get_bind().url.render_as_string(hide_password=False)
+    runner.refresh_waiting()
+    db_session.expire_all()
+    assert crud.find_export_job(db_session, "key", stale_before).id == job.id
+    assert runner.describe(crud.get_export_job(db_session, job.id)).status == "queued"
+
+class BrokenPool:
+    def submit(self, *args):
+        raise BrokenProcessPool("no workers")
+
+def test_job_that_cannot_be_submitted_is_failed(db_session: Session, auth, monkeypatch):
+    user_id, _ = auth
+    runner = export_jobs.ExportJobRunner()
+    monkeypatch.setattr(runner, "_pool", lambda: BrokenPool())
+    with pytest.raises(BrokenProcessPool):
+        runner.submit(db_session, schemas.ExportJobCreate(format="csv"), user_id)
+    job = db_session.query(models.ExportJob).one()
+    assert job.status == "failed" and job.error.startswith("Export could not be started")
+    assert runner._active == 0 and runner._waiting == {}
@@ -0,0 +1,12 @@
+import asyncio
+
+from backend import hashing
+
+def test_password_hashing_runs_in_pool():
+    async def roundtrip():
+        hashed = await hashing.hash_password("s3cret")
+        return hashed, await hashing.verify_password("s3cret", hashed), await hashing.verify_password("wrong", hashed)
+
+    hashed, ok, wrong = asyncio.run(roundtrip())
+    assert hashed.startswith("$2b$")
+    assert ok and not wrong
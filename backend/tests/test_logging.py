@@ -0,0 +1,52 @@
+import json
+import logging
+import queue
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.logging_setup import AccessLogSampler, JsonFormatter, NonBlockingQueueHandler, parse_sample_rates
+
+def make_record(msg, args=(), **extra):
+    record = logging.LogRecord("backend.test", logging.INFO, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+def test_json_formatter_includes_extra_fields_and_exceptions():
+    with pytest.raises(ValueError) as raised:
+        raise ValueError("boom")
+    exc_info = (raised.type, raised.value, raised.tb)
+    record = logging.LogRecord("backend.test", logging.ERROR, __file__, 1, "failed %s", ("x",), exc_info)
+    record.status = 500
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "failed x" and entry["level"] == "ERROR" and entry["status"] == 500
+    assert "ValueError: boom" in entry["exc_info"]
+
+def test_queue_handler_defers_plain_formatting_and_drops_when_full():
+    handler = NonBlockingQueueHandler(queue.SimpleQueue(), maxsize=2)
+    plain = make_record("user %s id %s", ("alice", 1))
+    handler.handle(plain)
+    items = ["a"]
+    mutable = make_record("items %s", (items,))
+    handler.handle(mutable)
+    items.append("b")
+    handler.handle(make_record("dropped"))
+
+    assert plain.args == ("alice", 1)  # formatted later, on the listener thread
+    assert mutable.msg == "items ['a']" and mutable.args is None
+    assert handler.queue.qsize() == 2 and handler.dropped == 1
+
+def test_access_log_sampler_rates():
+    sampler = AccessLogSampler(0.5, parse_sample_rates("/reports/analytics/*=0, /users/me/=1"), slow_ms=100, rng=lambda: 0.4)
+    assert sampler.sample("/reports/analytics/summary", 200, 5) == 0.0
+    assert sampler.sample("/reports/analytics/summary", 500, 5) == 1.0  # errors are always logged
+    assert sampler.sample("/reports/analytics/summary", 200, 150) == 1.0  # so are slow requests
+    assert sampler.sample("/users/me/", 200, 5) == 1.0
+    assert sampler.sample("/defects/{defect_id}", 200, 5) == 0.5
+    assert AccessLogSampler(0.5, rng=lambda: 0.6).sample("/defects/", 200, 5) == 0.0
+
+def test_access_log_records_route_template(client: TestClient, caplog):
+    with caplog.at_level(logging.INFO, logger="backend.access"):
+        client.get("/users/123")
+    record = next(r for r in caplog.records if r.name == "backend.access")
+    assert (record.route, record.status, record.sample_rate) == ("/users/{user_id}", 401, 1.0)
@@ -181,3 +181,19 @@ def test_delete_project_api(client: TestClient, test_user: models.User, auth_tok
         }
     )
     assert response.status_code == 404
+
+# Async endpoints that take a DB session must hand the blocking work to the threadpool
+ASYNC_DB_ENDPOINTS = {"login_for_access_token", "register_new_user", "create_user_api"}
+
+def test_async_endpoints_do_not_block_on_db():
+    import inspect
+    from fastapi.routing import APIRoute
+
+    offenders = {
+        route.endpoint.__name__
+        for route in app.routes
+        if isinstance(route, APIRoute)
+        and inspect.iscoroutinefunction(route.endpoint)
+        and "db" in inspect.signature(route.endpoint).parameters
+    }
+    assert offenders <= ASYNC_DB_ENDPOINTS, offenders - ASYNC_DB_ENDPOINTS
@@ -0,0 +1,49 @@
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from backend import crud, metrics, schemas
+from backend.main import pwd_context
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("test_seconds", "Test", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, 'a"b')
+    lines = histogram.render()
+    assert 'test_seconds_bucket{route="a\\"b",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{route="a\\"b",le="1.0"} 3' in lines
+    assert 'test_seconds_bucket{route="a\\"b",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{route="a\\"b"} 4' in lines
+    assert 'test_seconds_sum{route="a\\"b"} 4.05' in lines
+
+def test_metrics_endpoint_reports_routes_sql_and_bcrypt(client: TestClient, db_session: Session):
+    crud.create_user(db_session, user=schemas.UserCreate(username="metric", email="metric@example.com", password="pass", role="manager"), pwd_context=pwd_context)
+    verifies = metrics.PASSWORD_HASH_DURATION.snapshot("verify")[0]
+    token = client.post("/token", data={"username": "metric", "password": "pass"}).json()["access_token"]
+    assert sum(metrics.PASSWORD_HASH_DURATION.snapshot("verify")[0]) == sum(verifies) + 1
+
+    db_before = metrics.HTTP_DB_DURATION.snapshot("GET", "/projects/")
+    requests_before = metrics.HTTP_REQUESTS.value("GET", "/projects/", 200)
+    assert client.get("/projects/", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+    assert metrics.HTTP_REQUESTS.value("GET", "/projects/", 200) == requests_before + 1
+    db_after = metrics.HTTP_DB_DURATION.snapshot("GET", "/projects/")
+    assert sum(db_after[0]) == sum(db_before[0]) + 1 and db_after[1] > db_before[1]
+
+    r = client.get("/metrics")
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = r.text
+    assert 'http_requests_total{method="GET",route="/projects/",status="200"}' in body
+    assert 'db_statement_duration_seconds_count{operation="SELECT"}' in body
+    assert 'password_hash_duration_seconds_count{operation="verify"}' in body
+    assert "db_pool_checked_out " in body and "http_requests_in_progress " in body
+    assert 'auth_cache_lookups_total{result="miss"}' in body
+
+def test_unmatched_paths_share_one_label(client: TestClient):
+    before = metrics.HTTP_REQUESTS.value("GET", "unmatched", 404)
+    client.get("/no/such/path/1")
+    client.get("/no/such/path/2")
+    assert metrics.HTTP_REQUESTS.value("GET", "unmatched", 404) == before + 2
+
+def test_metrics_token(client: TestClient, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "secret")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer secret"}).status_code == 200
@@ -0,0 +1,94 @@
+import os
+import time
+
+import anyio
+from starlette.concurrency import run_in_threadpool
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from backend import crud, profiling, schemas
+from backend.main import pwd_context
+
+def login(client: TestClient, db_session: Session, username: str, role: str) -> dict:
+    crud.create_user(db_session, user=schemas.UserCreate(username=username, email=f"{username}@example.com", password="pass", role=role), pwd_context=pwd_context)
+    token = client.post("/token", data={"username": username, "password": "pass"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+def test_profiles_are_sampled_written_and_rotated(client: TestClient, db_session: Session, tmp_path, monkeypatch):
+    profiler = profiling.Profiler(directory=str(tmp_path), max_files=2, settings=profiling.Settings(enabled=False, sample_rate=1.0, slow_ms=60000, interval_ms=1))
+    monkeypatch.setattr(profiling, "profiler", profiler)
+    admin = login(client, db_session, "prof_admin", "admin")
+    engineer = login(client, db_session, "prof_engineer", "engineer")
+    assert client.put("/admin/profiling", json={"enabled": True}, headers=engineer).status_code == 403
+
+    r = client.put("/admin/profiling", json={"enabled": True}, headers=admin)
+    assert r.status_code == 200 and r.json()["enabled"] is True and r.json()["sample_rate"] == 1.0
+    for _ in range(3):
+        assert client.get("/projects/", headers=admin).status_code == 200
+    profiler.flush()
+
+    profiles = client.get("/admin/profiles", headers=admin).json()
+    assert len(profiles) == 2  # the oldest was rotated out
+    assert {p["route"] for p in profiles} == {"/projects/"} and {p["reason"] for p in profiles} == {"sampled"}
+    profile = client.get(f"/admin/profiles/{profiles[0]['id']}", headers=admin).json()
+    assert profile["statements"] == len(profile["sql"]) > 0
+    assert any("FROM projects" in s["statement"] for s in profile["sql"])
+    assert client.get("/admin/profiles/..%2Fsettings", headers=admin).status_code == 404
+
+    # Turned off at runtime: nothing more is recorded
+    client.put("/admin/profiling", json={"enabled": False}, headers=admin)
+    kept = profiler.kept
+    client.get("/projects/", headers=admin)
+    assert profiler.kept == kept
+
+def test_slow_requests_are_kept_and_settings_reach_other_workers(tmp_path):
+    first = profiling.Profiler(directory=str(tmp_path), settings=profiling.Settings(enabled=False))
+    second = profiling.Profiler(directory=str(tmp_path), settings=profiling.Settings(enabled=False), rng=lambda: 0.99)
+    first.update_settings(enabled=True, sample_rate=0.5, slow_ms=0)
+    assert second.current_settings().enabled and second.settings.sample_rate == 0.5
+
+    trace = second.start("GET", "/slow")
+    assert trace is not None
+    profile_id = second.finish(trace, "/slow", 200, 0.002)
+    second.flush()
+    assert second.load(profile_id)["reason"] == "slow"
+    assert os.path.exists(os.path.join(tmp_path, profile_id + ".json"))
+    assert profiling.current_trace.get() is None
+
+def spin(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+def test_work_without_sql_is_sampled_on_loop_and_threadpool(tmp_path):
+    profiler = profiling.Profiler(directory=str(tmp_path), settings=profiling.Settings(enabled=True, sample_rate=1.0, interval_ms=1))
+
+    async def request():
+        trace = profiler.start("GET", "/spin")
+        spin(0.05)  # before any SQL, on the event loop thread
+        await run_in_threadpool(spin, 0.05)  # a threadpool hop, as for sync endpoints
+        return profiler.finish(trace, "/spin", 200, 0.1)
+
+    profile_id = anyio.run(request)
+    profiler.flush()
+    collapsed = profiler.load(profile_id)["collapsed"]
+    assert any("request;spin" in line for line in collapsed)
+    assert any("_run_tagged;spin" in line for line in collapsed)
+    assert not profiling._active_threads
+
+def test_event_loop_shared_by_requests_is_not_credited_to_either(tmp_path):
+    profiler = profiling.Profiler(directory=str(tmp_path), settings=profiling.Settings(enabled=True, sample_rate=1.0, interval_ms=1))
+    first = profiler.start("GET", "/first")
+    second = profiler.start("GET", "/second")  # both in flight on this (event loop) thread
+    spin(0.05)
+    second_id = profiler.finish(second, "/second", 200, 0.05)
+    spin(0.05)  # the first request again has the thread to itself
+    first_id = profiler.finish(first, "/first", 200, 0.1)
+    profiler.flush()
+
+    second_profile = profiler.load(second_id)
+    assert second_profile["samples"] == 0 and second_profile["unattributed_samples"] > 0
+    first_profile = profiler.load(first_id)
+    assert first_profile["samples"] > 0 and first_profile["unattributed_samples"] > 0
+    assert not profiling._active_threads
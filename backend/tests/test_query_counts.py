@@ -0,0 +1,78 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.tests.conftest import count_statements, populate
+
+# Statements a list request may issue, independent of page size: the page itself and one
+# SELECT ... IN per eager-loaded relationship and the data version lookup for the ETag
+# (the user lookup is served by the auth cache)
+MAX_LIST_STATEMENTS = 6
+
+@pytest.mark.parametrize("path, relation", [
+    ("/projects/?expand=defects", "defects"),
+    ("/defects/?expand=comments,attachments", "comments"),
+    ("/projects/", None),
+    ("/defects/", None),
+])
+def test_list_endpoints_issue_constant_number_of_statements(client: TestClient, db_session: Session, auth, path: str, relation):
+    user_id, headers = auth
+    counts = []
+    for projects in (2, 20):
+        populate(db_session, user_id, projects)
+        with count_statements(db_session) as statements:
+            r = client.get(path, headers=headers)
+        assert r.status_code == 200
+        if relation:
+            assert r.json()[0][relation]
+        counts.append(len(statements))
+    assert counts[0] == counts[1], counts
+    assert counts[1] <= MAX_LIST_STATEMENTS, counts
+
+def test_list_endpoints_are_flat_unless_expanded(client: TestClient, db_session: Session, auth):
+    user_id, headers = auth
+    populate(db_session, user_id, 1)
+
+    project = client.get("/projects/", headers=headers).json()[0]
+    assert "defects" not in project
+    defect = client.get("/defects/", headers=headers).json()[0]
+    assert "comments" not in defect and "attachments" not in defect
+
+    defect = client.get("/defects/?expand=attachments", headers=headers).json()[0]
+    assert defect["attachments"][0]["filename"] == "f"
+    assert "comments" not in defect
+
+    r = client.get("/defects/?expand=reporter", headers=headers)
+    assert r.status_code == 400
+
+def test_conditional_gets_short_circuit_on_etag(client: TestClient, db_session: Session, auth):
+    user_id, headers = auth
+    populate(db_session, user_id, 2)
+    defect_id = db_session.query(models.Defect.id).first()[0]
+    project_id = db_session.query(models.Project.id).first()[0]
+    paths = ["/projects/", "/projects/?expand=defects", f"/projects/{project_id}", "/defects/", f"/defects/{defect_id}"]
+
+    etags = {}
+    for path in paths:
+        r = client.get(path, headers=headers)
+        assert r.status_code == 200 and r.headers["Cache-Control"] == "private, no-cache"
+        etags[path] = r.headers["ETag"]
+        with count_statements(db_session) as statements:
+            r = client.get(path, headers={**headers, "If-None-Match": etags[path]})
+        assert r.status_code == 304 and r.headers["ETag"] == etags[path]
+        # The data version lookup, plus an id lookup for a single project or defect
+        assert len(statements) == (2 if path in (f"/projects/{project_id}", f"/defects/{defect_id}") else 1), statements
+
+    # A comment changes the representations that embed comments, not the flat lists
+    r = client.post(f"/defects/{defect_id}/comments/", json={"content": "new", "defect_id": defect_id}, headers=headers)
+    assert r.status_code == 200
+    changed = {path for path in paths if client.get(path, headers={**headers, "If-None-Match": etags[path]}).status_code == 200}
+    assert changed == {"/projects/?expand=defects", f"/projects/{project_id}", f"/defects/{defect_id}"}
+
+    # The versions match any id, so a missing one is still 404 rather than 304
+    deleted_id = client.post("/defects/", json={"title": "gone", "description": "", "project_id": project_id}, headers=headers).json()["id"]
+    assert client.delete(f"/defects/{deleted_id}", headers=headers).status_code == 204
+    for path in (f"/defects/{deleted_id}", "/projects/999999"):
+        for validator in ({"If-None-Match": "*"}, {"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"}):
+            assert client.get(path, headers={**headers, **validator}).status_code == 404
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from backend import crud, schemas
+
+NOW = datetime(2025, 1, 1)
+
+# Filter combinations issued by GET /defects/ and /reports/defects/export
+FILTER_COMBINATIONS = [
+    {"project_id": 1},
+    {"project_id": 1, "status": schemas.DefectStatus.new},
+    {"project_id": 1, "priority": schemas.DefectPriority.high},
+    {"project_id": 1, "status": schemas.DefectStatus.new, "priority": schemas.DefectPriority.high},
+    {"project_id": 1, "created_start_date": NOW - timedelta(days=7)},
+    {"status": schemas.DefectStatus.in_progress},
+    {"status": schemas.DefectStatus.in_progress, "priority": schemas.DefectPriority.critical},
+    {"priority": schemas.DefectPriority.critical},
+    {"assignee_id": 2},
+    {"assignee_id": 2, "status": schemas.DefectStatus.on_review},
+    {"reporter_id": 3},
+    {"reporter_id": 3, "status": schemas.DefectStatus.new},
+    {"created_start_date": NOW - timedelta(days=7)},
+    {"created_start_date": NOW - timedelta(days=7), "created_end_date": NOW},
+    {"due_start_date": NOW, "due_end_date": NOW + timedelta(days=7)},
+    {"due_end_date": NOW, "status": schemas.DefectStatus.new},
+]
+
+def _explain_get_defects(db_session: Session, filters: dict, after_id=None):
+    bind = db_session.get_bind()
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "FROM defects" in statement:
+            captured.append((statement, parameters))
+
+    event.listen(bind, "before_cursor_execute", capture)
+    try:
+        crud.get_defects(db_session, after_id=after_id, **filters)
+    finally:
+        event.remove(bind, "before_cursor_execute", capture)
+
+    statement, parameters = captured[-1]
+    with bind.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+    return [row[-1] for row in rows]
+
+@pytest.mark.parametrize("after_id", [None, 1000], ids=["offset", "keyset"])
+@pytest.mark.parametrize("filters", FILTER_COMBINATIONS, ids=lambda f: "+".join(f))
+def test_defect_filters_use_an_index(db_session: Session, filters: dict, after_id):
+    plan = _explain_get_defects(db_session, filters, after_id)
+    defects_steps = [step for step in plan if " defects " in f"{step} "]
+    assert defects_steps, plan
+    for step in defects_steps:
+        assert step.startswith("SEARCH defects USING"), plan
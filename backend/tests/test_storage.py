@@ -0,0 +1,126 @@
+import hashlib
+import io
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from backend import crud, downloads, models, storage
+from backend.tests.conftest import populate
+
+def blob_files(root) -> list:
+    # Blobs only, not the previews/markers stored next to them
+    return sorted(name for _, _, names in os.walk(os.path.join(root, "blobs")) for name in names if "." not in name)
+
+def test_hash_stream_enforces_size_limit():
+    store = storage.BlobStore(chunk_size=4)
+    assert store.hash_stream(io.BytesIO(b"0123456789")) == (hashlib.sha256(b"0123456789").hexdigest(), 10)
+    with pytest.raises(storage.QuotaExceeded):
+        store.hash_stream(io.BytesIO(b"0123456789"), max_bytes=8)
+
+def test_duplicate_uploads_share_one_blob(client: TestClient, db_session: Session, auth, tmp_path, monkeypatch):
+    user_id, headers = auth
+    populate(db_session, user_id, projects=1, defects_per_project=2)
+    first, second = [d.id for d in db_session.query(models.Defect.id).order_by(models.Defect.id)]
+    monkeypatch.setattr(storage.blob_store, "root", str(tmp_path))
+    content = b"site photo" * 1000
+    digest = hashlib.sha256(content).hexdigest()
+
+    uploads = [
+        client.post(f"/defects/{defect_id}/attachments/", files={"file": (name, content, "image/jpeg")}, headers=headers).json()
+        for defect_id, name in ((first, "photo.jpg"), (second, "copy.jpg"))
+    ]
+    assert [(a["sha256"], a["size"], a["filename"]) for a in uploads] == [(digest, len(content), "photo.jpg"), (digest, len(content), "copy.jpg")]
+    assert blob_files(tmp_path) == [digest]
+    assert crud.get_blob(db_session, digest).ref_count == 2
+
+    r = client.get(f"/defects/{second}/attachments/{uploads[1]['id']}/download", headers=headers)
+    assert r.content == content and r.headers["content-type"] == "image/jpeg"
+
+    assert client.delete(f"/defects/{first}/attachments/{uploads[0]['id']}", headers=headers).status_code == 204
+    db_session.expire_all()
+    assert blob_files(tmp_path) == [digest] and crud.get_blob(db_session, digest).ref_count == 1
+    assert client.delete(f"/defects/{second}/attachments/{uploads[1]['id']}", headers=headers).status_code == 204
+    db_session.expire_all()
+    assert crud.get_blob(db_session, digest) is None
+    # The file stays until garbage collection, and not while it is recent: an upload of the same
+    # content may have just reused it
+    assert blob_files(tmp_path) == [digest]
+    assert storage.collect_garbage(db_session, storage.blob_store) == 0
+    storage.collect_garbage(db_session, storage.blob_store, min_age_seconds=-1)
+    assert not list(tmp_path.rglob(f"{digest}*"))
+
+def test_reused_blob_is_not_collected(db_session: Session, auth, tmp_path):
+    user_id, _ = auth
+    populate(db_session, user_id, projects=1, defects_per_project=1)
+    defect_id = db_session.query(models.Defect.id).scalar()
+    store = storage.BlobStore(root=str(tmp_path))
+    content = io.BytesIO(b"scan")
+    blob = storage.store_upload(db_session, content, defect_id, store)
+    # Stored long ago and unreferenced (its last attachment was deleted)
+    os.utime(blob.path, (0, 0))
+
+    # A new upload of the same content finds the file and reuses it while the collector runs
+    storage.ensure_stored(content, blob, store)
+    assert storage.collect_garbage(db_session, store) == 0
+    assert blob_files(tmp_path) == [blob.sha256]
+
+def test_upload_quotas(client: TestClient, db_session: Session, auth, tmp_path, monkeypatch):
+    user_id, headers = auth
+    populate(db_session, user_id, projects=1, defects_per_project=1)
+    defect_id = db_session.query(models.Defect.id).scalar()
+    monkeypatch.setattr(storage.blob_store, "root", str(tmp_path))
+    monkeypatch.setattr(storage, "ATTACHMENT_MAX_BYTES", 100)
+    monkeypatch.setattr(storage, "ATTACHMENT_DEFECT_QUOTA_BYTES", 150)
+
+    assert client.post(f"/defects/{defect_id}/attachments/", files={"file": ("big.bin", b"x" * 101)}, headers=headers).status_code == 413
+    assert client.post(f"/defects/{defect_id}/attachments/", files={"file": ("a.bin", b"a" * 100)}, headers=headers).status_code == 200
+    r = client.post(f"/defects/{defect_id}/attachments/", files={"file": ("b.bin", b"b" * 100)}, headers=headers)
+    assert r.status_code == 413 and "defect" in r.json()["detail"]
+    assert len(blob_files(tmp_path)) == 1
+
+def test_oversized_upload_is_refused_before_it_is_received(client: TestClient, db_session: Session, auth, tmp_path, monkeypatch):
+    user_id, headers = auth
+    populate(db_session, user_id, projects=1, defects_per_project=1)
+    defect_id = db_session.query(models.Defect.id).scalar()
+    monkeypatch.setattr(storage.blob_store, "root", str(tmp_path))
+    monkeypatch.setattr(storage, "ATTACHMENT_MAX_BYTES", 100)
+
+    def store_upload(*args, **kwargs):
+        raise AssertionError("the upload reached the endpoint")
+
+    monkeypatch.setattr(storage, "store_upload", store_upload)
+    r = client.post(f"/defects/{defect_id}/attachments/", files={"file": ("big.bin", b"x" * (storage.UPLOAD_OVERHEAD_BYTES + 101))}, headers=headers)
+    assert r.status_code == 413 and "100 byte limit" in r.json()["detail"]
+
+def test_downloads_support_ranges_and_revalidation(client: TestClient, db_session: Session, auth, tmp_path, monkeypatch):
+    user_id, headers = auth
+    populate(db_session, user_id, projects=1, defects_per_project=1)
+    defect_id = db_session.query(models.Defect.id).scalar()
+    monkeypatch.setattr(storage.blob_store, "root", str(tmp_path))
+    content = bytes(range(256)) * 40
+    attachment = client.post(f"/defects/{defect_id}/attachments/", files={"file": ("plan.pdf", content)}, headers=headers).json()
+    url = f"/defects/{defect_id}/attachments/{attachment['id']}/download"
+
+    r = client.get(url, headers=headers)
+    etag = f'"{attachment["sha256"]}"'
+    assert r.content == content and r.headers["etag"] == etag and r.headers["accept-ranges"] == "bytes"
+    assert r.headers["cache-control"] == "private, max-age=31536000, immutable"
+    assert r.headers["content-type"] == "application/pdf"
+
+    # Resuming from byte 1000, only while the file is still the same one
+    r = client.get(url, headers={**headers, "Range": "bytes=1000-", "If-Range": etag})
+    assert r.status_code == 206 and r.content == content[1000:] and r.headers["content-range"] == f"bytes 1000-{len(content) - 1}/{len(content)}"
+    r = client.get(url, headers={**headers, "Range": "bytes=1000-", "If-Range": '"stale"'})
+    assert r.status_code == 200 and r.content == content
+    assert client.get(url, headers={**headers, "Range": f"bytes={len(content)}-"}).status_code == 416
+
+    r = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert r.status_code == 304 and r.content == b"" and r.headers["etag"] == etag
+
+    monkeypatch.setattr(downloads, "ATTACHMENT_SENDFILE_HEADER", "X-Accel-Redirect")
+    r = client.get(url, headers=headers)
+    sha = attachment["sha256"]
+    assert r.content == b"" and r.headers["x-accel-redirect"] == f"/_attachments/blobs/{sha[:2]}/{sha[2:4]}/{sha}"
+    assert r.headers["content-disposition"] == 'attachment; filename="plan.pdf"'
@@ -0,0 +1,79 @@
+import io
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from backend import models, storage, thumbnails
+from backend.tests.conftest import populate
+
+Image = pytest.importorskip("PIL.Image")
+
+def png(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGBA", (width, height), (200, 30, 30, 128)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+def test_previews_are_generated_in_background_and_cached(client: TestClient, db_session: Session, auth, tmp_path, monkeypatch):
+    user_id, headers = auth
+    populate(db_session, user_id, projects=1, defects_per_project=1)
+    defect_id = db_session.query(models.Defect.id).scalar()
+    monkeypatch.setattr(storage.blob_store, "root", str(tmp_path))
+
+    photo = client.post(f"/defects/{defect_id}/attachments/", files={"file": ("site.png", png(2000, 1000))}, headers=headers).json()
+    thumbnails.pool.wait()
+    base = f"/defects/{defect_id}/attachments/{photo['id']}"
+    for variant, size in thumbnails.VARIANTS.items():
+        r = client.get(f"{base}/{variant}", headers=headers)
+        assert r.status_code == 200 and r.headers["content-type"] == "image/jpeg"
+        assert r.headers["cache-control"] == "private, max-age=31536000, immutable"
+        assert r.headers["content-disposition"] == f'inline; filename="site.{variant}.jpg"'
+        assert Image.open(io.BytesIO(r.content)).size == (size, size // 2)
+        assert client.get(f"{base}/{variant}", headers={**headers, "If-None-Match": r.headers["etag"]}).status_code == 304
+
+    # Previews are collected with the image once no attachment uses it
+    assert client.delete(base, headers=headers).status_code == 204
+    storage.collect_garbage(db_session, storage.blob_store, min_age_seconds=-1)
+    assert not list(tmp_path.rglob(f"{photo['sha256']}*"))
+
+def test_missing_previews_are_generated_on_request(client: TestClient, db_session: Session, auth, tmp_path, monkeypatch):
+    user_id, headers = auth
+    populate(db_session, user_id, projects=1, defects_per_project=1)
+    defect_id = db_session.query(models.Defect.id).scalar()
+    monkeypatch.setattr(storage.blob_store, "root", str(tmp_path))
+    monkeypatch.setattr(thumbnails.pool, "queue_size", 0)  # the upload finds the queue full
+
+    photo = client.post(f"/defects/{defect_id}/attachments/", files={"file": ("site.png", png(300, 300))}, headers=headers).json()
+    r = client.get(f"/defects/{defect_id}/attachments/{photo['id']}/thumbnail", headers=headers)
+    assert r.status_code == 200 and Image.open(io.BytesIO(r.content)).size == (256, 256)
+
+    broken = client.post(f"/defects/{defect_id}/attachments/", files={"file": ("broken.jpg", b"not an image")}, headers=headers).json()
+    assert client.get(f"/defects/{defect_id}/attachments/{broken['id']}/preview", headers=headers).status_code == 404
+    text = client.post(f"/defects/{defect_id}/attachments/", files={"file": ("notes.txt", b"text")}, headers=headers).json()
+    assert client.get(f"/defects/{defect_id}/attachments/{text['id']}/preview", headers=headers).status_code == 404
+    assert client.get(f"/defects/{defect_id}/attachments/{text['id']}/poster", headers=headers).status_code == 422
+
+def test_preview_requests_are_bounded_too(client: TestClient, db_session: Session, auth, tmp_path, monkeypatch):
+    user_id, headers = auth
+    populate(db_session, user_id, projects=1, defects_per_project=1)
+    defect_id = db_session.query(models.Defect.id).scalar()
+    monkeypatch.setattr(storage.blob_store, "root", str(tmp_path))
+    busy = threading.Event()
+    monkeypatch.setattr(thumbnails, "generate", lambda blob_path: busy.wait(5))
+    pool = thumbnails.ThumbnailPool(workers=1, queue_size=0, max_pending=1)
+    monkeypatch.setattr(thumbnails, "pool", pool)
+
+    first, second = [
+        client.post(f"/defects/{defect_id}/attachments/", files={"file": (f"{name}.png", png(10 + i, 10))}, headers=headers).json()
+        for i, name in enumerate(("first", "second"))
+    ]
+    waiting = pool.submit(storage.blob_store.path_for(first["sha256"]), force=True)
+    assert pool.submit(storage.blob_store.path_for(first["sha256"]), force=True) is waiting
+    with pytest.raises(thumbnails.PoolFull):
+        pool.submit(storage.blob_store.path_for(second["sha256"]), force=True)
+    r = client.get(f"/defects/{defect_id}/attachments/{second['id']}/thumbnail", headers=headers)
+    assert r.status_code == 503 and r.headers["retry-after"] == "5"
+    busy.set()
+    pool.wait()
+    assert pool.pending() == 0
@@ -0,0 +1,168 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+
+from . import metrics
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it attachments simply have no previews
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Downscaled copies of image attachments, generated in a background pool after the upload
+# has been committed and stored next to the blob: blobs/aa/bb/<sha256>.<variant>.jpg. Derived
+# files share the blob's content addressing, so an image uploaded to ten defects is processed
+# once, and garbage collection removes them together with the blob (see backend/storage.py).
+VARIANTS = {
+    "thumbnail": int(os.getenv("THUMBNAIL_SIZE", "256")),
+    "preview": int(os.getenv("PREVIEW_SIZE", "1280")),
+}
+JPEG_QUALITY = int(os.getenv("THUMBNAIL_JPEG_QUALITY", "80"))
+# Pillow releases the GIL while decoding and resampling, so threads scale across cores
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Images waiting for a worker; uploads beyond this are not queued and get their previews
+# generated on first request instead
+THUMBNAIL_QUEUE_SIZE = int(os.getenv("THUMBNAIL_QUEUE_SIZE", "100"))
+# Hard limit including images requested for preview; requests beyond it get 503
+THUMBNAIL_MAX_PENDING = int(os.getenv("THUMBNAIL_MAX_PENDING", "200"))
+# How long a preview request waits for a missing preview to be generated
+THUMBNAIL_WAIT_SECONDS = float(os.getenv("THUMBNAIL_WAIT_SECONDS", "10"))
+# Larger images are refused (decompression bombs)
+THUMBNAIL_MAX_PIXELS = int(os.getenv("THUMBNAIL_MAX_PIXELS", str(100_000_000)))
+
+MEDIA_TYPE = "image/jpeg"
+FAILED_SUFFIX = ".failed"
+# Types Pillow decodes; SVG and the like are left alone
+IMAGE_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp", "image/tiff"}
+
+GENERATION_DURATION = metrics.REGISTRY.register(metrics.Histogram(
+    "thumbnail_generation_seconds", "Time to decode an image and write its previews", ("result",),
+    (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+))
+
+class PoolFull(Exception):
+    pass
+
+def available() -> bool:
+    return Image is not None
+
+def is_image(media_type: Optional[str]) -> bool:
+    return media_type in IMAGE_TYPES
+
+def variant_path(blob_path: str, variant: str) -> str:
+    return f"{blob_path}.{variant}.jpg"
+
+def _failed_path(blob_path: str) -> str:
+    return blob_path + FAILED_SUFFIX
+
+def _save(image, path: str) -> None:
+    tmp_path = path + ".tmp"
+    image.save(tmp_path, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    os.replace(tmp_path, path)
+
+def generate(blob_path: str) -> bool:
+    """Writes every variant of the image at blob_path. Returns False if it is not a readable image."""
+    start = time.perf_counter()
+    try:
+        with Image.open(blob_path) as image:
+            if image.width * image.height > THUMBNAIL_MAX_PIXELS:
+                raise ValueError(f"{image.width}x{image.height} image is too large")
+            largest = max(VARIANTS.values())
+            # JPEG only: decode at 1/2, 1/4 or 1/8 scale when that is still at least `largest`
+            image.draft("RGB", (largest, largest))
+            image = ImageOps.exif_transpose(image)
+            if image.mode != "RGB":
+                # Transparent areas become white; JPEG has no alpha
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, "white")
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            # Largest first, each variant downscaled from the previous one
+            for variant, size in sorted(VARIANTS.items(), key=lambda item: -item[1]):
+                image.thumbnail((size, size), Image.Resampling.LANCZOS)
+                _save(image, variant_path(blob_path, variant))
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning("Could not generate previews for %s: %s", blob_path, e)
+        # Remembered so that preview requests do not retry a broken image over and over
+        # (unless the blob was deleted meanwhile)
+        if os.path.exists(blob_path):
+            with open(_failed_path(blob_path), "w"):
+                pass
+        GENERATION_DURATION.observe(time.perf_counter() - start, "failed")
+        return False
+    GENERATION_DURATION.observe(time.perf_counter() - start, "ok")
+    return True
+
+class ThumbnailPool:
+    def __init__(self, workers: int = THUMBNAIL_WORKERS, queue_size: int = THUMBNAIL_QUEUE_SIZE, max_pending: int = THUMBNAIL_MAX_PENDING):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_pending = max_pending
+        self.skipped = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # blob path -> pending generation; the same image uploaded twice is processed once
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def submit(self, blob_path: str, force: bool = False) -> Optional[Future]:
+        # Never blocks: returns None when the queue is full or Pillow is missing. force (a preview
+        # request waiting for the image) goes past queue_size but raises PoolFull at max_pending.
+        if not available():
+            return None
+        with self._lock:
+            future = self._pending.get(blob_path)
+            if future is not None:
+                return future
+            if len(self._pending) >= (self.max_pending if force else self.queue_size):
+                self.skipped += 1
+                if force:
+                    raise PoolFull(f"{len(self._pending)} images are waiting for previews")
+                return None
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="thumbnail")
+            future = self._pending[blob_path] = self._executor.submit(generate, blob_path)
+        future.add_done_callback(lambda _: self._done(blob_path))
+        return future
+
+    def _done(self, blob_path: str) -> None:
+        with self._lock:
+            self._pending.pop(blob_path, None)
+
+    def wait(self) -> None:
+        # Blocks until everything submitted so far is done (tests, benchmarks)
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.result()
+
+pool = ThumbnailPool()
+
+metrics.REGISTRY.register(metrics.CallbackMetric("thumbnail_queue_depth", "Images waiting for preview generation", pool.pending))
+
+def schedule(blob_path: str, media_type: Optional[str]) -> None:
+    if is_image(media_type) and not os.path.exists(variant_path(blob_path, "thumbnail")):
+        pool.submit(blob_path)
+
+def get_variant(blob_path: str, variant: str, timeout: float = THUMBNAIL_WAIT_SECONDS) -> Optional[str]:
+    """
+    Path of the variant, generating it first if needed; None if the image has no previews. Raises
+    PoolFull, or concurrent.futures.TimeoutError when the image is not done within timeout.
+    """
+    path = variant_path(blob_path, variant)
+    if os.path.exists(path):
+        return path
+    if os.path.exists(_failed_path(blob_path)) or not os.path.exists(blob_path):
+        return None
+    future = pool.submit(blob_path, force=True)
+    if future is None:
+        return None
+    future.result(timeout=timeout)
+    return path if os.path.exists(path) else None
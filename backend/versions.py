@@ -0,0 +1,87 @@
+from datetime import datetime, timezone
+from itertools import chain
+from typing import Iterable, Optional, Sequence, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Per-table data versions for response caching and ETags.
+# Every transaction that writes to a tracked table bumps that table's row in data_versions once,
+# inside the same transaction, so readers on any worker see the version change together with the
+# data. ORM flushes and Session.execute(insert/update/delete) are both covered; writes that bypass
+# the Session (raw SQL, other programs) are not.
+# The written tables are collected during the transaction and bumped by one upsert right before
+# COMMIT, in table name order: on PostgreSQL the row locks are then held only for the commit
+# itself and are always taken in the same order, so concurrent writers cannot deadlock on them.
+# Commits that write the same table still pass through its row one at a time.
+TRACKED_TABLES = frozenset({"defects", "projects", "comments", "attachments"})
+
+VERSIONS = models.DataVersion.__table__
+
+_TOUCHED = "versions_touched"
+
+def touch(session: Session, tables: Iterable[str]) -> None:
+    # Records the write; the version itself is bumped at commit
+    touched = set(tables) & TRACKED_TABLES
+    if touched:
+        session.info.setdefault(_TOUCHED, set()).update(touched)
+
+def _bump(session: Session, tables: Iterable[str]) -> None:
+    pending = sorted(tables)
+    connection = session.connection()
+    upsert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    now = datetime.now(timezone.utc)
+    stmt = upsert(VERSIONS)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["table_name"], set_={"version": VERSIONS.c.version + 1, "updated_at": stmt.excluded.updated_at}
+    )
+    connection.execute(stmt, [{"table_name": name, "version": 1, "updated_at": now} for name in pending])
+
+def current(db: Session, tables: Sequence[str]) -> Tuple[Tuple[str, int, Optional[datetime]], ...]:
+    # ((table, version, updated_at), ...) in the order given; tables never written report version 0
+    rows = {
+        name: (version, updated_at)
+        for name, version, updated_at in db.execute(
+            select(VERSIONS.c.table_name, VERSIONS.c.version, VERSIONS.c.updated_at).where(VERSIONS.c.table_name.in_(list(tables)))
+        )
+    }
+    return tuple((name, *rows.get(name, (0, None))) for name in tables)
+
+def last_modified(state: Sequence[Tuple[str, int, Optional[datetime]]]) -> Optional[datetime]:
+    stamps = [updated_at for _, _, updated_at in state if updated_at is not None]
+    if not stamps:
+        return None
+    # SQLite hands DateTime(timezone=True) back naive; the stored values are UTC
+    return max(stamp if stamp.tzinfo else stamp.replace(tzinfo=timezone.utc) for stamp in stamps)
+
+def tag(state: Sequence[Tuple[str, int, Optional[datetime]]]) -> str:
+    # The timestamp keeps tags unique even if the counters restart (e.g. after restoring a backup)
+    return ",".join(f"{name}:{version}:{updated_at.timestamp() if updated_at else 0}" for name, version, updated_at in state)
+
+@event.listens_for(Session, "after_flush")
+def _touch_flushed(session, flush_context):
+    touch(session, {obj.__table__.name for obj in chain(session.new, session.dirty, session.deleted)})
+
+@event.listens_for(Session, "do_orm_execute")
+def _touch_executed(orm_execute_state):
+    # Bulk paths: insert(Defect) with executemany, query(...).update(), delete(...)
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if getattr(table, "name", None) in TRACKED_TABLES:
+            touch(orm_execute_state.session, [table.name])
+
+@event.listens_for(Session, "before_commit")
+def _bump_touched(session):
+    # Changes still pending are flushed (and recorded) first; commit would flush them after this hook
+    session.flush()
+    touched = session.info.pop(_TOUCHED, None)
+    if touched:
+        _bump(session, touched)
+
+@event.listens_for(Session, "after_transaction_end")
+def _reset(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_TOUCHED, None)